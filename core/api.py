@@ -24,6 +24,8 @@ THE SOFTWARE.
 
 # These will be wired in oxide.py
 apply_tags                 = None
+cache_clear                = None
+cache_stats                = None
 collection_names           = None
 collection_cids            = None
 create_collection          = None
@@ -31,6 +33,7 @@ delete_collection_by_cid   = None
 delete_collection_by_name  = None
 documentation              = None
 exists                     = None
+exists_many                = None
 expand_oids                = None
 flush_oid                  = None
 flush_module               = None
@@ -38,12 +41,14 @@ get_cid_from_oid_list      = None
 get_cid_from_name          = None
 get_colname_from_oid       = None
 get_field                  = None
+get_memberships            = None
 get_names_from_oid         = None
 get_oids_with_name         = None
 get_oid_from_data          = None
 get_tags                   = None
 import_file                = None
 import_directory           = None
+io_stats                   = None
 local_available_data       = None
 local_count_records        = None
 local_delete_data          = None
@@ -52,16 +57,25 @@ local_exists               = None
 local_retrieve             = None
 local_retrieve_all         = None
 local_store                = None
+lock_stats                 = None
 load_reference             = None
+metrics_stats              = None
 models_dir                 = None
 modules_list               = None
 retrieve                   = None
 retrieve_all_keys          = None
+retrieve_many              = None
 libraries_dir              = None
 scratch_dir                = None
 source                     = None
+startup_stats              = None
 store                      = None
+store_many                 = None
+store_raw                  = None
 process                    = None
+progress_stats             = None
+raw_data                   = None
 tag_filter                 = None
+time_filter                = None
 valid_oids                 = None
     
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+"""
+In-process LRU cache of module results keyed on (module, oid, mangle suffix).
+
+Results are kept pickled, so every get() unpickles a fresh copy and a caller
+that modifies what it got back (e.g. pops a name off the names set of
+file_meta) cannot change what the next caller sees. A result that cannot be
+pickled is not cached. Unpickling from memory still skips the datastore read
+and decompression.
+"""
+
+import cPickle, logging
+from collections import OrderedDict
+
+name = "cache"
+logger = logging.getLogger(name)
+
+
+class lru_cache:
+    def __init__(self, max_bytes, enabled=True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.entries = OrderedDict() # key -> (pickled data, size), oldest first
+        self.by_oid = {}             # (mod_name, oid) -> set of keys
+        self.by_mod = {}             # mod_name -> set of keys
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, mod_name, oid, suffix):
+        """ Returns the cached data or None on a miss
+        """
+        if not self.enabled:
+            return None
+        key = (mod_name, oid, suffix)
+        try:
+            data, size = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = (data, size) # Move to the most recently used end
+        self.hits += 1
+        return cPickle.loads(data)
+
+    def put(self, mod_name, oid, suffix, data):
+        if not self.enabled or data is None:
+            return
+        key = (mod_name, oid, suffix)
+        try:
+            data = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError), err:
+            logger.debug("Not caching %s %s: %s", mod_name, oid, err)
+            return
+        size = len(data)
+        if size > self.max_bytes:
+            logger.debug("Not caching %s %s, %d bytes is over the cache size", mod_name, oid, size)
+            return
+        self._remove(key)
+        self.entries[key] = (data, size)
+        self.by_oid.setdefault((mod_name, oid), set()).add(key)
+        self.by_mod.setdefault(mod_name, set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key = next(iter(self.entries))
+            self._remove(old_key)
+            self.evictions += 1
+
+    def invalidate(self, mod_name, oid=None):
+        """ Drop every cached result for mod_name, or only those for the
+            given oid under any options.
+        """
+        if oid is None:
+            keys = self.by_mod.get(mod_name, ())
+        else:
+            keys = self.by_oid.get((mod_name, oid), ())
+        for key in list(keys):
+            self._remove(key)
+
+    def invalidate_oid(self, oid):
+        """ Drop every cached result for oid across all modules
+        """
+        for mod_name, o in [ k for k in self.by_oid if k[1] == oid ]:
+            self.invalidate(mod_name, oid)
+
+    def clear(self):
+        self.entries.clear()
+        self.by_oid.clear()
+        self.by_mod.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"hits"     :self.hits,
+                "misses"   :self.misses,
+                "evictions":self.evictions,
+                "entries"  :len(self.entries),
+                "bytes"    :self.size,
+                "max_bytes":self.max_bytes}
+
+    def _remove(self, key):
+        if key not in self.entries:
+            return
+        data, size = self.entries.pop(key)
+        self.size -= size
+        mod_name, oid = key[0], key[1]
+        self.by_oid[(mod_name, oid)].discard(key)
+        if not self.by_oid[(mod_name, oid)]:
+            del self.by_oid[(mod_name, oid)]
+        self.by_mod[mod_name].discard(key)
+        if not self.by_mod[mod_name]:
+            del self.by_mod[mod_name]
@@ -0,0 +1,152 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+
+name = "catalog"
+logger = logging.getLogger(name)
+
+import api, journaled
+
+# The catalog keeps the metadata of every collection so that names and cids
+# are resolved without loading a single member list, and the reverse of the
+# collections records so that membership questions only touch the
+# collections involved. It is a journaled.index in the datastore dir:
+#   {"cids":{cid: collections_meta record}, "names":{name: cid},
+#    "members":{oid: set of cids holding it}}
+# where "names" is derived on load and not saved. Creating, deleting,
+# pruning and renaming collections append ("add", cid, meta, oid_list) or
+# ("discard", cid, oid_list) to the journal, so a change costs the oids it
+# touches. A missing index is rebuilt from the collections_meta and
+# collections records.
+
+def get_catalog(index_dir):
+    """ Returns ({cid: meta}, {name: cid}) for the catalog in index_dir """
+    data = index.get(index_dir)
+    return data["cids"], data["names"]
+
+def get_members(index_dir):
+    """ Returns {oid: set of cids} for the catalog in index_dir """
+    return index.get(index_dir)["members"]
+
+def get_meta(index_dir, cid):
+    return get_catalog(index_dir)[0].get(cid)
+
+def get_cid(index_dir, col_name):
+    return get_catalog(index_dir)[1].get(col_name)
+
+def containing(index_dir, oid):
+    """ Returns the cids of the collections holding oid """
+    return list(get_members(index_dir).get(oid, ()))
+
+def memberships(index_dir, oid_list, exclude=()):
+    """ Returns {cid: [oids of oid_list in it]} for the collections holding
+        any of oid_list, leaving out the cids in exclude
+    """
+    members = get_members(index_dir)
+    result = {}
+    seen = set()
+    for oid in oid_list:
+        if oid in seen:
+            continue
+        seen.add(oid)
+        for cid in members.get(oid, ()):
+            if cid not in exclude:
+                result.setdefault(cid, []).append(oid)
+    return result
+
+def add(index_dir, cid, meta, oid_list):
+    meta = {"name":meta["name"], "num_oids":meta["num_oids"], "notes":meta["notes"]}
+    index.append(index_dir, [("add", cid, meta, list(oid_list))])
+    return True
+
+def discard(index_dir, cid, oid_list=None):
+    """ Drop cid from the catalog. oid_list is what the collection held, the
+        members are searched if it is not given. Nothing is searched for an
+        id that is not a collection in the catalog.
+    """
+    if oid_list is None:
+        if cid not in get_catalog(index_dir)[0]:
+            return True
+        oid_list = [ oid for oid, cids in get_members(index_dir).iteritems() if cid in cids ]
+    index.append(index_dir, [("discard", cid, None, list(oid_list))])
+    return True
+
+def replay(data, record):
+    """ Apply one journal record to data """
+    op, cid, meta, oid_list = record
+    old = data["cids"].pop(cid, None)
+    if old and data["names"].get(old["name"]) == cid:
+        del data["names"][old["name"]]
+    members = data["members"]
+    if op == "add":
+        data["cids"][cid] = meta
+        data["names"][meta["name"]] = cid
+        for oid in oid_list:
+            members.setdefault(oid, set()).add(cid)
+        return
+    for oid in oid_list:
+        if cid in members.get(oid, ()):
+            members[oid].discard(cid)
+            if not members[oid]:
+                del members[oid]
+
+def build():
+    """ Read the catalog from the collections_meta and collections records """
+    logger.debug("Building the collection catalog")
+    data = {"cids":{}, "names":{}, "members":{}}
+    for cid in api.retrieve_all_keys("collections_meta") or []:
+        meta = api.retrieve("collections_meta", cid)
+        if isinstance(meta, dict) and "name" in meta:
+            data["cids"][cid] = {"name":meta["name"], "num_oids":meta.get("num_oids"),
+                                 "notes":meta.get("notes", "")}
+    data["names"] = name_index(data["cids"])
+    for cid in api.retrieve_all_keys("collections") or []:
+        d = api.retrieve("collections", cid)
+        if not isinstance(d, dict) or "oid_list" not in d:
+            continue
+        for oid in d["oid_list"]:
+            data["members"].setdefault(oid, set()).add(cid)
+    return data
+
+def name_index(cids):
+    return dict( (meta["name"], cid) for cid, meta in cids.iteritems() )
+
+def dump(data):
+    return dict(cids=data["cids"], members=data["members"])
+
+def restore(saved):
+    if not isinstance(saved, dict) or "cids" not in saved or "members" not in saved:
+        return None
+    saved["names"] = name_index(saved["cids"])
+    return saved
+
+def reset(index_dir):
+    """ Drop the catalog so it is rebuilt on the next lookup """
+    index.reset(index_dir)
+
+def cleanup_state():
+    index.cleanup_state()
+
+index = journaled.index("collections", replay, build, dump=dump, restore=restore)
@@ -22,13 +22,19 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import logging, xmlrpclib
-import sys_utils
+import os, sys, time, logging, xmlrpclib, socket, threading
+import sys_utils, otypes
+import core.config as config
 from SimpleXMLRPCServer import SimpleXMLRPCServer
 
 name = "client"
 logger = logging.getLogger(name)
 
+# Binary transport connections are kept open and reused by every call to the
+# same server from this process.
+#   binary_proxies: (pid, ip, port) => binary_proxy
+binary_proxies = {}
+
 class proxy_wrapper:
     def __init__(self, proxy):
         methods = proxy.system.listMethods()
@@ -39,7 +45,132 @@ class proxy_wrapper:
             else:
                 setattr(self, m, decode(getattr(proxy, m)))
 
-def get_proxy(server_ip, server_port, wrapped=False):
+class binary_proxy:
+    """ A connection to a server on the binary transport. Calling a method
+        sends it and waits for its result, pipeline() sends several calls
+        before reading their results. Arguments and results are plain
+        python values, there is nothing to pack or unpack.
+    """
+    def __init__(self, server_ip, server_port, timeout=None):
+        self.address = (server_ip, int(server_port))
+        if timeout is None:
+            timeout = config.distributed_timeout
+        self.timeout = timeout or None # Seconds to wait on the server
+        self.sock = None
+        self.rfile = None
+        self.last_used = 0
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.system = _binary_system(self)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        def call(*args, **kwargs):
+            return self.pipeline([(method, args, kwargs)])[0]
+        call.__name__ = method
+        return call
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address, self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+
+    def close(self):
+        if self.sock:
+            self.rfile.close()
+            self.sock.close()
+        self.sock = None
+        self.rfile = None
+
+    def pipeline(self, calls):
+        """ Send every (method, args, kwargs) in calls, then read the results
+            back in order. Raises RemoteError for the first call that failed
+            on the server once all of the results are in. A server that is
+            silent for longer than the timeout raises socket.timeout, and a
+            call that could not be sent raises the sender's error.
+        """
+        with self.lock:
+            if self.sock and self.timeout and time.time() - self.last_used > self.timeout / 2.0:
+                # The server drops connections idle for its own timeout
+                self.close()
+            if not self.sock:
+                self.connect()
+            requests = []
+            for method, args, kwargs in calls:
+                self.next_id += 1
+                requests.append((self.next_id, method, tuple(args), kwargs))
+            sender = None
+            failed = []
+            try:
+                if len(requests) == 1:
+                    sys_utils.send_message(self.sock, requests[0])
+                else:
+                    # Send from a thread so the server is never blocked
+                    # writing results that nobody reads yet
+                    sender = threading.Thread(target=self._send_all, args=(requests, failed))
+                    sender.daemon = True
+                    sender.start()
+                results = []
+                error = None
+                for request in requests:
+                    req_id, ok, result = sys_utils.recv_message(self.rfile)
+                    if req_id != request[0]:
+                        raise EOFError("Response %s out of order, expected %s" % (req_id, request[0]))
+                    if not ok and not error:
+                        error = "%s on %s:%s: %s" % (request[1], self.address[0], self.address[1], result)
+                    results.append(result)
+            except (socket.error, EOFError):
+                exc_info = sys.exc_info()
+                if sender:
+                    # A sender that stopped first closed the connection under
+                    # us, its error is the one to report
+                    failed = failed[:]
+                    self._shutdown()
+                    sender.join()
+                self.close()
+                if failed:
+                    exc_info = failed[0]
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if sender:
+                sender.join()
+            self.last_used = time.time()
+        if error:
+            raise otypes.RemoteError(error)
+        return results
+
+    def _send_all(self, requests, failed):
+        try:
+            for request in requests:
+                sys_utils.send_message(self.sock, request)
+        except Exception:
+            logger.error("Not able to send to %s:%s: %s", self.address[0], self.address[1], sys.exc_info()[1])
+            failed.append(sys.exc_info())
+            # The server will not answer what was never sent, wake the reader
+            self._shutdown()
+
+    def _shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+class _binary_system:
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def listMethods(self):
+        return getattr(self.proxy, "system.listMethods")()
+
+def get_proxy(server_ip, server_port, wrapped=False, transport=None):
+    """ Returns a proxy for the server on server_ip:server_port, or None if
+        it is not alive. A wrapped xmlrpc proxy packs and unpacks the values
+        for each call, binary proxies always take and return plain values.
+    """
+    if not transport:
+        transport = config.distributed_transport
+    if transport == "binary":
+        return get_binary_proxy(server_ip, server_port)
     server_string = "http://" + server_ip + ":" + str(server_port)
     my_proxy = xmlrpclib.ServerProxy(server_string, allow_none=True)
     if not my_proxy.alive():
@@ -51,6 +182,20 @@ def get_proxy(server_ip, server_port, wrapped=False):
         return proxy_wrapper(my_proxy) 
     return my_proxy  
 
+def get_binary_proxy(server_ip, server_port):
+    key = (os.getpid(), server_ip, int(server_port))
+    if key not in binary_proxies:
+        proxy = binary_proxy(server_ip, server_port)
+        if not proxy.alive():
+            logger.error("Not able to connect to server %s:%s", server_ip, server_port)
+            return None
+        logger.debug("Connect to server %s:%s", server_ip, server_port)
+        binary_proxies[key] = proxy
+    return binary_proxies[key]
+
+def is_binary(proxy):
+    return isinstance(proxy, binary_proxy)
+
 def decode_file(f):
     def wrapper(*args, **kwargs):
         try:
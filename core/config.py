@@ -58,12 +58,25 @@ logging_defaults = {"level":"INFO",
 verbosity_defaults = {"level":"WARN"}
 
 multiproc_defaults = {"on":"False",
+                      "schedule":"True", # compute declared deps a level at a time
                       "max":"3"}
 
 file_defaults = {"max":"1024",
-                 "process_unrecognized_formats":"false"}
+                 "process_unrecognized_formats":"false",
+                 "import_threads":"4",  # files hashed and written at once by import_directory
+                 "import_inflight":"256"} # MB of files being imported at once
+
+datastore_defaults = {"backend":"filesystem", # filesystem or sqlite
+                      "revalidate":"True",     # stat module dirs to catch writes by other processes
+                      "decode_threads":"1"}    # threads used to read and decode bulk retrieves
+
+cache_defaults = {"on":"True",
+                  "max":"256"} # MB of module results kept in memory
 
 distributed_defaults = {"port":"8000",
+                        "transport":"xmlrpc", # xmlrpc or binary
+                        "sample_cache_max":"4096", # MB of samples a compute node keeps
+                        "timeout":"3600", # seconds a binary transport connection waits on a silent peer, 0 waits forever
                         "compute_nodes":"localhost"}
 
 dev_mode = {"enable": "True"}
@@ -81,6 +94,8 @@ all_defaults = {"dir"        :dir_defaults,
                 "verbosity"  :verbosity_defaults, 
                 "multiproc"  :multiproc_defaults,
                 "file"       :file_defaults,
+                "datastore"  :datastore_defaults,
+                "cache"      :cache_defaults,
                 "distributed":distributed_defaults,
                 "dev_mode"   :dev_mode,
                 "django"     :django,
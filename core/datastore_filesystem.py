@@ -22,14 +22,13 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import os, shutil, cPickle, logging, time, errno
-from glob import glob
+import os, shutil, cPickle, logging
 
 name = "ds_filesystem"
 import ologger
 logger = logging.getLogger(name)
 
-import sys_utils, config, api
+import sys_utils, config, api, lock_manager
 from options import build_suffix
 from options import parse_suffix
 
@@ -39,37 +38,51 @@ scratch_dir = config.dir_scratch
 sys_utils.assert_dir_exists(scratch_dir)
 
 COMPONENT_DELIM = '.' # separates oid from mangle opts
+RAW_EXT = ".raw"      # raw data of a module is under <mod_name>.raw
+decode_threads = config.datastore_decode_threads # used by retrieve_many
+io_metrics = dict(read=0, written=0) # bytes of records and raw data this process moved
 
 
 ############# MAIN FUNCTIONS ###################################################
 
 def store(mod_name, oid, data, opts, block=True):
+    return store_many(mod_name, {oid:data}, opts, block)
+
+def store_many(mod_name, data_dict, opts, block=True):
+    """ Store data_dict[oid] for each oid with the same opts. Returns False if
+        any of them could not be stored.
+    """
     mod_dir = get_mod_dir(mod_name)
     sys_utils.assert_dir_exists(mod_dir)
-
-    acquire_file_lock(mod_name, oid, opts, write=True)
-
+    suffix = build_suffix(mod_name, opts)
     tempfile = os.path.join(datastore_dir, "TMP"+str(os.getpid())+mod_name)
-    filename = get_fullpath(mod_dir, mod_name, oid, opts)
-    logger.debug("Storing data at %s", filename)
 
     return_val = True
+    stored = []
+    for oid, data in data_dict.iteritems():
+        acquire_file_lock(mod_name, oid, opts, write=True)
+        store_name = join_store_name(oid, suffix)
+        filename = os.path.join(mod_dir, store_name)
+        logger.debug("Storing data at %s", filename)
+
+        if not sys_utils.write_object_to_file(tempfile, data):
+            logger.error("Not able to store data at %s", filename)
+            return_val = False
+        try:
+            # Need to do this for windows becuase you cannot rename to an existing file.
+            # FIXME: is there any way to do this only if we know we are on windows?
+            #if os.path.isfile(filename):
+            #    os.remove(filename)
+            io_metrics["written"] += file_size(tempfile)
+            os.rename(tempfile, filename)
+            stored.append(store_name)
+        except:
+            logger.error("Not able to rename tempfile to %s", filename)
+            return_val = False
+        logger.debug("Releasing " + filename)
+        release_file_lock(mod_name, oid, opts)
 
-    if not sys_utils.write_object_to_file(tempfile, data):
-        logger.error("Not able to store data at %s", filename)
-        return_val = False
-    try:
-        # Need to do this for windows becuase you cannot rename to an existing file.
-        # FIXME: is there any way to do this only if we know we are on windows?
-        #if os.path.isfile(filename):
-        #    os.remove(filename)
-        os.rename(tempfile, filename)
-    except:
-        logger.error("Not able to rename tempfile to %s", filename)
-        return_val = False
-    logger.debug("Releasing " + filename)
-    release_file_lock(mod_name, oid, opts)
-
+    index_add(mod_name, stored)
     return return_val
 
 def available_data(mod_name):
@@ -114,10 +127,9 @@ def retrieve_all(mod_name):
     return results
 
 def retrieve_all_keys(mod_name):
-    mod_dir = get_mod_dir(mod_name)
-    files = sys_utils.get_files_from_directory(mod_dir)
-    if files:
-        return [ os.path.basename(f) for f in files ]
+    index = get_index(mod_name)
+    if index:
+        return list(index)
     else:
         return None
 
@@ -133,6 +145,7 @@ def retrieve(mod_name, oid, opts={}, lock=False):
     acquire_file_lock(mod_name, oid, opts, write=lock)
 
     data = sys_utils.read_object_from_file(filename)
+    io_metrics["read"] += file_size(filename)
         
     if not lock:
         release_file_lock(mod_name, oid, opts)
@@ -143,38 +156,103 @@ def retrieve(mod_name, oid, opts={}, lock=False):
     
     return data
 
+def retrieve_many(mod_name, oid_list, opts={}, lock=False):
+    """ Returns a dict of oid => data for each oid in oid_list that has data
+        stored with opts. Oids that are missing or can not be read are left
+        out, with lock or without. With lock, every oid returned is left
+        write locked for the caller.
+    """
+    found = exists_many(mod_name, oid_list, opts)
+    oid_list = [ oid for oid in oid_list if found[oid] ]
+    if lock:
+        results = {}
+        for oid in oid_list:
+            lockid = get_lockfilename(mod_name, oid, opts)[0]
+            held = lock_manager.holds(lockid)
+            data = retrieve(mod_name, oid, opts, lock=True)
+            if data is not None:
+                results[oid] = data
+            elif not held and lock_manager.holds(lockid):
+                release_file_lock(mod_name, oid, opts)
+        return results
+
+    # Take all of the read locks up front so the files can be read in parallel,
+    # leaving alone any the caller already holds
+    taken = [ oid for oid in oid_list
+              if not lock_manager.holds(get_lockfilename(mod_name, oid, opts)[0]) ]
+    for oid in taken:
+        acquire_file_lock(mod_name, oid, opts)
+    try:
+        mod_dir = get_mod_dir(mod_name)
+        suffix = build_suffix(mod_name, opts)
+        filenames = [ os.path.join(mod_dir, join_store_name(oid, suffix)) for oid in oid_list ]
+        results = dict(zip(oid_list, sys_utils.thread_map(sys_utils.read_object_from_file,
+                                                          filenames, decode_threads)))
+        io_metrics["read"] += sum( file_size(f) for f in filenames )
+    finally:
+        for oid in taken:
+            release_file_lock(mod_name, oid, opts)
+
+    for oid in results.keys():
+        if results[oid] is None:
+            logger.error("Not able to retrieve data for %s in %s", oid, mod_name)
+            del results[oid]
+    return results
+
 def count_records(mod_name):
-    mod_dir = get_mod_dir(mod_name)
-    if not os.path.isdir(mod_dir):
+    index = get_index(mod_name)
+    if index is None:
         return 0
 
-    logger.debug("Determining number of items in %s", mod_dir)
-    return len(os.listdir(mod_dir))
+    logger.debug("Determining number of items in %s", mod_name)
+    return len(index)
 
 def exists(mod_name, oid, opts={}):
-    os.listdir(datastore_dir) # NFS weirdness
+    logger.debug("Determining if data exists for %s in %s", oid, mod_name)
+    return exists_many(mod_name, [oid], opts)[oid]
+
+def exists_many(mod_name, oid_list, opts={}):
+    """ Returns a dict of oid => True/False for each oid in oid_list
+    """
+    index = get_index(mod_name)
+    if index is None:
+        return dict.fromkeys(oid_list, False)
     mod_dir = get_mod_dir(mod_name)
-    if not os.path.isdir(mod_dir):
-        return False
-    filename = get_fullpath(mod_dir, mod_name, oid, opts)
-    logger.debug("Determining if data exists at %s", filename)
-    return os.path.isfile(filename)
+    suffix = build_suffix(mod_name, opts)
+    results = {}
+    for oid in oid_list:
+        store_name = join_store_name(oid, suffix)
+        if store_name in index:
+            results[oid] = True
+        elif revalidate_index:
+            results[oid] = False # The index is current as of the directory mtime
+        # Another process may have stored it since the index was built
+        elif os.path.isfile(os.path.join(mod_dir, store_name)):
+            index.add(store_name)
+            results[oid] = True
+        else:
+            results[oid] = False
+    return results
 
-def delete_module_data(mod_name):
+def delete_module_data(mod_name, keep_raw=False):
     """ Remove all stored data for a given module
     """
+    if not keep_raw:
+        delete_raw(mod_name)
     files = retrieve_all_keys(mod_name)
     if not files:
         return True
     for fname in files:
         fullpath = os.path.join(datastore_dir, mod_name, fname)
         sys_utils.delete_file(fullpath)
+        index_discard(mod_name, fname)
     return True
         
 def delete_oid_data(mod_name, oid):
     """ Given an oid and the name of a module, remove the data for that
         combination if it exists.
     """
+    delete_raw(mod_name, oid)
     files = retrieve_all_keys(mod_name)
     if not files:
         return True
@@ -182,116 +260,163 @@ def delete_oid_data(mod_name, oid):
         if fname.startswith(oid):
             fullpath = os.path.join(datastore_dir, mod_name, fname)
             sys_utils.delete_file(fullpath)
+            index_discard(mod_name, fname)
     return True
 
 def get_fullpath(mod_dir, mod_name, oid, opts={}):
-    suffix = build_suffix(mod_name, opts)
-    if suffix:
-        store_name = COMPONENT_DELIM.join([oid, suffix])
-    else:
-        store_name = oid
-    filename_fp = os.path.join(mod_dir, store_name)
+    filename_fp = os.path.join(mod_dir, get_store_name(mod_name, oid, opts))
     return filename_fp
 
+def get_store_name(mod_name, oid, opts={}):
+    return join_store_name(oid, build_suffix(mod_name, opts))
+
+def join_store_name(oid, suffix):
+    if suffix:
+        return COMPONENT_DELIM.join([oid, suffix])
+    return oid
+
 def get_mod_dir(mod_name):
     return os.path.join(datastore_dir, mod_name)
 
 def get_lockfilename(modname, oid, opts):
     lockid = oid + '_' + build_suffix(modname, opts) + "_" + modname
-    return lockid, os.path.join(datastore_dir,  lockid+".lock")
-
-############# LOCK FILE FUNCTIONS ################################
-# These could go in sys_utils, but then there's a circular reference problem
-# has lock file ids as keys, with these subkeys:
-#   fp => file pointer/descriptor
-#   mod => module needing lock
-#   oid => oid needing lock
-#   opts => options of  analysis needing lock
-#   suffix => suffix of analysis needing lock (derived from mod,opts)
-#   name => filename of the lockfile
-locked_files = dict()
-
-def acquire_file_lock(modname, oid, opts, write=False, delay=1, timeout=10):
+    return lockid, os.path.join(datastore_dir, modname+".lock")
+
+############# RAW DATA FUNCTIONS ###############################################
+# A module can keep the raw bytes of an oid next to its record, e.g. the
+# contents of an imported file. They are stored uncompressed, one plain file
+# per oid under <datastore_dir>/<mod_name>.raw, so readers can map them into
+# memory and every process shares the same pages of the page cache.
+
+def store_raw(mod_name, oid, filename):
+    """ Move filename into the datastore as the raw bytes of oid
+    """
+    raw_dir = get_raw_dir(mod_name)
+    sys_utils.assert_dir_exists(raw_dir)
+    try:
+        io_metrics["written"] += file_size(filename)
+        shutil.move(filename, os.path.join(raw_dir, oid))
+        return True
+    except (IOError, OSError), err:
+        logger.error("Not able to store raw data for %s in %s: %s", oid, mod_name, err)
+        return False
+
+def retrieve_raw(mod_name, oid):
+    """ Returns a read-only mmap of the raw bytes of oid or None
+    """
+    filename = os.path.join(get_raw_dir(mod_name), oid)
+    if not os.path.isfile(filename):
+        return None
+    data = sys_utils.map_file(filename)
+    if data is not None:
+        io_metrics["read"] += len(data)
+    return data
+
+def delete_raw(mod_name, oid=None):
+    """ Remove the raw bytes of oid, or of every oid if oid is None
+    """
+    raw_dir = get_raw_dir(mod_name)
+    if oid is None:
+        if os.path.isdir(raw_dir):
+            shutil.rmtree(raw_dir, True)
+    elif os.path.isfile(os.path.join(raw_dir, oid)):
+        sys_utils.delete_file(os.path.join(raw_dir, oid))
+    return True
+
+def get_raw_dir(mod_name):
+    return os.path.join(datastore_dir, mod_name + RAW_EXT)
+
+############# EXISTENCE INDEX FUNCTIONS ##########################
+# Maps each module directory to the set of file names stored in it so that
+# exists() is a set lookup instead of a directory listing plus a stat. The
+# index is built on first use and kept current by store and the delete
+# functions. With revalidate_index on, each lookup also stats the module
+# directory and rebuilds the index when another process has changed it.
+# Otherwise a miss is confirmed with a single stat of the result file.
+#   mod_dir => dict(stat=(st_ino, st_mtime), names=set of file names)
+existence_index = dict()
+revalidate_index = config.datastore_revalidate
+
+def get_index(mod_name):
+    """ Returns the set of stored names for mod_name, or None if the module
+        has no directory yet.
+    """
+    mod_dir = get_mod_dir(mod_name)
+    entry = existence_index.get(mod_dir)
+    if entry and not revalidate_index:
+        return entry["names"]
+
+    dir_stat = get_dir_stat(mod_dir)
+    if not dir_stat:
+        existence_index.pop(mod_dir, None)
+        return None
+    if not entry or entry["stat"] != dir_stat:
+        logger.debug("Building existence index for %s", mod_dir)
+        entry = dict(stat=dir_stat, names=set(os.listdir(mod_dir)))
+        existence_index[mod_dir] = entry
+    return entry["names"]
+
+def index_add(mod_name, store_names):
+    mod_dir = get_mod_dir(mod_name)
+    entry = existence_index.get(mod_dir)
+    if entry is None or not store_names:
+        return
+    entry["names"].update(store_names)
+    entry["stat"] = get_dir_stat(mod_dir) # Our own write should not force a rebuild
+
+def index_discard(mod_name, store_name):
+    entry = existence_index.get(get_mod_dir(mod_name))
+    if entry is not None:
+        entry["names"].discard(store_name)
+
+def get_dir_stat(mod_dir):
+    try:
+        st = os.stat(mod_dir)
+        return (st.st_ino, st.st_mtime)
+    except OSError:
+        return None
+
+############# LOCK FUNCTIONS #####################################
+# Locks are fcntl range locks managed by lock_manager, one lock file per module.
+
+def acquire_file_lock(modname, oid, opts, write=False, timeout=10):
     lockid, lockfile = get_lockfilename(modname, oid, opts)
-    logger.debug("Locking %s", lockfile)
-    suffix = build_suffix(modname, opts)
-    
-    start_time = time.time()
-    while True:
-
-        # Since during processing the lockfile name might change and yet fail
-        # to open, get the lockfile fresh every iteration of the loop.
-        lockid, lockfile = get_lockfilename(modname, oid, opts)
-    	try:
-
-            # If we have the lock already.  Just return.
-            if lockid in locked_files:
-                break
-
-            # If someone else is writing, we need to wait.
-            if not os.path.isfile(lockfile+".write"):
-
-                other_read_locks = glob(lockfile+"*")
-                # If someone else is reading...
-                if other_read_locks:
-
-                    # If we want to write, we need to wait
-                    if write:
-                        break
-
-                    # For reading, get the next read lock
-                    lockfile = lockfile + "." + \
-                        str(max([int(s.rsplit('.',1)[-1]) for s in other_read_locks])+1)
-
-                # No one else is reading or writing
-                else:
-                    if write:
-                        lockfile = lockfile + ".write"
-                    else:
-                        lockfile = lockfile + ".0"
-
-                fp = os.open(lockfile, os.O_CREAT|os.O_EXCL|os.O_RDWR)
-                # if we get here, we've got the lock
-                locked_files[lockid] = dict(fp=fp, mod=modname, oid=oid, suffix=suffix, name=lockfile)
-                break
-
-        except OSError, e:
-            if e.errno != errno.EEXIST:
-                logger.error("Unexpected os error trying to get lockfile %s.", lockfile)
-                print "failed:", e
-                raise
-    	    elif (time.time() - start_time) >= timeout:
-                logger.error("File locking timeout on lockfile %s.", lockfile)
-                print "failed:", e
-                raise
-        time.sleep(delay)
+    logger.debug("Locking %s in %s", lockid, lockfile)
+    lock_manager.acquire(lockfile, lockid, write, timeout)
 
 def release_file_lock(modname, oid, opts):
     lockid, lockfile = get_lockfilename(modname, oid, opts)
-    logger.debug("Releasing lock file %s", lockid)
+    lock_manager.release(lockid)
 
-    if lockid in locked_files:
-        os.close(locked_files[lockid]['fp'])
-        os.unlink(locked_files[lockid]['name'])
-        del locked_files[lockid]
+def lock_stats():
+    return lock_manager.stats()
+
+def io_stats():
+    """ Returns the bytes this process read from and wrote to the datastore
+    """
+    return dict(io_metrics)
+
+def file_size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
 
 def cleanup_state():
     """
-    Not implemented. We need a parallel to datastore_cassandra.cleanup_datastore_state()
+    Forget in-memory state about the datastore, e.g. after its directory was
+    removed from under us.
     """
+    existence_index.clear()
     return True 
         
 def cleanup():
     """
-    Purge lingering lockfiles. This function can be used as part of a signal
-    handler.
+    Release any locks this process still holds. This function can be used as
+    part of a signal handler.
     """
     try:
-        for lockid in locked_files.keys():
-            logger.info("Releasing lock file %s PID %d", lockid, os.getpid())
-            os.close(locked_files[lockid]['fp'])
-            os.unlink(locked_files[lockid]['name'])
-            del locked_files[lockid]
+        lock_manager.release_all()
     except:
         pass
 
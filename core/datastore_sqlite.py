@@ -0,0 +1,404 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, time, shutil, cPickle, zlib, sqlite3, logging
+
+name = "ds_sqlite"
+import ologger
+logger = logging.getLogger(name)
+
+import sys_utils, config
+from options import build_suffix
+from options import parse_suffix
+
+datastore_dir = config.dir_datastore
+sys_utils.assert_dir_exists(datastore_dir)
+scratch_dir = config.dir_scratch
+sys_utils.assert_dir_exists(scratch_dir)
+
+COMPONENT_DELIM = '.'   # separates oid from mangle opts, same as ds_filesystem
+DB_EXT = ".sqlite"      # one database file per module under datastore_dir
+RAW_EXT = ".raw"        # raw data of a module is under <mod_name>.raw
+BUSY_TIMEOUT = 30       # seconds sqlite waits on a locked database
+CONTENDED_WAIT = 0.001  # seconds in BEGIN IMMEDIATE that count as contention
+MAX_VARS = 500          # keys per query, below SQLITE_MAX_VARIABLE_NUMBER
+decode_threads = config.datastore_decode_threads # used by retrieve_many
+io_metrics = dict(read=0, written=0) # bytes of records and raw data this process moved
+
+
+############# MAIN FUNCTIONS ###################################################
+
+def store(mod_name, oid, data, opts, block=True):
+    key = get_key(mod_name, oid, opts)
+    logger.debug("Storing data for %s at %s", key, get_db_path(mod_name))
+    try:
+        blob = sqlite3.Binary(serialize(data))
+        con = get_connection(mod_name)
+        con.execute("INSERT OR REPLACE INTO records (key, oid, data) VALUES (?,?,?)",
+                    (key, oid, blob))
+        release_lock(mod_name)
+        io_metrics["written"] += len(blob)
+        return True
+    except (sqlite3.Error, cPickle.PicklingError), err:
+        logger.error("Not able to store data for %s in %s: %s", key, mod_name, err)
+        release_lock(mod_name)
+        return False
+
+def store_many(mod_name, data_dict, opts, block=True):
+    """ Store data_dict[oid] for each oid with the same opts in a single
+        transaction. Returns False if they could not be stored.
+    """
+    suffix = build_suffix(mod_name, opts)
+    logger.debug("Storing %d records at %s", len(data_dict), get_db_path(mod_name))
+    try:
+        rows = [ (join_key(oid, suffix), oid, sqlite3.Binary(serialize(data)))
+                 for oid, data in data_dict.iteritems() ]
+        acquire_lock(mod_name)
+        get_connection(mod_name).executemany(
+            "INSERT OR REPLACE INTO records (key, oid, data) VALUES (?,?,?)", rows)
+        release_lock(mod_name)
+        io_metrics["written"] += sum( len(row[2]) for row in rows )
+        return True
+    except (sqlite3.Error, cPickle.PicklingError), err:
+        logger.error("Not able to store data in %s: %s", mod_name, err)
+        release_lock(mod_name)
+        return False
+
+def available_data(mod_name):
+    """
+    Returns list of (oid, option) pairs
+    """
+    keys = retrieve_all_keys(mod_name)
+    data = list()
+    if not keys:
+        return data
+
+    for key in keys:
+        components = key.split(COMPONENT_DELIM, 1)
+
+        if len(components) == 1: # no options present
+            oid = components[0]
+            opts = {}
+        else: # len must be 2 (assumed)
+            oid, suffix = components
+            opts = parse_suffix(mod_name, suffix)
+
+        data.append ( [oid, opts] )
+
+    return data
+
+def retrieve_all(mod_name):
+    results = {}
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return results
+    for key, blob in con.execute("SELECT key, data FROM records"):
+        results[key] = deserialize(blob)
+    return results
+
+def retrieve_all_keys(mod_name):
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return None
+    keys = [ str(row[0]) for row in con.execute("SELECT key FROM records") ]
+    if keys:
+        return keys
+    else:
+        return None
+
+def retrieve_lock(mod_name, oid, opts):
+    return retrieve(mod_name, oid, opts, lock=True)
+
+def retrieve(mod_name, oid, opts={}, lock=False):
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return None
+    key = get_key(mod_name, oid, opts)
+
+    # A locked retrieve opens a write transaction that is held until the
+    # matching store() commits it, mirroring the .write lock of ds_filesystem.
+    if lock:
+        acquire_lock(mod_name)
+    row = con.execute("SELECT data FROM records WHERE key=?", (key,)).fetchone()
+    if not row:
+        if lock:
+            release_lock(mod_name)
+        return None
+
+    io_metrics["read"] += len(row[0])
+    data = deserialize(row[0])
+    if data == None:
+        logger.error("Not able to retrieve data for %s in %s", key, mod_name)
+        if lock:
+            release_lock(mod_name)
+        return None
+
+    return data
+
+def retrieve_many(mod_name, oid_list, opts={}, lock=False):
+    """ Returns a dict of oid => data for each oid in oid_list that has data
+        stored with opts.
+    """
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return {}
+    # As in retrieve(), a locked retrieve holds one write transaction for the
+    # whole module until store() or store_many() commits it.
+    if lock:
+        acquire_lock(mod_name)
+    rows = select_keys(con, ", data", mod_name, oid_list, opts)
+    if lock and not rows:
+        release_lock(mod_name)
+    blobs = [ row[1] for row in rows ]
+    io_metrics["read"] += sum( len(b) for b in blobs )
+    results = {}
+    for row, data in zip(rows, sys_utils.thread_map(deserialize, blobs, decode_threads)):
+        if data is not None:
+            results[row[0]] = data
+    return results
+
+def count_records(mod_name):
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return 0
+
+    logger.debug("Determining number of items in %s", mod_name)
+    return con.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+def exists(mod_name, oid, opts={}):
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return False
+    key = get_key(mod_name, oid, opts)
+    logger.debug("Determining if data exists for %s in %s", key, mod_name)
+    row = con.execute("SELECT 1 FROM records WHERE key=?", (key,)).fetchone()
+    return row is not None
+
+def exists_many(mod_name, oid_list, opts={}):
+    """ Returns a dict of oid => True/False for each oid in oid_list
+    """
+    results = dict.fromkeys(oid_list, False)
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return results
+    for row in select_keys(con, "", mod_name, oid_list, opts):
+        results[row[0]] = True
+    return results
+
+def delete_module_data(mod_name, keep_raw=False):
+    """ Remove all stored data for a given module
+    """
+    if not keep_raw:
+        delete_raw(mod_name)
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return True
+    con.execute("DELETE FROM records")
+    return True
+
+def delete_oid_data(mod_name, oid):
+    """ Given an oid and the name of a module, remove the data for that
+        combination if it exists.
+    """
+    delete_raw(mod_name, oid)
+    con = get_connection(mod_name, create=False)
+    if not con:
+        return True
+    con.execute("DELETE FROM records WHERE oid=?", (oid,))
+    return True
+
+def get_key(mod_name, oid, opts={}):
+    """ Returns the record key, which is the same string ds_filesystem uses
+        as a file name so keys and available_data() agree between backends.
+    """
+    return join_key(oid, build_suffix(mod_name, opts))
+
+def join_key(oid, suffix):
+    if suffix:
+        return COMPONENT_DELIM.join([oid, suffix])
+    return oid
+
+def select_keys(con, columns, mod_name, oid_list, opts):
+    """ Query the records of oid_list stored with opts, MAX_VARS keys at a
+        time. Returns a list of (oid,)+columns tuples.
+    """
+    suffix = build_suffix(mod_name, opts)
+    keys = dict([ (join_key(oid, suffix), oid) for oid in oid_list ])
+    key_list = keys.keys()
+    rows = []
+    for i in xrange(0, len(key_list), MAX_VARS):
+        chunk = key_list[i:i+MAX_VARS]
+        query = "SELECT key%s FROM records WHERE key IN (%s)" % (columns, ",".join("?"*len(chunk)))
+        rows.extend([ (keys[row[0]],) + tuple(row[1:]) for row in con.execute(query, chunk) ])
+    return rows
+
+def get_db_path(mod_name):
+    return os.path.join(datastore_dir, mod_name + DB_EXT)
+
+############# RAW DATA FUNCTIONS ###############################################
+# Raw bytes are plain files laid out as in ds_filesystem rather than blobs in
+# the database, so that they can be mapped into memory.
+
+def store_raw(mod_name, oid, filename):
+    """ Move filename into the datastore as the raw bytes of oid
+    """
+    raw_dir = get_raw_dir(mod_name)
+    sys_utils.assert_dir_exists(raw_dir)
+    try:
+        io_metrics["written"] += os.path.getsize(filename)
+        shutil.move(filename, os.path.join(raw_dir, oid))
+        return True
+    except (IOError, OSError), err:
+        logger.error("Not able to store raw data for %s in %s: %s", oid, mod_name, err)
+        return False
+
+def retrieve_raw(mod_name, oid):
+    """ Returns a read-only mmap of the raw bytes of oid or None
+    """
+    filename = os.path.join(get_raw_dir(mod_name), oid)
+    if not os.path.isfile(filename):
+        return None
+    data = sys_utils.map_file(filename)
+    if data is not None:
+        io_metrics["read"] += len(data)
+    return data
+
+def delete_raw(mod_name, oid=None):
+    """ Remove the raw bytes of oid, or of every oid if oid is None
+    """
+    raw_dir = get_raw_dir(mod_name)
+    if oid is None:
+        if os.path.isdir(raw_dir):
+            shutil.rmtree(raw_dir, True)
+    elif os.path.isfile(os.path.join(raw_dir, oid)):
+        sys_utils.delete_file(os.path.join(raw_dir, oid))
+    return True
+
+def get_raw_dir(mod_name):
+    return os.path.join(datastore_dir, mod_name + RAW_EXT)
+
+############# SERIALIZATION FUNCTIONS ##########################################
+# Same on-disk encoding as sys_utils.write_object_to_file so blobs can be
+# copied between backends without re-encoding.
+
+def serialize(data):
+    return zlib.compress(cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL), zlib.Z_BEST_SPEED)
+
+def deserialize(blob):
+    try:
+        return cPickle.loads(zlib.decompress(str(blob)))
+    except (zlib.error, cPickle.UnpicklingError), err:
+        logger.error("Not able to deserialize record: %s", err)
+        return None
+
+############# CONNECTION FUNCTIONS #############################################
+# Connections are cached per process and per database path. A connection must
+# never be shared across a fork, so the pid is part of the key.
+connections = dict()
+locked_modules = set()
+
+def get_connection(mod_name, create=True):
+    db_path = get_db_path(mod_name)
+    conkey = (os.getpid(), db_path)
+    if conkey in connections:
+        if os.path.isfile(db_path):
+            return connections[conkey]
+        del connections[conkey] # The database was removed from under us
+
+    if not create and not os.path.isfile(db_path):
+        return None
+
+    sys_utils.assert_dir_exists(datastore_dir)
+    con = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    con.text_factory = str
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("PRAGMA synchronous=NORMAL")
+    con.execute("CREATE TABLE IF NOT EXISTS records "
+                "(key TEXT PRIMARY KEY, oid TEXT NOT NULL, data BLOB)")
+    con.execute("CREATE INDEX IF NOT EXISTS records_oid ON records (oid)")
+    connections[conkey] = con
+    return con
+
+lock_metrics = dict(acquired=0, contended=0, timeouts=0, wait_time=0.0, max_wait=0.0)
+
+def acquire_lock(mod_name):
+    if mod_name in locked_modules:
+        return
+    start_time = time.time()
+    try:
+        get_connection(mod_name).execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError:
+        lock_metrics["timeouts"] += 1
+        raise
+    waited = time.time() - start_time
+    if waited > CONTENDED_WAIT:
+        lock_metrics["contended"] += 1
+    lock_metrics["acquired"] += 1
+    lock_metrics["wait_time"] += waited
+    lock_metrics["max_wait"] = max(lock_metrics["max_wait"], waited)
+    locked_modules.add(mod_name)
+
+def release_lock(mod_name):
+    if mod_name not in locked_modules:
+        return
+    locked_modules.discard(mod_name)
+    get_connection(mod_name).execute("COMMIT")
+
+def lock_stats():
+    """ Returns lock wait metrics for this process, as ds_filesystem does
+    """
+    s = dict(lock_metrics)
+    s["held"] = len(locked_modules)
+    return s
+
+def io_stats():
+    """ Returns the bytes this process read from and wrote to the datastore
+    """
+    return dict(io_metrics)
+
+def cleanup_state():
+    """
+    Not implemented. We need a parallel to datastore_cassandra.cleanup_datastore_state()
+    """
+    return True
+
+def cleanup():
+    """
+    Roll back any write transactions left open by retrieve_lock. This function
+    can be used as part of a signal handler.
+    """
+    try:
+        for mod_name in list(locked_modules):
+            logger.info("Releasing lock on %s PID %d", mod_name, os.getpid())
+            locked_modules.discard(mod_name)
+            get_connection(mod_name).execute("ROLLBACK")
+    except:
+        pass
+
+def register_process():
+    """
+    Called through Pool()'s initializer kw. Connections are created lazily
+    per pid so nothing needs to happen here.
+    """
+    pass
@@ -25,7 +25,6 @@ THE SOFTWARE.
 import logging, xmlrpclib, types, random
 import oxide, oxide_server, api, server
 import multiproc as mp
-from sys_utils import pack, unpack
 from client import get_proxy
 
 name = "distribution_server"
@@ -40,8 +39,7 @@ random.seed()
 print " - Servers list: " + ", ".join(server_list)
 print " - Servers port:", server_port
  
-functions = [oxide_server.encode(getattr(oxide, f)) for f in dir(oxide) if isinstance(getattr(oxide, f), types.FunctionType)]
-functions.extend( [oxide_server.encode(getattr(api, f)) for f in dir(api) if isinstance(getattr(api, f), types.FunctionType)] )
+functions = list(oxide_server.functions)
  
 def get_random_server_ip():
     r = random.randint(0,num_servers-1)
@@ -49,10 +47,6 @@ def get_random_server_ip():
 
 def retrieve(mod_name, oid_list, opts={}):
     proxy_list = []
-    oid_list = unpack(oid_list)
-    mod_name = unpack(mod_name)
-    opts = unpack(opts)
-
     for server_ip in server_list:
         proxy_list.append((server_ip, server_port))
     if not isinstance(oid_list, list):
@@ -64,22 +58,20 @@ def retrieve(mod_name, oid_list, opts={}):
     if new_oid_list:
         mp.multi_map_distrib(proxy_list, mod_name, new_oid_list, opts)
     proxy = get_proxy(server_ip, server_port, wrapped=True)
-    return pack(proxy.retrieve(mod_name, oid_list, opts))
+    return proxy.retrieve(mod_name, oid_list, opts)
     
 def process(mod_name, oid_list, opts={}, force=False):
     proxy_list = []
     for server_ip in server_list:
         proxy_list.append((server_ip, server_port))
-    oid_list = unpack(oid_list)
-    mod_name = unpack(mod_name)
-    opts = unpack(opts)
-    return pack(mp.multi_map_distrib(proxy_list, mod_name, oid_list, opts, True, force))
+    return mp.multi_map_distrib(proxy_list, mod_name, oid_list, opts, True, force)
 
     
 functions.extend([retrieve, process])
 
 def main(my_ip, my_port):
-    if not server.init(my_ip, my_port, functions):
+    if not server.init(my_ip, my_port, functions, oxide.config.distributed_transport,
+                       oxide.config.distributed_timeout):
        print " - Not able to initiate server!"
        return 
     print " Listening on %s:%s" % (my_ip, my_port) 
@@ -0,0 +1,210 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, hashlib, tempfile, threading, Queue, logging
+
+name = "importer"
+logger = logging.getLogger(name)
+
+import sys_utils
+
+CHUNK_SIZE = 1048576     # bytes read, hashed and copied at a time
+PREFIX_SIZE = 65536      # bytes hashed for the duplicate check
+PREFIX_INDEX = "files.prefix" # file under the datastore dir
+
+# Files are read once in CHUNK_SIZE pieces. Each piece is fed to sha1 and
+# copied to a temp file in the datastore dir, so the contents are never held
+# in memory. Once the oid is known the temp file is moved into place as the
+# raw data of the files module.
+#
+# The prefix index maps (size, sha1 of the first PREFIX_SIZE bytes) to the
+# oids already imported with that size and prefix. On a match the file is
+# hashed without being written and only written if the full hash turns out
+# to be new. The index is only a hint, a stale entry costs a second read.
+#   prefix_indexes: index file => {(size, prefix digest): set of oids}
+prefix_indexes = dict()
+
+def stream_file(file_location, tmp_dir, max_file_size, known=None):
+    """ Hash file_location and, unless it looks like an import in known,
+        copy it to a temp file in tmp_dir. Returns a dict with the oid,
+        the temp file (None if not written), the file stat, the size in MB
+        and the prefix key, or None if the file cannot be imported.
+    """
+    file_stat = sys_utils.get_import_stat(file_location, max_file_size)
+    if not file_stat:
+        return None
+    size = file_stat["size"]
+
+    try:
+        fd = file(file_location, 'rb')
+        try:
+            prefix = (size, hashlib.sha1(fd.read(PREFIX_SIZE)).hexdigest())
+            fd.seek(0)
+            tmp = None
+            oid = None
+            if known and prefix in known:
+                oid = copy_file(fd, size, None)
+                if oid not in known[prefix]:
+                    fd.seek(0)
+                    oid = None
+            if not oid:
+                tmp_fd, tmp = tempfile.mkstemp(prefix="TMP", dir=tmp_dir)
+                try:
+                    out = os.fdopen(tmp_fd, 'wb')
+                    try:
+                        oid = copy_file(fd, size, out)
+                    finally:
+                        out.close()
+                except:
+                    os.remove(tmp)
+                    raise
+                if not oid:
+                    os.remove(tmp)
+        finally:
+            fd.close()
+    except IOError, err:
+        logger.error("IOError:%s", err)
+        return None
+
+    if not oid:
+        logger.error("File %s changed while it was imported", file_location)
+        return None
+    return {"oid":oid, "tmp":tmp, "file_stat":file_stat,
+            "size":size/1048576., "prefix":prefix}
+
+def copy_file(fd, size, out):
+    """ Read size bytes from fd, writing them to the file out if it is given.
+        Returns the sha1 hexdigest or None if fd did not have size bytes.
+    """
+    sha1 = hashlib.sha1()
+    count = 0
+    chunk = fd.read(CHUNK_SIZE)
+    while chunk:
+        count += len(chunk)
+        sha1.update(chunk)
+        if out:
+            out.write(chunk)
+        chunk = fd.read(CHUNK_SIZE)
+
+    if count != size:
+        return None
+    return sha1.hexdigest()
+
+def stream_files(files_list, tmp_dir, max_file_size, known=None, nthreads=1, max_inflight=0):
+    """ Generator yielding (file_location, stream_file result) for each file in
+        files_list, in the order they complete. Up to nthreads files are
+        streamed at once and no new file is started while more than
+        max_inflight bytes of files are unfinished or not yet consumed.
+    """
+    if nthreads <= 1 or len(files_list) <= 1:
+        for file_location in files_list:
+            yield file_location, stream_file(file_location, tmp_dir, max_file_size, known)
+        return
+
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+    def worker():
+        while True:
+            file_location = tasks.get()
+            if file_location is None:
+                return
+            try:
+                fd = stream_file(file_location, tmp_dir, max_file_size, known)
+            except:
+                logger.exception("Not able to stream %s", file_location)
+                fd = None
+            results.put((file_location, fd))
+
+    threads = [ threading.Thread(target=worker) for i in xrange(nthreads) ]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    sizes = dict()
+    inflight = [0]
+    def take():
+        file_location, fd = results.get()
+        inflight[0] -= sizes.pop(file_location)
+        return file_location, fd
+
+    try:
+        for file_location in files_list:
+            if file_location in sizes:
+                continue # Same file listed twice
+            try:
+                size = os.path.getsize(file_location)
+            except OSError:
+                size = 0
+            while sizes and inflight[0] + size > max_inflight:
+                yield take()
+            sizes[file_location] = size
+            inflight[0] += size
+            tasks.put(file_location)
+        while sizes:
+            yield take()
+    finally:
+        for t in threads:
+            tasks.put(None)
+        if sizes: # Closed early, drop the temp files of unconsumed results
+            for t in threads:
+                t.join()
+            while not results.empty():
+                file_location, fd = results.get()
+                if fd and fd["tmp"]:
+                    os.remove(fd["tmp"])
+
+############# PREFIX INDEX FUNCTIONS ###########################################
+
+def get_prefix_index(index_dir):
+    """ Returns the prefix index kept in index_dir, loading it on first use """
+    path = os.path.join(index_dir, PREFIX_INDEX)
+    if path not in prefix_indexes:
+        index = None
+        if os.path.isfile(path):
+            index = sys_utils.read_object_from_file(path)
+        prefix_indexes[path] = index or dict()
+    return prefix_indexes[path]
+
+def prefix_add(index_dir, prefix, oid):
+    get_prefix_index(index_dir).setdefault(prefix, set()).add(oid)
+
+def save_prefix_index(index_dir):
+    """ Write the prefix index back, merging in entries saved by other
+        processes since it was loaded.
+    """
+    path = os.path.join(index_dir, PREFIX_INDEX)
+    index = prefix_indexes.get(path)
+    if index is None:
+        return True
+    if os.path.isfile(path):
+        for prefix, oids in (sys_utils.read_object_from_file(path) or {}).iteritems():
+            index.setdefault(prefix, set()).update(oids)
+    tmp = sys_utils.write_object_to_temp(index_dir, index)
+    if not tmp:
+        return False
+    os.rename(tmp, path)
+    return True
+
+def cleanup_state():
+    prefix_indexes.clear()
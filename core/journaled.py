@@ -0,0 +1,181 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, cPickle, tempfile, logging
+
+name = "journaled"
+logger = logging.getLogger(name)
+
+import sys_utils, lock_manager
+
+JOURNAL_MAX = 1048576 # bytes of journal before it is folded into the index
+
+class index:
+    """ An index kept in files under a datastore dir: <name>.index holds the
+        index as of the last fold and <name>.journal the records appended
+        since, so adding to it does not rewrite the whole index each time.
+        Once the journal passes JOURNAL_MAX it is folded into the index file.
+        Every process replays the journal from where it last read, and the
+        lock file <name>.lock keeps writers from interleaving.
+
+        apply(data, record) applies one journal record to data. When build is
+        given the index is derived data: a missing or unreadable index is
+        rebuilt with build() and saved. Otherwise the journal is all there is,
+        and a missing index starts from empty(). dump(data) is what gets
+        saved and restore(saved) makes the data back, or returns None if
+        saved is not a valid index.
+    """
+    def __init__(self, name, apply, build=None, empty=dict, dump=None, restore=None):
+        self.name = name
+        self.index_file = name + ".index"
+        self.journal_file = name + ".journal"
+        self.lock_file = name + ".lock"
+        self.apply = apply
+        self.build = build
+        self.empty = empty
+        self.dump = dump or (lambda data: data)
+        self.restore = restore or (lambda saved: saved if isinstance(saved, dict) else None)
+        # index dir => dict(key=index file stat key, ino=journal inode,
+        #                   offset=journal bytes replayed, data=index)
+        self.states = dict()
+
+    def lock(self, index_dir):
+        lock_manager.acquire(os.path.join(index_dir, self.lock_file), self.index_file, True)
+
+    def unlock(self):
+        lock_manager.release(self.index_file)
+
+    def get(self, index_dir):
+        """ Returns the index for index_dir with the journal replayed """
+        self.lock(index_dir)
+        try:
+            return self.load(index_dir)
+        finally:
+            self.unlock()
+
+    def append(self, index_dir, records):
+        """ Append records to the journal. They are applied when the index is
+            next loaded, so appending does not replay what others appended.
+        """
+        self.lock(index_dir)
+        try:
+            path = os.path.join(index_dir, self.journal_file)
+            buf = "".join( cPickle.dumps(r, cPickle.HIGHEST_PROTOCOL) for r in records )
+            fd = os.open(path, os.O_CREAT|os.O_WRONLY|os.O_APPEND)
+            try:
+                os.write(fd, buf)
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > JOURNAL_MAX:
+                self.save(index_dir, self.load(index_dir))
+        finally:
+            self.unlock()
+
+    def fold(self, index_dir):
+        """ Fold the journal into the index file now """
+        self.lock(index_dir)
+        try:
+            return self.save(index_dir, self.load(index_dir))
+        finally:
+            self.unlock()
+
+    def load(self, index_dir):
+        """ Returns the index for index_dir with the journal replayed, the
+            caller holds the lock
+        """
+        path = os.path.join(index_dir, self.index_file)
+        key = sys_utils.stat_key(path)
+        jpath = os.path.join(index_dir, self.journal_file)
+        try:
+            st = os.stat(jpath)
+        except OSError:
+            st = None
+        state = self.states.get(index_dir)
+        # Folding the journal always writes a new index, so a journal that is
+        # gone or replaced under the same index was reset by another process
+        if (not state or state["key"] != key or
+            (state["ino"] is not None and (not st or st.st_ino != state["ino"]))):
+            data = None
+            if key is not None:
+                data = self.restore(sys_utils.read_object_from_file(path))
+                if data is None:
+                    logger.warning("Index %s unreadable, starting it over", path)
+            if data is None and self.build:
+                self.save(index_dir, self.build())
+                return self.states[index_dir]["data"]
+            if data is None:
+                data = self.empty()
+            state = self.states[index_dir] = dict(key=key, ino=None, offset=0, data=data)
+        if not st:
+            return state["data"]
+        if st.st_ino != state["ino"]:
+            state["ino"], state["offset"] = st.st_ino, 0
+        if st.st_size > state["offset"]:
+            fd = open(jpath, "rb")
+            try:
+                fd.seek(state["offset"])
+                while True:
+                    try:
+                        self.apply(state["data"], cPickle.load(fd))
+                    except EOFError:
+                        break
+                state["offset"] = fd.tell()
+            finally:
+                fd.close()
+        return state["data"]
+
+    def save(self, index_dir, data):
+        """ Write data as the index and start an empty journal, the caller
+            holds the lock
+        """
+        path = os.path.join(index_dir, self.index_file)
+        fd, tmp = tempfile.mkstemp(prefix="TMP", dir=index_dir)
+        os.close(fd)
+        if not sys_utils.write_object_to_file(tmp, self.dump(data)):
+            logger.error("Not able to save the index %s", path)
+            os.remove(tmp)
+            self.states[index_dir] = dict(key=None, ino=None, offset=0, data=data)
+            return False
+        os.rename(tmp, path)
+        jpath = os.path.join(index_dir, self.journal_file)
+        if os.path.isfile(jpath):
+            os.remove(jpath)
+        self.states[index_dir] = dict(key=sys_utils.stat_key(path), ino=None, offset=0, data=data)
+        return True
+
+    def reset(self, index_dir):
+        """ Drop the index and its journal """
+        self.lock(index_dir)
+        try:
+            self.states.pop(index_dir, None)
+            for fname in (self.index_file, self.journal_file):
+                path = os.path.join(index_dir, fname)
+                if os.path.isfile(path):
+                    os.remove(path)
+        finally:
+            self.unlock()
+
+    def cleanup_state(self):
+        self.states.clear()
@@ -23,18 +23,42 @@ THE SOFTWARE.
 """
 
 from __future__ import division
-import collections
-from collections import defaultdict
+import collections, mmap
+from array import array
+from collections import defaultdict, Mapping
+from itertools import izip, chain
 from math import sqrt, log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 name = "histogram"
 
+BYTE_BITS    = 8    # bits per byte in a packed n-gram key
+TOKEN_BITS   = 16   # bits per token id in a packed n-gram key
+MAX_KEY_BITS = 64   # packed keys must fit in a uint64 to be counted with numpy
+BULK_MERGE   = 4096 # merges at least this large go through numpy
+BYTE_TYPES   = (str, mmap.mmap) # inputs counted as strings of bytes
+
 def build_histo(input_list):
+    if numpy is not None and isinstance(input_list, BYTE_TYPES):
+        return build_byte_histo(input_list)
     histo = defaultdict(int)
     for i in input_list:
         histo[i] += 1
     return histo
-    
+
+def build_byte_histo(data):
+    """ Same as build_histo for a string of bytes, but counted with numpy
+    """
+    counts = numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=256)
+    histo = defaultdict(int)
+    for b in numpy.flatnonzero(counts).tolist():
+        histo[chr(b)] = int(counts[b])
+    return histo
+
 def build_ngrams(input_list, n):
     ngrams = defaultdict(int)
     # ngram holds a rotating set of elements constituting the current ngram
@@ -45,13 +69,270 @@ def build_ngrams(input_list, n):
         ngrams[ngram_str] += 1
         del ngram[0]
     return ngrams
-    
+
+def build_sparse_ngrams(input_list, n):
+    """ Same as build_ngrams but returns a sparse_histo. input_list is either
+        a string of bytes or a list of strings such as opcodes.
+    """
+    histo = sparse_histo(n, byte_keys=isinstance(input_list, BYTE_TYPES))
+    histo.count(input_list)
+    return histo
+
+def build_ngram_histo(input_list, n):
+    """ Returns the n-grams of input_list as a sparse_histo when numpy can
+        count them, otherwise as the string keyed dict of build_ngrams. Both
+        read the same way.
+    """
+    histo = sparse_histo(n, byte_keys=isinstance(input_list, BYTE_TYPES))
+    if numpy is None or n*histo.bits() > MAX_KEY_BITS:
+        return build_ngrams(input_list, n)
+    histo.count(input_list)
+    return histo
+
+def merge_histos(histos):
+    """ Returns the sum of a list of histograms. sparse_histos are summed in
+        one pass.
+    """
+    histos = [ h for h in histos if h ]
+    if not histos:
+        return defaultdict(int)
+    if isinstance(histos[0], sparse_histo):
+        out_histo = sparse_histo(histos[0].n, histos[0].byte_keys)
+        out_histo.add_many(histos)
+        return out_histo
+    out_histo = defaultdict(int)
+    for histo in histos:
+        merge_histo(out_histo, histo)
+    return out_histo
+
 def merge_histo(main_histo, new_histo):
+    if isinstance(main_histo, sparse_histo):
+        if new_histo:
+            main_histo.add(new_histo)
+        return main_histo
     if new_histo:
         for i in new_histo:
             main_histo[i] += new_histo[i]
     return main_histo
 
+class sparse_histo(Mapping):
+    """ Compact n-gram histogram.
+
+        Each n-gram is packed into one integer, BYTE_BITS per byte for byte
+        n-grams or TOKEN_BITS per token id for n-grams of interned tokens,
+        and table maps those integers to counts. With numpy the n-grams are
+        counted and large histograms merged with unique/bincount.
+
+        As a read-only mapping it looks like the comma joined string keyed
+        histogram of build_ngrams, so existing consumers keep working.
+    """
+    def __init__(self, n, byte_keys=False):
+        self.n = n
+        self.byte_keys = byte_keys
+        self.vocab = []  # token id => token, unused for byte n-grams
+        self.table = {}  # packed n-gram => count
+        self._ids = None # token => token id, built on demand
+
+    def count(self, input_list):
+        """ Add the n-grams of input_list
+        """
+        n = self.n
+        if len(input_list) < n:
+            return
+        if self.byte_keys:
+            seq = input_list
+        else:
+            seq = [ self.intern(token) for token in input_list ]
+
+        if numpy is not None and n*self.bits() <= MAX_KEY_BITS:
+            if self.byte_keys:
+                ids = numpy.frombuffer(seq, dtype=numpy.uint8).astype(numpy.uint64)
+            else:
+                ids = numpy.array(seq, dtype=numpy.uint64)
+            m = len(ids) - n + 1
+            keys = numpy.zeros(m, dtype=numpy.uint64)
+            for j in xrange(n):
+                keys = (keys << numpy.uint64(self.bits())) | ids[j:j+m]
+            keys, counts = numpy.unique(keys, return_counts=True)
+            self._add_table(dict(izip(keys.tolist(), counts.tolist())))
+            return
+
+        grams = defaultdict(int)
+        if self.byte_keys:
+            for i in xrange(len(seq)-n+1):
+                grams[seq[i:i+n]] += 1
+            table = dict([ (int(g.encode("hex"), 16), c) for g, c in grams.iteritems() ])
+        else:
+            for g in izip(*[ seq[j:] for j in xrange(n) ]):
+                grams[g] += 1
+            table = dict([ (self.pack(g), c) for g, c in grams.iteritems() ])
+        self._add_table(table)
+
+    def add(self, other):
+        """ Add the counts of other, a sparse_histo or a string keyed histogram
+        """
+        self.add_many([other])
+
+    def add_many(self, others):
+        """ Add the counts of each histogram in others, merging them all at once
+        """
+        tables = [ self._get_table(other) for other in others ]
+        n = len(self.table) + sum([ len(t) for t in tables ])
+        if numpy is not None and n >= BULK_MERGE and self.n*self.bits() <= MAX_KEY_BITS:
+            tables.insert(0, self.table)
+            keys = numpy.fromiter(chain(*[ t.iterkeys() for t in tables ]), numpy.uint64, n)
+            counts = numpy.fromiter(chain(*[ t.itervalues() for t in tables ]), numpy.int64, n)
+            keys, inverse = numpy.unique(keys, return_inverse=True)
+            counts = numpy.bincount(inverse, weights=counts).astype(numpy.int64)
+            self.table = dict(izip(keys.tolist(), counts.tolist()))
+            return
+        for table in tables:
+            self._add_table(table)
+
+    def to_dict(self):
+        """ Returns the string keyed histogram
+        """
+        histo = defaultdict(int)
+        for key, c in self.table.iteritems():
+            histo[self.label(key)] = c
+        return histo
+
+    def bits(self):
+        if self.byte_keys:
+            return BYTE_BITS
+        return TOKEN_BITS
+
+    def intern(self, token):
+        ids = self._get_ids()
+        if token not in ids:
+            if len(self.vocab) >= 1 << TOKEN_BITS:
+                raise ValueError("sparse_histo supports at most %d distinct tokens" % (1 << TOKEN_BITS))
+            ids[token] = len(self.vocab)
+            self.vocab.append(token)
+        return ids[token]
+
+    def pack(self, ids):
+        key = 0
+        for i in ids:
+            key = (key << TOKEN_BITS) | i
+        return key
+
+    def unpack(self, key):
+        mask = (1 << self.bits()) - 1
+        return [ (key >> (self.bits()*j)) & mask for j in xrange(self.n-1, -1, -1) ]
+
+    def label(self, key):
+        """ Returns the comma joined n-gram of a packed key
+        """
+        if self.byte_keys:
+            return ",".join(("%0*x" % (2*self.n, key)).decode("hex"))
+        return ",".join([ self.vocab[i] for i in self.unpack(key) ])
+
+    def encode(self, label, add=False):
+        """ Returns the packed key of a comma joined n-gram or None if it is
+            not one. With add, unseen tokens are interned.
+        """
+        if not isinstance(label, str):
+            return None
+        if self.byte_keys:
+            if len(label) != 2*self.n-1 or label[1::2].strip(",") != "":
+                return None
+            return int(label[0::2].encode("hex"), 16)
+        tokens = label.split(",")
+        if len(tokens) != self.n:
+            return None
+        ids = self._get_ids()
+        if add:
+            return self.pack([ self.intern(t) for t in tokens ])
+        if not all([ t in ids for t in tokens ]):
+            return None
+        return self.pack([ ids[t] for t in tokens ])
+
+    ####### DICT COMPATIBLE VIEW #######
+    # Mapping fills in keys, items, values, get, __eq__ and friends
+    def __getitem__(self, label):
+        key = self.encode(label)
+        if key not in self.table:
+            raise KeyError(label)
+        return self.table[key]
+
+    def __contains__(self, label):
+        return self.encode(label) in self.table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        for key in self.table:
+            yield self.label(key)
+
+    def has_key(self, label):
+        return label in self
+
+    def iteritems(self):
+        for key, c in self.table.iteritems():
+            yield self.label(key), c
+
+    ####### PICKLING #######
+    def __getstate__(self):
+        # Pickle the table as two raw arrays rather than a dict when it fits
+        state = dict(n=self.n, byte_keys=self.byte_keys, vocab=self.vocab)
+        if self.n*self.bits() <= array("L").itemsize*8:
+            state["keys"] = array("L", self.table.iterkeys()).tostring()
+            state["counts"] = array("l", self.table.itervalues()).tostring()
+        else:
+            state["table"] = self.table
+        return state
+
+    def __setstate__(self, state):
+        self.n = state["n"]
+        self.byte_keys = state["byte_keys"]
+        self.vocab = state["vocab"]
+        self._ids = None
+        if "table" in state:
+            self.table = state["table"]
+        else:
+            keys, counts = array("L"), array("l")
+            keys.fromstring(state["keys"])
+            counts.fromstring(state["counts"])
+            self.table = dict(izip(keys, counts))
+
+    def _get_table(self, other):
+        """ Returns the counts of other keyed by this histogram's packed keys
+        """
+        if (isinstance(other, sparse_histo) and other.n == self.n
+            and other.byte_keys == self.byte_keys):
+            if self.byte_keys or other.vocab == self.vocab:
+                return other.table
+            return self._translate(other)
+        table = defaultdict(int)
+        for label, c in other.iteritems():
+            table[self.encode(label, True)] += c
+        table.pop(None, None) # Labels that are not n-grams of this kind
+        return table
+
+    def _add_table(self, table):
+        if not self.table:
+            self.table = dict(table)
+            return
+        t = self.table
+        for key, c in table.iteritems():
+            t[key] = t.get(key, 0) + c
+
+    def _translate(self, other):
+        """ Returns the table of other re-packed with this histogram's token ids
+        """
+        trans = [ self.intern(token) for token in other.vocab ]
+        table = {}
+        for key, c in other.table.iteritems():
+            table[self.pack([ trans[i] for i in other.unpack(key) ])] = c
+        return table
+
+    def _get_ids(self):
+        if self._ids is None:
+            self._ids = dict([ (t, i) for i, t in enumerate(self.vocab) ])
+        return self._ids
+
 def build_ngram_freq(data, n=1):
     """
     Takes a sequence containing data, typically a string of binary data.
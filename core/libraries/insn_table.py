@@ -0,0 +1,180 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from array import array
+from collections import Mapping
+
+name = "insn_table"
+
+OP_TYPES    = ["reg", "imm", "off", "rel", "eff_addr", "seg_off"]
+OP_SUBTYPES = [None, "far", "near"]
+EFF_ADDR_FIELDS = ("base", "idx", "scale", "disp")
+
+# Per instruction columns and their array typecodes
+INSN_COLUMNS = [("offset", "l"), ("addr", "l"), ("len", "B"),
+                ("mnem_id", "H"), ("group_id", "H"),
+                ("op_first", "l"), ("op_count", "B")]
+# Per operand columns, op_data holds the Python values
+OP_COLUMNS = [("op_type", "B"), ("op_subtype", "B")]
+
+
+class insn_table(Mapping):
+    """ Columnar store for disassembled instructions.
+
+        Each instruction is one row of parallel arrays (offset, addr, len,
+        mnem_id, group_id) and its operands are rows of a separate operand
+        table. Mnemonics and groups are stored once in string tables.
+
+        The table also behaves like the {offset: insn_dict} mapping that
+        disassemblers used to return: indexing by offset builds the same
+        instruction dict on demand, so modules that walk insns.keys() keep
+        working while new code can use column() on whole arrays.
+    """
+    def __init__(self):
+        for col, typecode in INSN_COLUMNS + OP_COLUMNS:
+            setattr(self, col, array(typecode))
+        self.op_data = []
+        self.mnems = []  # mnem_id => mnemonic
+        self.groups = [] # group_id => group
+        self._ids = None # (mnemonic => id, group => id), built on demand
+        self._rows = None # offset => row, built on demand
+
+    def append(self, offset, insn):
+        """ Add insn, a dict as built by linear_disassembler.build_insn, at offset
+        """
+        mnem_ids, group_ids = self._get_ids()
+        self._get_rows()[offset] = len(self.offset)
+        self.offset.append(offset)
+        self.addr.append(insn["addr"])
+        self.len.append(insn["len"])
+        self.mnem_id.append(intern_string(insn["mnem"], self.mnems, mnem_ids))
+        self.group_id.append(intern_string(insn["group"], self.groups, group_ids))
+
+        ops = []
+        if "d_op" in insn:
+            ops.append(insn["d_op"])
+        ops.extend(insn.get("s_ops", []))
+        self.op_first.append(len(self.op_type))
+        self.op_count.append(len(ops))
+        for op in ops:
+            self.op_type.append(OP_TYPES.index(op["type"]))
+            self.op_subtype.append(OP_SUBTYPES.index(op.get("subtype")))
+            data = op["data"]
+            if op["type"] == "eff_addr":
+                data = tuple([ data[f] for f in EFF_ADDR_FIELDS ])
+            self.op_data.append(data)
+
+    def column(self, col):
+        """ Returns the array for one of the INSN_COLUMNS or OP_COLUMNS
+        """
+        return getattr(self, col)
+
+    def length(self, offset):
+        return self.len[self._get_rows()[offset]]
+
+    def insn(self, row):
+        """ Returns the instruction dict of a row
+        """
+        new_insn = {"addr" :self.addr[row],
+                    "group":self.groups[self.group_id[row]],
+                    "mnem" :self.mnems[self.mnem_id[row]],
+                    "len"  :self.len[row]}
+        first = self.op_first[row]
+        count = self.op_count[row]
+        if count > 0:
+            new_insn["d_op"] = self.operand(first)
+        if count > 1:
+            new_insn["s_ops"] = [ self.operand(i) for i in xrange(first+1, first+count) ]
+        return new_insn
+
+    def operand(self, i):
+        new_op = {"type":OP_TYPES[self.op_type[i]], "data":self.op_data[i]}
+        if self.op_subtype[i]:
+            new_op["subtype"] = OP_SUBTYPES[self.op_subtype[i]]
+        if new_op["type"] == "eff_addr":
+            new_op["data"] = dict(zip(EFF_ADDR_FIELDS, new_op["data"]))
+        return new_op
+
+    ####### DICT COMPATIBLE VIEW #######
+    # Mapping fills in keys, items, values, get, __eq__ and friends
+    def __getitem__(self, offset):
+        return self.insn(self._get_rows()[offset])
+
+    def __contains__(self, offset):
+        return offset in self._get_rows()
+
+    def __len__(self):
+        return len(self.offset)
+
+    def __iter__(self):
+        return iter(self.offset)
+
+    def has_key(self, offset):
+        return offset in self
+
+    def keys(self):
+        return self.offset.tolist()
+
+    def iteritems(self):
+        for row in xrange(len(self.offset)):
+            yield self.offset[row], self.insn(row)
+
+    ####### PICKLING #######
+    def __getstate__(self):
+        # Pickle the arrays as raw bytes rather than as lists of ints
+        state = dict(op_data=self.op_data, mnems=self.mnems, groups=self.groups)
+        for col, typecode in INSN_COLUMNS + OP_COLUMNS:
+            state[col] = getattr(self, col).tostring()
+        return state
+
+    def __setstate__(self, state):
+        for col, typecode in INSN_COLUMNS + OP_COLUMNS:
+            a = array(typecode)
+            a.fromstring(state[col])
+            setattr(self, col, a)
+        self.op_data = state["op_data"]
+        self.mnems = state["mnems"]
+        self.groups = state["groups"]
+        self._ids = None
+        self._rows = None
+
+    def _get_ids(self):
+        if self._ids is None:
+            self._ids = (dict([ (m, i) for i, m in enumerate(self.mnems) ]),
+                         dict([ (g, i) for i, g in enumerate(self.groups) ]))
+        return self._ids
+
+    def _get_rows(self):
+        if self._rows is None:
+            self._rows = dict([ (o, r) for r, o in enumerate(self.offset) ])
+        return self._rows
+
+
+def intern_string(s, table, ids):
+    """ Returns the id of s in table, adding it if necessary
+    """
+    if s not in ids:
+        ids[s] = len(table)
+        table.append(s)
+    return ids[s]
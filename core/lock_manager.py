@@ -0,0 +1,205 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, time, zlib, errno, thread, threading, logging
+
+name = "lock_manager"
+logger = logging.getLogger(name)
+
+import otypes
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    logger.warning("fcntl is not available, datastore locking is disabled")
+
+MIN_DELAY = 0.0001 # seconds to wait after the first failed attempt
+MAX_DELAY = 0.05   # the wait doubles on each failed attempt up to this
+
+# Each lock is a one byte fcntl range lock in a shared lock file. The offset is
+# a hash of the lock id, so unrelated ids rarely contend and no per-lock files
+# are created. The kernel drops the locks of a process when it exits, so a
+# crash cannot leave a stale lock behind.
+# fcntl locks belong to the process, so the threads of a process are kept
+# apart here: a lock id is held by the threads in its owners, and another
+# thread waits for it like another process would (readers share it). Two ids
+# can hash to the same byte, so the byte stays locked until the last id on it
+# is released. mutex guards all of this and is only held briefly.
+#   lock_files: (pid, path) => file descriptor
+#   held_locks: lockid => dict(path=lock file, offset=byte offset, write=bool,
+#                              owners=set of thread ids)
+#   offsets:    (path, offset) => [lock ids held on the byte, locked for write]
+lock_files = dict()
+held_locks = dict()
+offsets = dict()
+mutex = threading.RLock() # Reentrant so release_all can run in a signal handler
+metrics = dict(acquired=0, contended=0, timeouts=0, wait_time=0.0, max_wait=0.0)
+
+def acquire(path, lockid, write=False, timeout=10):
+    """ Take a shared (or with write an exclusive) lock on lockid within the
+        lock file at path. Raises otypes.LockTimeout after timeout seconds.
+    """
+    if not fcntl or holds(lockid):
+        return True
+    me = thread.get_ident()
+    offset = zlib.crc32(lockid) & 0x7fffffff
+
+    start_time = time.time()
+    delay = MIN_DELAY
+    while True:
+        mutex.acquire()
+        try:
+            if take(path, lockid, offset, write, me):
+                break
+        finally:
+            mutex.release()
+        waited = time.time() - start_time
+        if waited >= timeout:
+            metrics["timeouts"] += 1
+            logger.error("Lock timeout on %s in %s", lockid, path)
+            raise otypes.LockTimeout("Timed out waiting for lock %s" % lockid)
+        time.sleep(delay)
+        delay = min(delay*2, MAX_DELAY)
+
+    waited = time.time() - start_time
+    if delay > MIN_DELAY: # We had to wait at least once
+        metrics["contended"] += 1
+    metrics["acquired"] += 1
+    metrics["wait_time"] += waited
+    metrics["max_wait"] = max(metrics["max_wait"], waited)
+    return True
+
+def take(path, lockid, offset, write, me):
+    """ Returns whether thread me got lockid, the caller holds mutex """
+    lock = held_locks.get(lockid)
+    if lock:
+        if write or lock["write"]: # Held by another thread of this process
+            return False
+        lock["owners"].add(me)
+        return True
+    fd = get_fd(path)
+    held = offsets.get((path, offset))
+    if not held or (write and not held[1]):
+        mode = fcntl.LOCK_EX if write else fcntl.LOCK_SH
+        try:
+            fcntl.lockf(fd, mode|fcntl.LOCK_NB, 1, offset)
+        except IOError, e:
+            if e.errno not in (errno.EACCES, errno.EAGAIN):
+                logger.error("Unexpected error locking %s in %s: %s", lockid, path, e)
+                raise
+            return False
+    if not held:
+        held = offsets[(path, offset)] = [0, False]
+    held[0] += 1
+    held[1] = held[1] or write
+    held_locks[lockid] = dict(path=path, offset=offset, write=write, owners=set([me]))
+    return True
+
+def holds(lockid):
+    """ Returns whether the calling thread holds lockid """
+    lock = held_locks.get(lockid)
+    return bool(lock) and thread.get_ident() in lock["owners"]
+
+def release(lockid):
+    """ Release the calling thread's hold on lockid """
+    mutex.acquire()
+    try:
+        lock = held_locks.get(lockid)
+        if not lock:
+            return
+        lock["owners"].discard(thread.get_ident())
+        if not lock["owners"]:
+            drop(lockid)
+    finally:
+        mutex.release()
+
+def drop(lockid):
+    """ Forget lockid and unlock its byte if no other id holds it, the caller
+        holds mutex
+    """
+    lock = held_locks.pop(lockid)
+    logger.debug("Releasing lock %s", lockid)
+    key = (lock["path"], lock["offset"])
+    held = offsets.get(key)
+    if not held:
+        return
+    held[0] -= 1
+    if held[0] > 0:
+        return
+    del offsets[key]
+    fd = lock_files.get((os.getpid(), lock["path"]))
+    if fd is not None:
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, lock["offset"])
+
+def release_all():
+    """ Release every lock held by this process. This function can be used as
+        part of a signal handler.
+    """
+    mutex.acquire()
+    try:
+        for lockid in held_locks.keys():
+            logger.info("Releasing lock %s PID %d", lockid, os.getpid())
+            drop(lockid)
+    finally:
+        mutex.release()
+
+def get_fd(path):
+    """ Returns this process's descriptor for the lock file at path, opening it
+        again if the file was removed or replaced since it was opened. The
+        caller holds mutex.
+    """
+    fdkey = (os.getpid(), path)
+    fd = lock_files.get(fdkey)
+    if fd is not None:
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                return fd
+        except OSError:
+            pass
+        # Any locks on the old file are meaningless to other processes now
+        for lockid in [ l for l in held_locks if held_locks[l]["path"] == path ]:
+            del held_locks[lockid]
+        for key in [ k for k in offsets if k[0] == path ]:
+            del offsets[key]
+        os.close(fd)
+    fd = os.open(path, os.O_CREAT|os.O_RDWR)
+    lock_files[fdkey] = fd
+    return fd
+
+def cleanup_state():
+    """ Forget the locks of the parent in a forked child, which does not
+        inherit its fcntl locks
+    """
+    global mutex
+    mutex = threading.RLock() # Another thread may have held it at the fork
+    held_locks.clear()
+    offsets.clear()
+
+def stats():
+    """ Returns lock wait metrics for this process
+    """
+    s = dict(metrics)
+    s["held"] = len(held_locks)
+    return s
@@ -0,0 +1,143 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import os, sys, cPickle, tempfile, logging
+
+name = "manifest"
+logger = logging.getLogger(name)
+
+import sys_utils
+
+MANIFEST_FILE = "modules.manifest" # file under the scratch dir
+
+# The manifest lets oxide start without importing every module. It holds
+# what oxide needs to know about a module before running it:
+#   mod_name => dict(type=module type, dir=dir holding the module,
+#                    mtimes={file: mtime of each .py file in the module},
+#                    libs={file: mtime of each .py file in the libraries dir},
+#                    doc=documentation(), error=True if it did not import)
+# An entry is good as long as the module still lives in dir and none of its
+# files or the shared library files changed; any other module is imported
+# to make a new entry. A module whose documentation cannot be pickled gets
+# doc None and is imported on every start, as is a module that failed to
+# import, since what it was missing may have been installed since.
+
+def load(path):
+    """ Returns the manifest at path, or an empty one if it is missing or
+        unreadable
+    """
+    if not os.path.isfile(path):
+        return {}
+    try:
+        fd = open(path, "rb")
+        try:
+            entries = cPickle.load(fd)
+        finally:
+            fd.close()
+    except Exception, err: # Unpickling can raise about anything
+        logger.warning("Module manifest %s unreadable, rebuilding it: %s", path, err)
+        return {}
+    if not isinstance(entries, dict):
+        return {}
+    return entries
+
+def save(path, entries):
+    sys_utils.assert_dir_exists(os.path.dirname(path))
+    fd, tmp = tempfile.mkstemp(prefix="TMP", dir=os.path.dirname(path))
+    try:
+        os.write(fd, cPickle.dumps(entries, cPickle.HIGHEST_PROTOCOL))
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+def is_current(entry, mod_type, mod_dir, mtimes, lib_mtimes):
+    return (entry is not None and "libs" in entry and entry["type"] == mod_type
+            and entry["dir"] == mod_dir and entry["mtimes"] == mtimes
+            and entry["libs"] == lib_mtimes)
+
+def make_entry(mod_type, mod_dir, mtimes, lib_mtimes, doc, error=False):
+    if doc is not None:
+        try:
+            cPickle.dumps(doc, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logger.debug("Documentation of a %s module in %s is not picklable", mod_type, mod_dir)
+            doc = None
+    return dict(type=mod_type, dir=mod_dir, mtimes=mtimes, libs=lib_mtimes, doc=doc, error=error)
+
+def module_mtimes(this_mod_dir):
+    """ Returns {file: mtime} for the .py files under this_mod_dir """
+    mtimes = {}
+    for root, dirs, files in os.walk(this_mod_dir):
+        for f in files:
+            if f.endswith(".py"):
+                path = os.path.join(root, f)
+                try:
+                    mtimes[os.path.relpath(path, this_mod_dir)] = os.path.getmtime(path)
+                except OSError:
+                    pass
+    return mtimes
+
+class lazy_modules(dict):
+    """ mod_name => module interface, where a module that has not been
+        imported yet is held as None and imported by loader on first access
+    """
+    def __init__(self, loader):
+        dict.__init__(self)
+        self.loader = loader
+
+    def __getitem__(self, mod_name):
+        mod = dict.__getitem__(self, mod_name)
+        if mod is None:
+            mod = self.loader(mod_name)
+        return mod
+
+    def get(self, mod_name, default=None):
+        if mod_name not in self:
+            return default
+        return self[mod_name]
+
+    def loaded(self, mod_name):
+        return dict.get(self, mod_name) is not None
+
+    def values(self):
+        return [ self[mod_name] for mod_name in self ]
+
+    def items(self):
+        return [ (mod_name, self[mod_name]) for mod_name in self ]
+
+class module_finder:
+    """ Import hook that imports the modules in a lazy_modules by name, so a
+        worker forked before a module was first used can still unpickle the
+        module's functions.
+    """
+    def __init__(self, modules):
+        self.modules = modules
+
+    def find_module(self, fullname, path=None):
+        if path is None and fullname in self.modules and not self.modules.loaded(fullname):
+            return self
+        return None
+
+    def load_module(self, fullname):
+        self.modules[fullname]
+        return sys.modules[fullname]
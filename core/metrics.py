@@ -0,0 +1,226 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, sys, time, atexit, logging
+name = "metrics"
+logger = logging.getLogger(name)
+
+import api, journaled
+
+try:
+    import resource
+except ImportError:
+    resource = None
+    logger.info("Not able to import resource, peak RSS will not be recorded")
+
+BUCKETS = (0.001, 0.01, 0.1, 1., 10., 100.) # upper bounds in seconds of the wall time histogram
+SLOWEST_MAX = 10 # slowest oids kept per entry
+
+# Every call of a module's process, mapper, reducer or results goes through
+# call(), which records its wall time, CPU time, datastore bytes read and
+# written, result cache hits and the peak RSS of the process when it
+# returned. A call that runs other modules (e.g. a retrieve of a dependency
+# that is not stored yet) includes their cost, and they are recorded as well.
+# Records are kept in memory until flush(), which sums them per module, kind
+# and oid and appends the sums to the journal, so workers and remote nodes
+# writing to the same datastore all add up, see journaled.index. The journal
+# is all there is, so the index starts empty. Pool workers hand their records
+# back to the parent with their results (see take) rather than writing the
+# journal per task. The src_type of each oid is looked up by summary(), so
+# recording a call never touches the datastore.
+#   pending: index dir => list of (mod_name, kind, oid, wall, cpu, read,
+#                                  written, hits, rss)
+#   index:   (mod_name, kind) => {oid or None: sums}, sums is a list of the
+#            fields below
+pending = dict()
+CALLS, WALL, CPU, READ, WRITTEN, HITS, RSS, MAX_WALL, HISTOGRAM = range(9)
+depth = 0 # calls in progress in this process, nothing is flushed until 0
+
+def call(index_dir, mod_name, kind, oid, func, *args):
+    """ Returns func(*args) and records the call as one invocation of kind
+        (process, mapper, reducer or results) of mod_name over oid, or None
+        when it was called over a list of oids
+    """
+    global depth
+    start = snapshot()
+    depth += 1
+    try:
+        return func(*args)
+    finally:
+        depth -= 1
+        end = snapshot()
+        rss = 0
+        if resource:
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform != "darwin": # Linux reports kilobytes
+                rss *= 1024
+        pending.setdefault(index_dir, []).append(
+            (mod_name, kind, oid) + tuple( e - s for s, e in zip(start, end) ) + (rss,))
+
+def snapshot():
+    """ (wall, cpu, bytes read, bytes written, cache hits) so far """
+    t = os.times()
+    io = api.io_stats()
+    return (time.time(), t[0] + t[1], io["read"], io["written"], api.cache_stats()["hits"])
+
+def flush():
+    """ Append the pending records to the journal of their datastore. Does
+        nothing while a call is in progress so that it is not charged for it.
+    """
+    if depth or not pending:
+        return
+    for index_dir, records in pending.items():
+        del pending[index_dir]
+        if not os.path.isdir(index_dir):
+            logger.debug("Dropping metrics of the removed datastore %s", index_dir)
+            continue
+        journal(index_dir, aggregate(records))
+
+def take():
+    """ Returns the pending records and forgets them, for a worker to hand
+        them to the process that runs the pool
+    """
+    if depth:
+        return {}
+    records = dict(pending)
+    pending.clear()
+    return records
+
+def add(records):
+    """ Add records returned by take() in another process to the pending ones """
+    for index_dir, r in records.iteritems():
+        pending.setdefault(index_dir, []).extend(r)
+
+def aggregate(records):
+    """ Sum records into {(mod_name, kind): {oid: sums}} """
+    deltas = {}
+    for mod_name, kind, oid, wall, cpu, read, written, hits, rss in records:
+        oids = deltas.setdefault((mod_name, kind), {})
+        sums = oids.get(oid)
+        if sums is None:
+            sums = oids[oid] = new_sums()
+        sums[CALLS] += 1
+        sums[WALL] += wall
+        sums[CPU] += cpu
+        sums[READ] += read
+        sums[WRITTEN] += written
+        sums[HITS] += hits
+        sums[RSS] = max(sums[RSS], rss)
+        sums[MAX_WALL] = max(sums[MAX_WALL], wall)
+        sums[HISTOGRAM][bucket(wall)] += 1
+    return deltas
+
+def src_type(record):
+    if not isinstance(record, dict) or not record.get("type"):
+        return "unknown"
+    t = record["type"]
+    if isinstance(t, (set, list, tuple)):
+        return ",".join(sorted( str(i) for i in t ))
+    return str(t)
+
+def bucket(wall):
+    for i, bound in enumerate(BUCKETS):
+        if wall < bound:
+            return i
+    return len(BUCKETS)
+
+def new_sums():
+    return [0, 0., 0., 0, 0, 0, 0, 0., [0] * (len(BUCKETS) + 1)]
+
+def new_entry():
+    return dict(calls=0, wall=0., cpu=0., read=0, written=0, cache_hits=0, peak_rss=0,
+                histogram=[0] * (len(BUCKETS) + 1), slowest=[])
+
+def merge(data, deltas):
+    """ Add the sums of deltas into data """
+    for key, oids in deltas.iteritems():
+        target = data.setdefault(key, {})
+        for oid, delta in oids.iteritems():
+            sums = target.get(oid)
+            if sums is None:
+                sums = target[oid] = new_sums()
+            for field in (CALLS, WALL, CPU, READ, WRITTEN, HITS):
+                sums[field] += delta[field]
+            sums[RSS] = max(sums[RSS], delta[RSS])
+            sums[MAX_WALL] = max(sums[MAX_WALL], delta[MAX_WALL])
+            sums[HISTOGRAM] = [ a + b for a, b in zip(sums[HISTOGRAM], delta[HISTOGRAM]) ]
+
+def summary(index_dir, mod_name=None):
+    """ Returns {(mod_name, src_type, kind): entry} for every module or only
+        mod_name. src_type is None for calls over a list of oids. An entry has
+        the totals calls, wall, cpu (seconds), read, written (bytes) and
+        cache_hits, the highest peak_rss (bytes), histogram as a list of
+        (upper bound in seconds or None for the rest, calls) and slowest as a
+        list of (wall of the slowest call, oid), slowest first.
+    """
+    flush()
+    data = index.get(index_dir)
+    keys = [ key for key in data if not mod_name or key[0] == mod_name ]
+    oids = set()
+    for key in keys:
+        oids.update( oid for oid in data[key] if oid )
+    types = api.retrieve_many("src_type", list(oids))
+    results = {}
+    for mod, kind in keys:
+        for oid, sums in data[(mod, kind)].iteritems():
+            key = (mod, src_type(types.get(oid)) if oid else None, kind)
+            entry = results.get(key)
+            if entry is None:
+                entry = results[key] = new_entry()
+            entry["calls"] += sums[CALLS]
+            entry["wall"] += sums[WALL]
+            entry["cpu"] += sums[CPU]
+            entry["read"] += sums[READ]
+            entry["written"] += sums[WRITTEN]
+            entry["cache_hits"] += sums[HITS]
+            entry["peak_rss"] = max(entry["peak_rss"], sums[RSS])
+            entry["histogram"] = [ a + b for a, b in zip(entry["histogram"], sums[HISTOGRAM]) ]
+            if oid:
+                entry["slowest"].append((sums[MAX_WALL], oid))
+    for entry in results.itervalues():
+        entry["histogram"] = zip(BUCKETS + (None,), entry["histogram"])
+        entry["slowest"] = sorted(entry["slowest"], reverse=True)[:SLOWEST_MAX]
+    return results
+
+def journal(index_dir, deltas):
+    """ Append deltas to the journal of index_dir """
+    if deltas:
+        index.append(index_dir, [deltas])
+
+def reset(index_dir):
+    """ Forget every recorded call in index_dir """
+    pending.pop(index_dir, None)
+    index.reset(index_dir)
+
+def cleanup_state():
+    """ Forget the indexes, the records not flushed yet and the calls in
+        progress, e.g. in a worker that was forked with those of its parent
+    """
+    global depth
+    index.cleanup_state()
+    pending.clear()
+    depth = 0
+
+index = journaled.index("metrics", merge)
+atexit.register(flush)
@@ -22,67 +22,186 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import os, time, xmlrpclib, logging, traceback, cPickle
-from multiprocessing import Pool, Process, Queue, current_process, active_children
-from multiprocessing.managers import BaseManager
+import os, time, atexit, xmlrpclib, logging, traceback, cPickle, threading, Queue
+import multiprocessing.util
+from multiprocessing import Pool, Process, current_process, active_children, cpu_count
+from multiprocessing.dummy import Pool as ThreadPool
 
-import sys_utils, server, client, oxide
+import sys_utils, server, client, oxide, lock_manager
 from progress import progress
 from client import get_proxy
 
 name = "multiproc"
 logger = logging.getLogger(name)
 
-class MyManager(BaseManager):
-    pass
+CHUNKS_PER_WORKER = 4 # tasks are sent to the pool in about this many chunks per worker
+COMBINE_FANIN = 8     # partial map-reduce results combined at a time
+DISTRIB_BATCHES_PER_NODE = 8 # oids are handed to compute nodes in about this many batches each
+DISTRIB_MAX_TRIES = 3        # nodes a batch is tried on before it is given up
+DISTRIB_MAX_FAILURES = 3     # failed batches before a node is dropped for the rest of a call
+DISTRIB_SEND_MAX = 67108864  # bytes of samples sent to a compute node per call
+DISTRIB_SLOTS_TTL = 60        # seconds the idle CPUs a compute node reported are trusted
 
-MyManager.register('Progress', progress)
+############# POOL FUNCTIONS ###################################################
+# One worker pool is created on first use and kept for the life of the
+# process, so a pipeline of commands does not fork a new set of workers (and
+# re-import every module) per call. It is rebuilt if multiproc_max changes
+# and shut down at exit. Workers are forked from the state of oxide when the
+# pool was created, so each call hands them the current datastore dir and
+# they drop their caches when they see a new call.
+pool = None
+pool_pid = None
+pool_processes = 0
+call_count = 0
+worker_call = None # The call this worker last synced to
+distrib_stats = [] # node_stats of the last multi_map_distrib call
 
-max_processes = oxide.config.multiproc_max
-results_q = Queue()
+def pool_size():
+    """ multiproc_max processes but no more than there are CPUs. With
+        multiproc_max <= 0 use one per CPU.
+    """
+    try:
+        cpus = cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    max_processes = oxide.config.multiproc_max
+    if max_processes <= 0:
+        return cpus
+    return max(1, min(max_processes, cpus))
+
+def get_pool():
+    global pool, pool_pid, pool_processes
+    size = pool_size()
+    if pool is not None and pool_pid == os.getpid() and pool_processes == size:
+        return pool
+    shutdown()
+    logger.debug("Starting a pool of %d worker processes", size)
+    pool = Pool(processes=size, initializer=_init_worker)
+    pool_pid = os.getpid()
+    pool_processes = size
+    return pool
+
+def shutdown():
+    """ Stop the worker pool, if this process started one
+    """
+    global pool, pool_pid, pool_processes
+    if pool is None:
+        return
+    if pool_pid == os.getpid():
+        try:
+            pool.close()
+            pool.join()
+        except:
+            pool.terminate()
+    pool, pool_pid, pool_processes = None, None, 0
+
+atexit.register(shutdown)
+
+def new_call():
+    """ Returns the state workers sync to before running a task of this call
+    """
+    global call_count
+    call_count += 1
+    return (os.getpid(), call_count, oxide.datastore.datastore_dir, oxide.tracer.handoff())
 
-def _process_map((func, mod_name, oid, opts, p)):
+def chunk_size(num_tasks):
+    return max(1, num_tasks / (pool_processes * CHUNKS_PER_WORKER))
+
+def run_tasks(wrapper, tasks, num_tasks, name=None):
+    """ Run wrapper over tasks in the pool, ticking progress as the results
+        come back in any order. Returns the results.
+    """
+    p = progress(num_tasks, name=name)
+    results = []
     try:
-        oxide.config.multiproc_on = False
-        func(mod_name, oid, opts)
-        p.tick()
+        pool = get_pool()
+        for result, records in pool.imap_unordered(_run_task, ( (wrapper, t) for t in tasks ),
+                                                   chunk_size(num_tasks)):
+            oxide.metrics.add(records)
+            results.append(result)
+            p.tick()
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
+    return results
 
-def process_map(func, mod_name, oid_list, opts, blocking=False):
-    num_oids = len(oid_list)
-    if num_oids == 0:
-        return True
-    nprocs = min(num_oids, max_processes)
-    pool = Pool(processes=nprocs)
-    manager = MyManager()
-    manager.start()
-    p = manager.Progress(num_oids)
+def _run_task((wrapper, task)):
+    """ Returns wrapper(task) and the metrics the worker recorded running it,
+        which the parent appends to the journal once for all of the tasks
+    """
+    return wrapper(task), oxide.metrics.take()
+
+def _init_worker():
+    oxide.config.multiproc_on = False
+    oxide.datastore.register_process()
+    lock_manager.cleanup_state() # fcntl locks are not inherited
+    oxide.metrics.cleanup_state() # Drop the records forked from the parent
+    oxide.tracer.follow(None)
+    # Records left behind by tasks not run through _run_task
+    multiprocessing.util.Finalize(None, oxide.metrics.flush, exitpriority=10)
+
+def _sync_worker(call):
+    global worker_call
+    if call == worker_call:
+        return
+    worker_call = call
+    oxide.datastore.datastore_dir = call[2]
+    oxide.tracer.follow(call[3])
+    oxide.cache_clear()
+    oxide.datastore.cleanup_state()
+
+def _finish_task():
+    """ Write out the spans the worker traced for the task it finished """
+    oxide.tracer.flush()
+
+def _seed_source(oid, src):
+    """ Take the source of oid resolved by the parent so the worker does not
+        look it up again
+    """
+    if src:
+        oxide.source_map[oid] = src
+
+############# MAP FUNCTIONS ####################################################
+
+def _process_map((func, mod_name, oid, src, opts, call)):
     try:
-        pool.map(_process_map, [(func, mod_name, i, opts, p) for i in oid_list])
+        _sync_worker(call)
+        _seed_source(oid, src)
+        func(mod_name, oid, opts)
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
+
+def process_map(func, mod_name, oid_list, opts, blocking=False):
+    num_oids = len(oid_list)
+    if num_oids == 0:
+        return True
+    call = new_call()
+    srcs = oxide.sources(oid_list)
+    run_tasks(_process_map, ((func, mod_name, i, srcs[i], opts, call) for i in oid_list), num_oids, mod_name)
     return True
 
 def multi_map(func, oid_list, opts, blocking=False):
     num_oids = len(oid_list)
     if num_oids == 0:
         return True
-    nprocs = min(num_oids, max_processes)
-    pool = Pool(processes=nprocs)
-    manager = MyManager()
-    manager.start()
-    p = manager.Progress(num_oids)
-    try:
-        pool.map(_map_wrapper, [(func, i, opts, p) for i in oid_list])
-    except:
-        print '-'*60
-        traceback.print_exc()
-        print '-'*60
+    call = new_call()
+    srcs = oxide.sources(oid_list)
+    run_tasks(_map_wrapper, ((func, i, srcs[i], opts, call) for i in oid_list), num_oids, func.__module__)
+    return True
+
+def multi_map_stage(tasks):
+    """ Run a stage of the dependency scheduler, tasks is a list of
+        (mod_name, oid, opts) that can mix several modules.
+    """
+    num_tasks = len(tasks)
+    if num_tasks == 0:
+        return True
+    call = new_call()
+    srcs = oxide.sources(list(set( i for m, i, opts in tasks )))
+    run_tasks(_stage_wrapper, ((m, i, srcs[i], opts, call) for m, i, opts in tasks), num_tasks, "stage")
     return True
 
 def expand_oids(mod_name, oid_list):
@@ -92,94 +211,404 @@ def expand_oids(mod_name, oid_list):
     return oxide.expand_oids(oid_list)
 
 def multi_map_distrib(proxy_list, mod_name, oid_list, opts={}, blocking=False, force=False):
+    """ Process oid_list on the compute nodes in proxy_list. The oids are cut
+        into batches of about equal total sample size that the nodes take as
+        they finish their last one, so a node with big samples or a high load
+        just takes fewer batches. Batches go first to a node that already has
+        their samples, and a node that does not is sent them. A batch that
+        fails is retried on the other nodes and a node that keeps failing is
+        dropped.
+    """
+    global distrib_stats
     if not isinstance(oid_list, list):
         oid_list = [oid_list]
-    num_oids = len(oid_list)
-    if num_oids == 0:
+    if len(oid_list) == 0:
         return True
-        
-    elif num_oids == 1:
-        proxy = get_proxy(proxy_list[0][0], proxy_list[0][1], True) 
-        proxy.process(mod_name, oid_list[0], opts, force)
-        return True
-    nprocs = min(num_oids, max_processes)
-    pool = Pool(processes=nprocs)
-    manager = MyManager()
-    manager.start()
-    p = manager.Progress(num_oids)
-    num_partitions = len(proxy_list)
-    list_len = len(oid_list)
-    chunk_len = list_len/num_partitions
-    pool_jobs = []
-    for i in xrange(num_partitions-1):
-        j = oid_list[i*chunk_len:i*chunk_len+chunk_len]
-        pool_jobs.append( (proxy_list[i], mod_name, j, opts, p, force) )
-    j = oid_list[(num_partitions-1)*chunk_len:]
-    pool_jobs.append( (proxy_list[-1], mod_name, j, opts, p, force) )
-    
+
+    sizes = sample_sizes(oid_list)
+    nodes = [ node_stats(ip, port) for ip, port in proxy_list ]
+    holdings = node_holdings(nodes, mod_name, sizes.keys())
+    queues = dict( (n.name, Queue.Queue()) for n in nodes )
+    queues[None] = Queue.Queue() # Batches any node can take first
+    for owner, batches in assign_batches(sizes, holdings, len(nodes)).iteritems():
+        for batch in batches:
+            queues[owner].put((batch, set()))
+    p = progress(len(sizes), name=mod_name)
+    state = {"lock":threading.Lock(), "inflight":0, "lost":0, "sizes":sizes}
+    def run_node(node):
+        try:
+            _distrib_node(node, nodes, queues, mod_name, opts, force, p, state)
+        except:
+            print '-'*60
+            traceback.print_exc()
+            print '-'*60
+
+    # The nodes only wait on the compute nodes, so threads are enough
+    pool = ThreadPool(len(nodes))
     try:
-        pool.map(_multi_map_process_wrapper, pool_jobs)
-    except:
-        print '-'*60
-        traceback.print_exc()
-        print '-'*60
-    return True
+        pool.map(run_node, nodes)
+    finally:
+        pool.close()
+        pool.join()
+
+    distrib_stats = nodes
+    for node in nodes:
+        logger.info("%s", node)
+    lost = state["lost"]
+    for q in queues.itervalues(): # Left when every node was dropped
+        while not q.empty():
+            batch, tried = q.get()
+            lost += len(batch)
+    if lost:
+        logger.error("Not able to process %d oids, no node left to try them", lost)
+    return lost == 0
+
+def make_batches(sizes, num_nodes, target=None):
+    """ Cut the oids in sizes into about DISTRIB_BATCHES_PER_NODE batches per
+        node of equal total size, or of target bytes if given. The biggest
+        samples come first so the long ones start early.
+    """
+    oids = sorted(sizes, key=sizes.get, reverse=True)
+    if not target:
+        target = max(1, sum(sizes.itervalues()) / (max(1, num_nodes) * DISTRIB_BATCHES_PER_NODE))
+    batches = []
+    batch, weight = [], 0
+    for oid in oids:
+        batch.append(oid)
+        weight += sizes[oid]
+        if weight >= target:
+            batches.append(batch)
+            batch, weight = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def assign_batches(sizes, holdings, num_nodes):
+    """ Returns a dict of node name => batches for that node, with None for
+        the batches of oids no node has. An oid goes to the least loaded of
+        the nodes that have its results, or else of those that have its
+        sample.
+    """
+    groups = {}
+    assigned = dict.fromkeys(holdings, 0)
+    for oid in sorted(sizes, key=sizes.get, reverse=True):
+        have = [ n for n in holdings if oid in holdings[n] ]
+        choices = [ n for n in have if holdings[n][oid] ] or have
+        owner = None
+        if choices:
+            owner = min(choices, key=assigned.get)
+            assigned[owner] += sizes[oid]
+        groups.setdefault(owner, {})[oid] = sizes[oid]
+    target = max(1, sum(sizes.itervalues()) / (max(1, num_nodes) * DISTRIB_BATCHES_PER_NODE))
+    return dict( (owner, make_batches(group, num_nodes, target))
+                 for owner, group in groups.iteritems() )
+
+def sample_sizes(oid_list):
+    """ Returns a dict of oid => bytes of raw data behind it, at least 1 so
+        every oid has some weight
+    """
+    sizes = {}
+    for oid, src in oxide.sources(oid_list).iteritems():
+        try:
+            sizes[oid] = max(1, os.path.getsize(os.path.join(oxide.datastore.get_raw_dir(src), oid)))
+        except (OSError, TypeError):
+            sizes[oid] = 1
+    return sizes
+
+def node_holdings(nodes, mod_name, oid_list):
+    """ Ask every node which of oid_list it has. Returns a dict of node name
+        => {oid: True if it has the results of mod_name, False if only the
+        sample}, empty for nodes that do not answer.
+    """
+    def ask(node):
+        try:
+            return get_proxy(node.ip, node.port, True).held_samples(mod_name, oid_list) or {}
+        except Exception, err:
+            logger.debug("Not able to ask %s for its samples: %s", node.name, err)
+            return {}
+    pool = ThreadPool(len(nodes))
+    try:
+        return dict(zip([ n.name for n in nodes ], pool.map(ask, nodes)))
+    finally:
+        pool.close()
+        pool.join()
+
+def send_samples(node, proxy, oid_list):
+    """ Send node the samples of oid_list it does not have, in calls of up to
+        DISTRIB_SEND_MAX bytes. Returns the bytes sent.
+    """
+    sent = 0
+    samples, size = {}, 0
+    for oid in proxy.missing_samples(oid_list):
+        src = oxide.source(oid)
+        data = oxide.raw_data(src, oid) if src else None
+        if data is None:
+            logger.warning("No sample of %s to send to %s", oid, node.name)
+            continue
+        samples[oid] = data[:]
+        size += len(samples[oid])
+        if size >= DISTRIB_SEND_MAX:
+            proxy.cache_samples(samples)
+            sent += size
+            samples, size = {}, 0
+    if samples:
+        proxy.cache_samples(samples)
+        sent += size
+    return sent
+
+class node_stats:
+    """ What a compute node did during one multi_map_distrib call """
+    def __init__(self, ip, port):
+        self.name = "%s:%s" % (ip, port)
+        self.ip = ip
+        self.port = port
+        self.batches = 0
+        self.stolen = 0
+        self.oids = 0
+        self.bytes = 0
+        self.sent = 0
+        self.seconds = 0.
+        self.failures = 0
+        self.slots = None # Batches taken at once, asked when the node joins
+        self.slots_time = 0.
+        self.dropped = False
+        self.finished = False # Stopped taking batches
+
+    def __str__(self):
+        oid_rate, mb_rate = 0., 0.
+        if self.seconds:
+            oid_rate = self.oids / self.seconds
+            mb_rate = self.bytes / 1048576. / self.seconds
+        state = " (dropped)" if self.dropped else ""
+        return ("%s%s: %d batches (%d stolen), %d oids in %.2fs (%.2f oids/s, %.2f MB/s), "
+                "%.2f MB of samples sent, %d failures") % (
+                self.name, state, self.batches, self.stolen, self.oids, self.seconds,
+                oid_rate, mb_rate, self.sent / 1048576., self.failures)
+
+def _take_batch(node, queues):
+    """ Returns (batch, tried, stolen) from the node's own queue, the shared
+        queue or else another node's queue, or None if they are all empty.
+    """
+    others = [ name for name in queues if name not in (node.name, None) ]
+    for name in [node.name, None] + others:
+        try:
+            batch, tried = queues[name].get_nowait()
+            return batch, tried, name not in (node.name, None)
+        except Queue.Empty:
+            pass
+    return None
+
+def _distrib_node(node, nodes, queues, mod_name, opts, force, p, state):
+    """ Take batches for node until all of them are done. A failed batch goes
+        back in the shared queue for the nodes that have not failed it yet,
+        so a node only stops once no batch is left or out on another node.
+        A batch counts as out from when it is taken until it is done or put
+        back, and both happen under the lock along with the check for no
+        batch left.
+    """
+    try:
+        _distrib_batches(node, nodes, queues, mod_name, opts, force, p, state)
+    finally:
+        with state["lock"]:
+            node.finished = True
+
+def _distrib_batches(node, nodes, queues, mod_name, opts, force, p, state):
+    lock = state["lock"]
+    while not node.dropped:
+        with lock:
+            taken = _take_batch(node, queues)
+            if taken:
+                state["inflight"] += 1
+            elif state["inflight"] == 0:
+                return
+        if not taken:
+            time.sleep(0.1) # Wait for batches out on other nodes
+            continue
+        batch, tried, stolen = taken
+        if node.name in tried:
+            with lock:
+                state["inflight"] -= 1
+                others = [ n for n in nodes if not (n.dropped or n.finished or n.name in tried) ]
+                if not others:
+                    logger.error("Giving up on %d oids, every node left failed them", len(batch))
+                    state["lost"] += len(batch)
+                    continue
+                queues[None].put((batch, tried))
+            time.sleep(0.1)
+            continue
+
+        taken = [(batch, tried)]
+        stolen = int(stolen)
+        slots = _node_slots(node)
+        while len(taken) < slots:
+            with lock:
+                more = _take_batch(node, queues)
+                if more and node.name in more[1]:
+                    queues[None].put(more[:2])
+                    more = None
+                elif more:
+                    state["inflight"] += 1
+            if not more:
+                break
+            taken.append(more[:2])
+            stolen += more[2]
+        oids = [ oid for batch, tried in taken for oid in batch ]
+        start = time.time()
+        try:
+            proxy = get_proxy(node.ip, node.port, True)
+            if not proxy:
+                raise IOError("not able to get proxy")
+            sent = send_samples(node, proxy, oids)
+            proxy.process(mod_name, oids, opts, force)
+        except Exception, err:
+            logger.warning("Batch of %d oids failed on %s: %s", len(oids), node.name, err)
+            with lock:
+                node.failures += 1
+                node.slots = None # Ask again, the node may be saturated
+                if node.failures >= DISTRIB_MAX_FAILURES:
+                    logger.error("Dropping %s after %d failures", node.name, node.failures)
+                    node.dropped = True
+                for batch, tried in taken:
+                    tried.add(node.name)
+                    if len(tried) < DISTRIB_MAX_TRIES:
+                        queues[None].put((batch, tried))
+                    else:
+                        logger.error("Giving up on %d oids after %d tries", len(batch), len(tried))
+                        state["lost"] += len(batch)
+                state["inflight"] -= len(taken)
+            continue
 
+        with lock:
+            node.batches += len(taken)
+            node.stolen += stolen
+            node.oids += len(oids)
+            node.bytes += sum( state["sizes"][oid] for oid in oids )
+            node.sent += sent
+            node.seconds += time.time() - start
+            state["inflight"] -= len(taken)
+            for oid in oids:
+                p.tick()
 
-def _multi_map_process_wrapper(((server_ip, server_port), mod_name, i, opts, p, force)):
+def _node_slots(node):
+    """ Batches a node takes at once, about one per CPU it reports idle. The
+        node is asked on its first batch and again once its answer is
+        DISTRIB_SLOTS_TTL seconds old or a batch failed on it.
+    """
+    now = time.time()
+    if node.slots is None or now - node.slots_time > DISTRIB_SLOTS_TTL:
+        try:
+            cpus, load = get_proxy(node.ip, node.port, True).load()
+            node.slots = max(1, int(round(cpus - load)))
+        except Exception:
+            node.slots = 1
+        node.slots_time = now
+    return node.slots
+
+def _map_wrapper((func, i, src, opts, call)):
+    """ Called through multi_map """
     try:
-        oxide.config.multiproc_on = False
-        proxy = get_proxy(server_ip, server_port, True) 
-        if not proxy:
-            logger.error("Not able to get proxy")
-            raise
-        proxy.process(mod_name, i, opts, force)
-        p.tick()
+        _sync_worker(call)
+        _seed_source(i, src)
+        oxide.call_module(func.__module__, func.__name__, i, func, i, opts)
+        _finish_task()
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
 
-
-def _map_wrapper((func, i, opts, p)):
-    """ Called through multi_map """
+def _stage_wrapper((mod_name, oid, src, opts, call)):
+    """ Called through multi_map_stage """
     try:
-        oxide.config.multiproc_on = False
-        func(i, opts)
-        p.tick()
+        _sync_worker(call)
+        _seed_source(oid, src)
+        mod = oxide.initialized_modules[mod_name]
+        if oxide.get_mod_type(mod_name) == "map_reducers":
+            oxide.call_module(mod_name, "mapper", oid, mod.mapper, oid, opts, None)
+        else:
+            oxide.call_module(mod_name, "process", oid, mod.process, oid, opts)
+        _finish_task()
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
 
-def multi_mapreduce(map_func, reduce_func, oid_list, opts, jobid):
+def multi_mapreduce(map_func, reduce_func, oid_list, opts, jobid, combine_func=None):
+    """ Map map_func over oid_list in the pool and hand the mapper results to
+        reduce_func. With a combine_func each worker combines the results of
+        its chunk of oids, and the partial results are combined in a tree
+        before they are reduced.
+    """
     try:
         num_oids = len(oid_list)
         if num_oids == 0:
             return None
-        nprocs = min(num_oids, max_processes)
-        pool = Pool(processes=nprocs)
-        manager = MyManager()
-        manager.start()
-        p = manager.Progress(num_oids)
-        pool.map(_map_reduce_wrapper, [(map_func, i, opts, p) for i in oid_list])
-        results = []
-        for i in xrange(num_oids):
-            results.append(results_q.get())
-        return reduce_func(results, opts, jobid)
+        call = new_call()
+        srcs = oxide.sources(oid_list)
+        if not combine_func:
+            results = run_tasks(_map_reduce_wrapper,
+                                ((map_func, i, srcs[i], opts, jobid, call) for i in oid_list),
+                                num_oids, map_func.__module__)
+            return _reduce(reduce_func, results, opts, jobid)
+
+        p = progress(num_oids, name=map_func.__module__)
+        pool = get_pool()
+        size = chunk_size(num_oids)
+        chunks = [ oid_list[i:i+size] for i in xrange(0, num_oids, size) ]
+        partials = []
+        for (count, partial), records in pool.imap_unordered(_run_task,
+                ((_map_combine_wrapper, (map_func, combine_func, [ (i, srcs[i]) for i in chunk ],
+                                         opts, jobid, call))
+                 for chunk in chunks)):
+            oxide.metrics.add(records)
+            partials.append(partial)
+            p.tick(count)
+        return _reduce(reduce_func, [tree_combine(combine_func, partials, opts, call)], opts, jobid)
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
 
-def _map_reduce_wrapper((func, i, opts, p)):
+def tree_combine(combine_func, partials, opts, call):
+    """ Combine partials COMBINE_FANIN at a time, a level at a time, with
+        the levels that have more than one group done in the pool.
+    """
+    while len(partials) > COMBINE_FANIN:
+        groups = [ partials[i:i+COMBINE_FANIN] for i in xrange(0, len(partials), COMBINE_FANIN) ]
+        partials = get_pool().map(_combine_wrapper, [ (combine_func, g, opts, call) for g in groups ], 1)
+    return combine_func(partials, opts)
+
+def _reduce(reduce_func, results, opts, jobid):
+    return oxide.call_module(reduce_func.__module__, "reducer", None,
+                             reduce_func, results, opts, jobid)
+
+def _map_reduce_wrapper((func, i, src, opts, jobid, call)):
     """ Called through multi_mapreduce """
     try:
-        oxide.config.multiproc_on = False
-        result = func(i, opts)
-        p.tick()
-        results_q.put(result)
+        _sync_worker(call)
+        _seed_source(i, src)
+        result = oxide.call_module(func.__module__, "mapper", i, func, i, opts, jobid)
+        _finish_task()
+        return result
+    except:
+        print '-'*60
+        traceback.print_exc()
+        print '-'*60
+        return None
+
+def _map_combine_wrapper((map_func, combine_func, chunk, opts, jobid, call)):
+    """ Called through multi_mapreduce with a combine_func, chunk is a list of
+        (oid, source)
+    """
+    _sync_worker(call)
+    results = [ _map_reduce_wrapper((map_func, i, src, opts, jobid, call)) for i, src in chunk ]
+    return len(chunk), _combine_wrapper((combine_func, results, opts, call))
+
+def _combine_wrapper((func, results, opts, call)):
+    try:
+        _sync_worker(call)
+        return func(results, opts)
     except:
         print '-'*60
         traceback.print_exc()
         print '-'*60
+        return None
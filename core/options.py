@@ -42,10 +42,63 @@ import api, otypes
 ## it could break the scheme used here.
 SUFFIX_DELIM = '='
 
+## The opts_doc of each module compiled into a schema, once when the module is
+## initialized (or on first use), so that the functions below do not walk and
+## sort opts_doc on every exists, retrieve and store.
+##   schemas: module name => schema
+schemas = dict()
+
+class schema:
+    """ The options of a module: sorted option and mangle keys, defaults,
+        the keys without a usable default and the type of each option.
+    """
+    __slots__ = ("fields", "mangles", "defaults", "missing", "types", "suffix")
+
+    def __init__(self, mod_name, opts_doc):
+        mangles = []
+        defaults, missing, types = {}, set(), {}
+        for field in opts_doc:
+            try:
+                if opts_doc[field]["mangle"]:
+                    mangles.append(field)
+            except KeyError:
+                raise otypes.OxideError("%s Module writer left out the mangle field in options."%mod_name)
+            if opts_doc[field].get("default") is None:
+                missing.add(field)
+            else:
+                defaults[field] = opts_doc[field]["default"]
+            types[field] = opts_doc[field].get("type")
+        self.fields = tuple(sorted(opts_doc))
+        self.mangles = tuple(sorted(mangles))
+        self.defaults = defaults
+        self.missing = frozenset(missing)
+        self.types = types
+        self.suffix = suffix_builder(self.mangles)
+
+def suffix_builder(mangles):
+    """ Returns a function of opts that builds the suffix for mangles """
+    if not mangles:
+        return lambda opts: ""
+    if len(mangles) == 1:
+        field = mangles[0]
+        return lambda opts: str(opts[field])
+    return lambda opts: SUFFIX_DELIM.join([ str(opts[field]) for field in mangles ])
+
+def compile_schema(mod_name, doc):
+    """ Compile and keep the schema of mod_name from its documentation """
+    if not doc:
+        raise TypeError("No documentation for module %s" % mod_name)
+    schemas[mod_name] = schema(mod_name, doc["opts_doc"])
+    return schemas[mod_name]
+
+def get_schema(mod_name):
+    s = schemas.get(mod_name)
+    if s is None:
+        s = compile_schema(mod_name, api.documentation(mod_name))
+    return s
 
 def normalize_mangled_options(mod_name, opts):
-    mfields = mangle_fields (mod_name)
-    if mfields:
+    if get_schema(mod_name).mangles:
         norm_options = sorted (opts.items())
     else:
         norm_options = list()
@@ -55,25 +108,14 @@ def normalize_mangled_options(mod_name, opts):
 def mangle_fields(mod_name): # exported
     """ Returns the keys of the mangled options for the given module. The
     returned keys are sorted. """
-    doc = api.documentation(mod_name)
-    all_opts = doc["opts_doc"]
-        
-    mangles = list()
-    for field in all_opts:
-        try:
-            if all_opts[field]["mangle"]:
-                mangles.append(field)
-        except KeyError:
-            raise otypes.OxideError("%s Module writer left out the mangle field in options."%mod_name)
-    mangles.sort()
-    return mangles
+    return list(get_schema(mod_name).mangles)
 
 def mangle_options (mod_name, opts):
     """
     Return subset of module's options dictionary 'opts'; only mangle options
     will be in returned dictionary.
     """
-    mangle_keys = mangle_fields (mod_name)
+    mangle_keys = get_schema(mod_name).mangles
 
     mangle_dict = dict ( [ (k,v) for (k,v) in opts.iteritems()
                            if k in mangle_keys ])
@@ -85,16 +127,10 @@ def build_suffix(mod_name, opts):
     like this: val1=val2=val3, where the values are in the order of their
     respective keys. Only mangle options are included in the suffix.
     """
-    
-    suffix = "" # default val
-    mfields = mangle_fields(mod_name)
-    if len(mfields) != 0: 
-        doc = api.documentation(mod_name)
-        slist = []
-        for field in mfields: 
-            slist.append(str((opts[field])))
-        suffix = SUFFIX_DELIM.join(slist)
-    return suffix
+    s = schemas.get(mod_name)
+    if s is None:
+        s = get_schema(mod_name)
+    return s.suffix(opts)
 
 def parse_suffix(mod_name, suffix):
     """
@@ -102,13 +138,9 @@ def parse_suffix(mod_name, suffix):
     filled in from the suffix.
     """
 
-    doc = api.documentation(mod_name)
-    all_opts = doc["opts_doc"]
-
-    # returns field names, sorted (same order as their vals appear in suffix)
-
-    mangles = mangle_fields(mod_name)
-    vals = [cast_string_to_type (s)
+    # field names, sorted (same order as their vals appear in suffix)
+    mangles = get_schema(mod_name).mangles
+    vals = [otypes.cast_string (s)
             for s in suffix.split(SUFFIX_DELIM)]
     
     if len(mangles) != len(vals):
@@ -124,26 +156,21 @@ def validate_opts(mod_name, opts, only_mangle=False):
     Validate opts checks for option correctness and fills in
     defaults. TODO: can oshell._validate_opts() use this function instead?
     """
-    doc = api.documentation(mod_name)
-    if not doc: return False
-    opts_doc = doc["opts_doc"]
-    mangled_fields = mangle_fields(mod_name)
-    for k in opts_doc:
-        if not only_mangle or k in mangled_fields:
-            if not opts.has_key(k): # No option provided for this key
-                if opts_doc[k].has_key("default"):
-                    logger.debug("%s option '%s' not provided. Setting to default value.", mod_name, k)
-                    if opts_doc[k]["default"] == None:
-                        logger.error("Module %s has no default for required key %s", mod_name, k)
-                        return False
-                    opts[k] = opts_doc[k]["default"]
-                else:
-                    logger.error("Module %s has no default for required key %s", mod_name, k)
-                    return False
-            try:
-                tmp = opts_doc[k]["type"](opts[k])
-            except (ValueError, TypeError):
-             #if not isinstance(opts[k], opts_doc[k]["type"]): # Wrong option type provided
-                logger.error("%s option '%s' type mismatch.", mod_name, k)
+    s = schemas.get(mod_name)
+    if s is None:
+        doc = api.documentation(mod_name)
+        if not doc: return False
+        s = compile_schema(mod_name, doc)
+    for k in (s.mangles if only_mangle else s.fields):
+        if k not in opts: # No option provided for this key
+            if k in s.missing:
+                logger.error("Module %s has no default for required key %s", mod_name, k)
                 return False
+            logger.debug("%s option '%s' not provided. Setting to default value.", mod_name, k)
+            opts[k] = s.defaults[k]
+        try:
+            s.types[k](opts[k])
+        except (ValueError, TypeError):
+            logger.error("%s option '%s' type mismatch.", mod_name, k)
+            return False
     return True
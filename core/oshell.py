@@ -23,7 +23,7 @@ THE SOFTWARE.
 """
 
 import os, logging, time, cPickle, types, traceback, sys, shutil, sys_utils
-from collections import defaultdict
+from collections import defaultdict, Mapping
 from glob import glob 
 import oxide as local_oxide
 import shell_api
@@ -31,7 +31,7 @@ from otypes import cast_string
 from cmd import Cmd
 from code import InteractiveConsole, InteractiveInterpreter
 
-dict_type = (dict, defaultdict)
+dict_type = (dict, defaultdict, Mapping)
 collection_type = (list, set, tuple)
 modifiers = ("%", "&", "$", "@", "-", "^")
 readline_enabled = False
@@ -149,9 +149,9 @@ class OxideShell(Cmd):
         self.logger.debug("Initializing subcommands")
         self.commands["tag"] = ("apply", "get", "filter")
         self.commands["show"] = ("collections", "context", "modules", "stats", 
-                                 "orphans", "vars", "plugins", "aliases")
+                                 "orphans", "vars", "plugins", "aliases", "startup", "metrics")
         self.show_completions = ("collections", "context", "modules ", "stats", 
-                                 "orphans", "vars", "plugins ", "aliases")
+                                 "orphans", "vars", "plugins ", "aliases", "startup", "metrics ")
         self.commands["context"] = ("add", "clear", "remove", "set", "load", "save")
         self.commands["collection"] = ("create", "delete", "rename", "add", "remove")
         self.commands["history"] = ("clear")
@@ -412,6 +412,8 @@ class OxideShell(Cmd):
         show collections [--verbose]
         show context
         show stats
+        show metrics [<module>]
+        show startup
         show orphans
         show vars
         show plugins
@@ -465,6 +467,26 @@ class OxideShell(Cmd):
         self.parse_pipe(commands)
                 
                 
+    @error_handler
+    def do_trace(self, line):
+        """
+    Description: Run a command and trace the modules it retrieves, processes
+        and stores, including the ones modules pull in as dependencies. The
+        trace is written to trace.folded (collapsed stacks for flamegraph.pl)
+        and trace.json (chrome://tracing) in the scratch dir.
+    Syntax: trace <command>
+        """
+        if not line:
+            raise ShellSyntaxError("")
+        path = os.path.join(self.oxide.scratch_dir, "trace")
+        self.oxide.start_trace(path)
+        try:
+            self.onecmd(line)
+        finally:
+            spans = self.oxide.stop_trace()
+        self.print_trace(spans, self.oxide.tracer.write(spans, path))
+
+
     @error_handler
     def do_run(self, line):
         """
@@ -787,6 +809,13 @@ class OxideShell(Cmd):
                 mod_stats = self.oxide.modules_stats()
                 self.print_item(mod_stats, "Modules Stats")
                 
+            elif subcommand == "startup": # show startup
+                self.print_startup()
+                
+            elif subcommand == "metrics": # show metrics [<module>]
+                self.print_metrics(args)
+                args = []
+                
             elif subcommand == "vars": # show vars
                 self.print_item(self.vars, "Variables")
                 if not self.vars:
@@ -865,6 +894,12 @@ class OxideShell(Cmd):
                         for d in dirs:
                             shutil.rmtree(os.path.join(root, d))
 
+                    self.oxide.cache_clear()
+                    self.oxide.datastore.cleanup_state()
+                    self.oxide.importer.cleanup_state()
+                    self.oxide.catalog.cleanup_state()
+                    self.oxide.tags.cleanup_state()
+                    self.oxide.metrics.cleanup_state()
                     print "  - Deleted contents of %s" % path
                 elif subcommand == "orphans": # drop orphans
                     oids = self.oxide.retrieve_all_keys("file_meta")
@@ -1436,7 +1471,7 @@ class OxideShell(Cmd):
         if "verbose" in opts: 
             self.print_item(self.oxide.retrieve_all("collections_meta"), header="Collections")
         else:
-            cm = self.oxide.retrieve_all("collections_meta")
+            cm = self.oxide.catalog.get_catalog(self.oxide.datastore.datastore_dir)[0]
             collections = {}
             for c in cm:
                 collections[cm[c]["name"]] = cm[c]["num_oids"]
@@ -1444,6 +1479,64 @@ class OxideShell(Cmd):
         self.print_header()
 
      
+    def print_startup(self):
+        """ Print function for the command: show startup
+        """
+        stats = self.oxide.startup_stats()
+        self.print_header("Startup")
+        print "  Module initialization: %.3fs" % stats["initialize"]
+        print "  Modules not imported yet: %d" % stats["deferred"]
+        times = sorted(stats["modules"].items(), key=lambda t: t[1], reverse=True)
+        if times:
+            print "  Module import times:"
+        for mod_name, seconds in times:
+            print "    %-30s %.3fs" % (mod_name, seconds)
+        self.print_header()
+
+    def print_metrics(self, items):
+        """ Print function for the command: show metrics [<module>]. With a
+            module name also print the histogram and slowest oids of each
+            entry.
+        """
+        mod_name = None
+        if items:
+            mod_name = items[0]
+        entries = self.oxide.metrics_stats(mod_name)
+        self.print_header("Metrics")
+        if not entries:
+            print "  <EMPTY>"
+        else:
+            print "  %-24s %-10s %-8s %7s %9s %9s %9s %9s %7s %8s" % ("module", "src_type", "kind",
+                  "calls", "wall", "mean", "cpu", "read MB", "hits", "rss MB")
+        keys = sorted(entries, key=lambda k: entries[k]["wall"], reverse=True)
+        for key in keys:
+            mod, src_type, kind = key
+            e = entries[key]
+            print "  %-24s %-10s %-8s %7d %8.2fs %8.3fs %8.2fs %9.2f %7d %8.1f" % (mod,
+                  src_type or "-", kind, e["calls"], e["wall"], e["wall"] / max(1, e["calls"]),
+                  e["cpu"], e["read"] / 1048576., e["cache_hits"], e["peak_rss"] / 1048576.)
+            if not mod_name:
+                continue
+            print "      written: %.2f MB" % (e["written"] / 1048576.)
+            print "      histogram: " + "  ".join( "%s:%d" % ("<%gs" % bound if bound else "rest", count)
+                                                   for bound, count in e["histogram"] )
+            for wall, oid in e["slowest"]:
+                print "      %8.3fs  %s" % (wall, oid)
+        self.print_header()
+
+    def print_trace(self, spans, files):
+        """ Print function for the command: trace <command>
+        """
+        self.print_header("Trace")
+        computed = len([ s for s in spans if s["status"] == "compute" ])
+        print "  %d spans, %d computed" % (len(spans), computed)
+        print "  %9s %7s %7s  %s" % ("self", "calls", "compute", "span")
+        for seconds, label, calls, compute in self.oxide.tracer.top(spans):
+            print "  %8.3fs %7d %7d  %s" % (seconds, calls, compute, label)
+        for f in files:
+            print "  - Wrote %s" % f
+        self.print_header()
+
     def print_modules(self, items, opts):
         """ Print function for the commanbd show modules [ <module_name> ]
         """
@@ -1488,6 +1581,8 @@ class OxideShell(Cmd):
         print "  - ", doc["description"]
         type = self.oxide.get_mod_type(name)
         print "  -   Type: ", type
+        if doc.get("deps"):
+            print "  -   Depends on: ", ", ".join(doc["deps"])
         opts_doc = doc["opts_doc"]
         if opts_doc:
             print "  -   Options:"
@@ -1534,7 +1629,7 @@ class OxideShell(Cmd):
         
     def time_filter(self, oid_list, opts):
         """ Given an oid_list and opts with year, mon, day return a filtered 
-            oid list where the tags match all of the opts given 
+            oid list where the time tags match all of the opts given 
         """
         if "y" in opts:
             opts["year"] = opts["y"]
@@ -1563,28 +1658,7 @@ class OxideShell(Cmd):
         if "day" in opts:
             day = opts["day"]
             
-        filtered_oids = []
-        for oid in oid_list:
-            tags = self.oxide.get_tags(oid)
-            for tag in tags:
-                if "time" in tag and isinstance(tags[tag], (float, int)):
-                    t = time.localtime(tags[tag])
-                    if (year and mon and day and year == t.tm_year 
-                       and mon == t.tm_mon and day == t.tm_mday):
-                            filtered_oids.append(oid)
-                    elif year and mon and year == t.tm_year and mon == t.tm_mon:
-                            filtered_oids.append(oid)
-                    elif mon and day and mon == t.tm_mon and day == t.tm_mday:
-                            filtered_oids.append(oid)
-                    elif year and day and year == t.tm_year and day == t.tm_mday:
-                            filtered_oids.append(oid)
-                    elif year and year == t.tm_year:
-                        filtered_oids.append(oid)
-                    elif mon and mon == t.tm_mon:
-                        filtered_oids.append(oid)
-                    elif day and day == t.tm_mday:
-                        filtered_oids.append(oid)
-        return filtered_oids
+        return self.oxide.time_filter(oid_list, year, mon, day)
         
         
     def tag_value_split(self, arg):
@@ -23,6 +23,8 @@ THE SOFTWARE.
 """
 
 import logging
+from collections import Mapping
+import api
 
 log_levels = ["DEBUG", "INFO", "WARN", "WARNING", "ERROR", "CRITICAL", "FATAL"]
 class OxideError(Exception):
@@ -40,6 +42,39 @@ class AnalysisModuleError(OxideError):
 class InvalidOIDList(AnalysisModuleError):
     pass
 
+class LockTimeout(OxideError):
+    pass
+
+class RemoteError(OxideError):
+    pass
+
+class raw_record(Mapping):
+    """ The record a module stores for data kept raw by the datastore. It
+        reads like the old {"data":<bytes>} record. Use api.raw_data to get
+        at the bytes without copying them.
+    """
+    def __init__(self, mod_name, oid, size):
+        self.mod_name = mod_name
+        self.oid = oid
+        self.size = size
+
+    def __getitem__(self, key):
+        if key != "data":
+            raise KeyError(key)
+        data = api.raw_data(self.mod_name, self.oid)
+        if data is None:
+            raise KeyError(key)
+        return data[:]
+
+    def __contains__(self, key):
+        return key == "data"
+
+    def __len__(self):
+        return 1
+
+    def __iter__(self):
+        return iter(["data"])
+
 def cast_string(s):
     if not isinstance (s, str) or s == "":
         return s
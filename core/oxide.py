@@ -1,5 +1,5 @@
 from __future__ import absolute_import
-import os, sys, platform, imp, hashlib, logging, time, signal
+import os, sys, platform, imp, hashlib, logging, time, signal, tempfile
 from collections import defaultdict
 import core.config as config
 
@@ -7,9 +7,13 @@ import core.config as config
 sys.path.insert(0, config.dir_oxide)
 sys.path.insert(0, config.dir_libraries)
 
-import sys_utils, ologger, api, otypes, progress, options, otypes
-from tags import get_tags, apply_tags, tag_filter
-import datastore_filesystem as datastore
+import sys_utils, ologger, api, otypes, progress, options, otypes, cache, importer, scheduler, catalog, manifest, metrics, tracer
+import tags
+from tags import get_tags
+if config.datastore_backend == "sqlite":
+    import datastore_sqlite as datastore
+else:
+    import datastore_filesystem as datastore
 
 name = "oxide"
 logger = logging.getLogger(name)
@@ -25,7 +29,24 @@ except ImportError:
 for d in config.get_section("dir").values():
     sys_utils.assert_dir_exists(d)
 
-initialized_modules = {} # Used to call modules
+result_cache = cache.lru_cache(config.cache_max*1048576, config.cache_on)
+
+# The source module of each oid this process has seen, filled in when a
+# source module stores a record and when source() finds one, so resolving an
+# oid a second time checks one module instead of all of them. Another
+# process may flush the oid, so an entry is confirmed with exists before it
+# is used. Workers start each call empty and get the sources of their oids
+# from the parent along with the tasks.
+#   source_map: oid => source module name
+source_map = {}
+
+# Used to call modules. Modules are imported on first use, see
+# initialize_all_modules.
+initialized_modules = manifest.lazy_modules(lambda mod_name: load_module(mod_name))
+sys.meta_path.append(manifest.module_finder(initialized_modules))
+module_docs = {} # mod_name => documentation() from the manifest
+module_dirs = {} # mod_name => directory holding the module
+startup_times = {"modules":{}} # seconds spent starting up, see startup_stats
 module_types = ["source", "extractors", "analyzers", "map_reducers"]
 modules_available = {}
 for mod_type in module_types:
@@ -43,7 +64,10 @@ def documentation(mod_name):
     if mod_name not in initialized_modules:
         logger.error("%s not found.", mod_name)
         return None
-    return initialized_modules[mod_name].documentation()
+    doc = module_docs.get(mod_name)
+    if doc is None:
+        return initialized_modules[mod_name].documentation()
+    return doc
 
 def get_mod_type(mod_name):
     """ Return the type of a module
@@ -57,20 +81,31 @@ def single_call_module(type, mod_name, oid_list, opts):
     """ Calls any module type with one oid_list
     """
     if type in ["extractors", "source"]:
-        return initialized_modules[mod_name].process(oid_list, opts)
+        func = initialized_modules[mod_name].process
+        return call_module(mod_name, "process", oid_list, func, oid_list, opts)
     elif type in ["analyzers"]:
-        return initialized_modules[mod_name].results(oid_list, opts)
+        func = initialized_modules[mod_name].results
+        return call_module(mod_name, "results", None, func, oid_list, opts)
     elif type in ["map_reducers"]:
-        p = progress.progress(len(oid_list))
+        mod = initialized_modules[mod_name]
+        p = progress.progress(len(oid_list), name=mod_name)
         jobid = get_cid_from_oid_list(oid_list)
         results = []
         for oid in oid_list:
-            results.append( initialized_modules[mod_name].mapper(oid, opts, jobid) )
+            results.append( call_module(mod_name, "mapper", oid, mod.mapper, oid, opts, jobid) )
             p.tick()
-        return initialized_modules[mod_name].reducer(results, opts, jobid)
+        return call_module(mod_name, "reducer", None, mod.reducer, results, opts, jobid)
     else:
         raise otypes.UnrecognizedModule("Attempt to call module not in module list")
+
+def call_module(mod_name, kind, oid, func, *args):
+    """ Returns func(*args), the kind (process, mapper, reducer or results)
+        function of mod_name, and records its cost in the metrics store
+    """
+    return tracer.span(kind, mod_name, oid, True, metrics.call,
+                       datastore.datastore_dir, mod_name, kind, oid, func, *args)
     
+@tracer.traced("process")
 def process(mod_name, oid_list, opts=None, force=False):
     """ Calls a module over an oid_list without returning results.
     """
@@ -87,17 +122,21 @@ def process(mod_name, oid_list, opts=None, force=False):
         return False
     try:
         # Prune analysis that already exists
-        new_list = []
-        for oid in oid_list:
-            if not exists(mod_name, oid, opts) or force:
-                new_list.append(oid)
+        if force:
+            new_list = oid_list
+        else:
+            found = exists_many(mod_name, oid_list, opts)
+            new_list = [ oid for oid in oid_list if not found[oid] ]
         if len(new_list) == 0:  # Everything was already processed
             return True
+        if force:
+            for oid in new_list:
+                result_cache.invalidate(mod_name, oid)
         # Process the oid_list        
         if len(new_list) == 1 or not config.multiproc_on or mod_type in ["analyzers"]:
             ret_val = True
             if mod_type in ["extractors", "source"]:
-                p = progress.progress(len(new_list))
+                p = progress.progress(len(new_list), name=mod_name)
                 for oid in new_list:
                     if not single_call_module(mod_type, mod_name, oid, opts):
                         ret_val = False
@@ -117,12 +156,19 @@ def process(mod_name, oid_list, opts=None, force=False):
                 func = initialized_modules[mod_name].mapper
             else:
                 raise otypes.UnrecognizedModule("Attempt to call module not of known type.")
+            scheduler.schedule(mod_name, new_list)
             return mp.multi_map(func, new_list, opts, True)
     except:
         datastore.cleanup()
         raise
+    finally:
+        metrics.flush()
 
 def single_retrieve(mod_name, oid, opts, lock):
+    if not lock:
+        data = result_cache.get(mod_name, oid, options.build_suffix(mod_name, opts))
+        if data is not None:
+            return data
     if not datastore.exists(mod_name, oid, opts):
         if not options.validate_opts(mod_name, opts):
             logger.warning("Failed to validate opts for %s : %s", mod_name, opts)
@@ -130,14 +176,53 @@ def single_retrieve(mod_name, oid, opts, lock):
         process(mod_name, oid, opts)
     if lock:
         return datastore.retrieve_lock(mod_name, oid, opts)
-    return datastore.retrieve(mod_name, oid, opts)
+    return cached_retrieve(mod_name, oid, opts)
+
+def cached_retrieve(mod_name, oid, opts):
+    """ Retrieve stored results through the result cache. The returned data
+        is the caller's own copy.
+    """
+    suffix = options.build_suffix(mod_name, opts)
+    data = result_cache.get(mod_name, oid, suffix)
+    if data is None:
+        data = datastore.retrieve(mod_name, oid, opts)
+        result_cache.put(mod_name, oid, suffix, data)
+    return data
     
 def multi_retrieve(mod_name, oid_list, opts, lock):
+    found = exists_many(mod_name, oid_list, opts)
+    new_list = [ oid for oid in oid_list if not found[oid] ]
+    if new_list:
+        if options.validate_opts(mod_name, opts):
+            process(mod_name, new_list, opts)
+        else:
+            logger.warning("Failed to validate opts for %s : %s", mod_name, opts)
+    if lock:
+        results = datastore.retrieve_many(mod_name, oid_list, opts, lock=True)
+        return dict([ (oid, results.get(oid)) for oid in oid_list ])
+    return retrieve_many(mod_name, oid_list, opts)
+
+def retrieve_many(mod_name, oid_list, opts=None):
+    """ Returns a dict of oid => stored results of mod_name for each oid in
+        oid_list, None where nothing is stored. Unlike retrieve this never
+        calls the module.
+    """
+    if not opts: opts = {}
+    suffix = options.build_suffix(mod_name, opts)
     results = {}
+    misses = []
     for oid in oid_list:
-        results[oid] = single_retrieve(mod_name, oid, opts, lock)
+        results[oid] = result_cache.get(mod_name, oid, suffix)
+        if results[oid] is None:
+            misses.append(oid)
+    if misses:
+        data = datastore.retrieve_many(mod_name, misses, opts)
+        for oid in misses:
+            results[oid] = data.get(oid)
+            result_cache.put(mod_name, oid, suffix, results[oid])
     return results
     
+@tracer.traced("retrieve")
 def retrieve(mod_name, oid_list, opts=None, lock=False):
     """ Returns the results of calling a module over an oid_list.
     """
@@ -164,7 +249,7 @@ def retrieve(mod_name, oid_list, opts=None, lock=False):
             else:
                 if len(oid_list) == 1:
                     if datastore.exists(mod_name, oid_list[0], opts):
-                        return datastore.retrieve(mod_name, oid_list[0], opts)
+                        return cached_retrieve(mod_name, oid_list[0], opts)
                 if not options.validate_opts(mod_name, opts):
                     logger.warning("Failed to validate opts for %s : %s", mod_name, opts)
                     return False
@@ -174,30 +259,34 @@ def retrieve(mod_name, oid_list, opts=None, lock=False):
                 if len(oid_list) == 1:
                     return single_retrieve(mod_name, oid_list[0], opts, lock)
                 else:
-                    new_list = []
-                    for oid in oid_list:
-                        if not exists(mod_name, oid, opts):
-                            new_list.append(oid)
+                    found = exists_many(mod_name, oid_list, opts)
+                    new_list = [ oid for oid in oid_list if not found[oid] ]
                     if new_list and not options.validate_opts(mod_name, opts):
                         logger.warning("Failed to validate opts for %s : %s", mod_name, opts)
                         return None
                     func = initialized_modules[mod_name].process
+                    scheduler.schedule(mod_name, new_list)
                     mp.multi_map(func, new_list, opts, True)
                     return multi_retrieve(mod_name, oid_list, opts, lock)
             else:  # Map Reducer module
                 if len(oid_list) == 1:
                     if datastore.exists(mod_name, oid_list[0], opts):
-                        return datastore.retrieve(mod_name, oid_list[0], opts)
+                        return cached_retrieve(mod_name, oid_list[0], opts)
                 if not options.validate_opts(mod_name, opts):
                     logger.warning("Failed to validate opts for %s : %s", mod_name, opts)
                     return False
                 jobid = get_cid_from_oid_list(oid_list)
                 map_func = initialized_modules[mod_name].mapper
                 reduce_func = initialized_modules[mod_name].reducer
-                return mp.multi_mapreduce(map_func, reduce_func, oid_list, opts, jobid)
+                combine_func = getattr(initialized_modules[mod_name], "combiner", None)
+                found = exists_many(mod_name, oid_list, opts)
+                scheduler.schedule(mod_name, [ oid for oid in oid_list if not found[oid] ])
+                return mp.multi_mapreduce(map_func, reduce_func, oid_list, opts, jobid, combine_func)
     except:
         datastore.cleanup()
         raise
+    finally:
+        metrics.flush()
         
 def exists(mod_name, oid, opts={}):
     if not options.validate_opts(mod_name, opts, only_mangle=True):
@@ -208,6 +297,17 @@ def exists(mod_name, oid, opts={}):
         val = False
     return val
 
+def exists_many(mod_name, oid_list, opts=None):
+    """ Returns a dict of oid => True/False for each oid in oid_list
+    """
+    if not opts: opts = {}
+    if not options.validate_opts(mod_name, opts, only_mangle=True):
+        return dict.fromkeys(oid_list, False)
+    try:
+        return datastore.exists_many(mod_name, oid_list, opts)
+    except TypeError:
+        return dict.fromkeys(oid_list, False)
+
 def get_field(mod_name, oid, field, opts=None):
     """ Given a module name, oid and a field return the value of that field
     """
@@ -222,34 +322,174 @@ def get_field(mod_name, oid, field, opts=None):
 def retrieve_all(mod_name):
     return datastore.retrieve_all(mod_name)
         
+@tracer.traced("store")
 def store(mod_name, oid, data, opts=None, block=True):
-    return datastore.store(mod_name, oid, data, opts, block)
+    result_cache.invalidate(mod_name, oid)
+    if not datastore.store(mod_name, oid, data, opts, block):
+        return False
+    if mod_name in modules_available["source"]:
+        source_map[oid] = mod_name
+    return True
+
+@tracer.traced("store")
+def store_many(mod_name, data_dict, opts=None, block=True):
+    """ Store data_dict[oid] as the results of mod_name for each oid
+    """
+    if not opts: opts = {}
+    for oid in data_dict:
+        result_cache.invalidate(mod_name, oid)
+    if not datastore.store_many(mod_name, data_dict, opts, block):
+        return False
+    if mod_name in modules_available["source"]:
+        source_map.update(dict.fromkeys(data_dict, mod_name))
+    return True
+
+def store_raw(mod_name, oid, data):
+    """ Store the string data as the raw bytes of oid along with a record
+        that reads them back as its "data" field
+    """
+    fd, tmp = tempfile.mkstemp(prefix="TMP", dir=datastore.datastore_dir)
+    try:
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    return store_raw_file(mod_name, oid, tmp)
+
+def store_raw_file(mod_name, oid, filename):
+    """ Same as store_raw but moves the bytes in from filename
+    """
+    size = os.path.getsize(filename)
+    result_cache.invalidate(mod_name, oid)
+    if not datastore.store_raw(mod_name, oid, filename):
+        return False
+    return store(mod_name, oid, otypes.raw_record(mod_name, oid, size), {})
+
+def raw_data(mod_name, oid):
+    """ Returns a read-only mmap of the raw bytes mod_name stored for oid.
+        Slicing it only copies the slice. For data that is not stored raw
+        the "data" field of the record is returned instead.
+    """
+    data = datastore.retrieve_raw(mod_name, oid)
+    if data is not None:
+        return data
+    record = retrieve(mod_name, oid)
+    if not record or isinstance(record, otypes.raw_record) or "data" not in record:
+        return None
+    return record["data"]
+
+def cache_stats():
+    """ Return the hit, miss and eviction counters of the result cache
+    """
+    return result_cache.stats()
+
+def cache_clear():
+    result_cache.clear()
+    source_map.clear()
+
+def progress_stats():
+    """ Returns the count, rate and time left of the latest run of each
+        module, see progress.stats
+    """
+    return progress.stats()
+
+def lock_stats():
+    """ Return the lock wait counters of the datastore for this process
+    """
+    return datastore.lock_stats()
+
+def io_stats():
+    """ Return the bytes this process read from and wrote to the datastore
+    """
+    return datastore.io_stats()
+
+def start_trace(path=None):
+    """ Start tracing the retrieve, process and store calls of this process
+        and its workers, see tracer
+    """
+    if not path:
+        path = os.path.join(config.dir_scratch, "trace")
+    tracer.start(path)
+
+def stop_trace():
+    """ Stop tracing and return the spans, see tracer.stop
+    """
+    return tracer.stop()
+
+def metrics_stats(mod_name=None):
+    """ Returns the cost of the recorded calls of every module, or only of
+        mod_name, as {(mod_name, src_type, kind): entry}, see metrics.summary
+    """
+    return metrics.summary(datastore.datastore_dir, mod_name)
 
 def source(oid):
     if not oid:
         return None
+    if oid in source_map:
+        if exists(source_map[oid], oid, {}):
+            return source_map[oid]
+        del source_map[oid]
     for source in modules_available["source"]:
         if exists(source, oid, {}):
             logger.debug("Source of %s is %s", oid, source)
+            source_map[oid] = source
             return source 
     return None
 
+def sources(oid_list):
+    """ Returns a dict of oid => source module (or None) for each oid in oid_list
+    """
+    results = dict.fromkeys(oid_list)
+    remaining = []
+    cached = {}
+    for oid in oid_list:
+        if oid in source_map:
+            cached.setdefault(source_map[oid], []).append(oid)
+        elif oid:
+            remaining.append(oid)
+    for source, oids in cached.iteritems():
+        found = exists_many(source, oids, {})
+        for oid in oids:
+            if found[oid]:
+                results[oid] = source
+            else:
+                del source_map[oid]
+                remaining.append(oid)
+    for source in modules_available["source"]:
+        if not remaining:
+            break
+        found = exists_many(source, remaining, {})
+        for oid in remaining:
+            if found[oid]:
+                results[oid] = source_map[oid] = source
+        remaining = [ oid for oid in remaining if not found[oid] ]
+    return results
+
 ########### DELETE FUNCTIONS ###################################################
 
 def flush_oid(oid):
     logger.warning("Flushing data for oid %s", oid)
-    for cid in collection_cids():
-        if oid in expand_oids(cid):
-            prune_collection_by_cid(cid, [oid])
-            flush_oid(cid)
+    for cid in catalog.containing(datastore.datastore_dir, oid):
+        prune_collection_by_cid(cid, [oid])
+        flush_oid(cid)
                 
+    result_cache.invalidate_oid(oid)
+    source_map.pop(oid, None)
     for mod_type in modules_available:
         for mod_name in modules_available[mod_type]:
             datastore.delete_oid_data(mod_name, oid)
+    catalog.discard(datastore.datastore_dir, oid)
+    tags.discard(datastore.datastore_dir, oid)
     
 def flush_module(mod_name):
     logger.warning("Flushing data for module %s", mod_name)
+    result_cache.invalidate(mod_name)
     datastore.delete_module_data(mod_name)
+    for oid in [ oid for oid in source_map if source_map[oid] == mod_name ]:
+        del source_map[oid]
+    if mod_name in ("collections", "collections_meta"):
+        catalog.reset(datastore.datastore_dir)
+    if mod_name == "tags":
+        tags.reset(datastore.datastore_dir)
 
 ############## MODULES RELATED FUNCTIONS #######################################
 def module_types_list():
@@ -285,25 +525,33 @@ def modules_stats(modules="all", mod_type="all", show_private=True):
 
 ############## FILE RELATED FUNCTIONS ##########################################
 def import_file(file_location):
-    fd = sys_utils.import_file(file_location, config.file_max)
+    known = importer.get_prefix_index(datastore.datastore_dir)
+    fd = importer.stream_file(file_location, datastore.datastore_dir, config.file_max, known)
     if not fd:
         return None, False
+    return store_import(file_location, fd)
 
-    oid = get_oid_from_data(fd["data"])
-    if not oid:
-        logger.error("Not able to get and oid for %s", file_location)
-        return None, False
-    
-    opts_file = { "file_contents":fd["data"]}   
-    opts_meta = { "file_location":file_location, "stat":fd["file_stat"]}   
-
-    if not exists("files", oid, opts_file): 
-        new_file = True
-        if not process("files", oid, opts_file):
-            logger.error("Not able to process file data %s",file_location)
+def store_import(file_location, fd):
+    """ Finish the import of a file streamed by importer: move its contents
+        into the files module and record its metadata.
+    """
+    oid = fd["oid"]
+    new_file = not exists("files", oid)
+    if new_file and not fd["tmp"]: # It was only hashed but is not stored
+        fd = importer.stream_file(file_location, datastore.datastore_dir, config.file_max)
+        if not fd or fd["oid"] != oid:
+            logger.error("%s changed while it was imported", file_location)
             return None, False
-    else:
-        new_file = False
+    if fd["tmp"]:
+        if not new_file:
+            os.remove(fd["tmp"])
+        else:
+            if not store_raw_file("files", oid, fd["tmp"]):
+                logger.error("Not able to process file data %s",file_location)
+                return None, False
+    importer.prefix_add(datastore.datastore_dir, fd["prefix"], oid)
+
+    opts_meta = { "file_location":file_location, "stat":fd["file_stat"]}   
     if not process("file_meta", oid, opts_meta, force=True):
         logger.error("Not able to process file metadata %s",file_location)
         return None, False
@@ -311,7 +559,6 @@ def import_file(file_location):
     logger.debug("%s file import complete.", file_location)
     return oid, new_file
 
-
 def import_files(files_list):
     if not isinstance(files_list, list):
         logger.error("files must be of type list.")
@@ -319,14 +566,22 @@ def import_files(files_list):
     try:
         new_file_count = 0
         oids = []
-        p = progress.progress(len(files_list))
-        for file_location in files_list:
-            oid, new_file = import_file(file_location)
+        p = progress.progress(len(files_list), name="import")
+        known = importer.get_prefix_index(datastore.datastore_dir)
+        for file_location, fd in importer.stream_files(files_list, datastore.datastore_dir,
+                                                       config.file_max, known,
+                                                       config.file_import_threads,
+                                                       config.file_import_inflight*1048576):
+            if fd:
+                oid, new_file = store_import(file_location, fd)
+            else:
+                oid, new_file = None, False
             p.tick()
             if oid:
                 oids.append(oid)
                 if new_file:
                     new_file_count += 1
+        importer.save_prefix_index(datastore.datastore_dir)
     except:
         datastore.cleanup()
         raise
@@ -352,7 +607,16 @@ def set_logging_level(level):
     
 ################### INTERNAL FUNCTIONS #########################################
 def initialize_all_modules():
+    """ Find the modules and register them from the module manifest. Only
+        the modules that are new or changed since the manifest was written
+        are imported here, the others are imported on first use.
+    """
     logger.debug("initialize_all_modules (%s)", module_types)
+    start = time.time()
+    manifest_file = os.path.join(config.dir_scratch, manifest.MANIFEST_FILE)
+    entries = manifest.load(manifest_file)
+    new_entries = {}
+    lib_mtimes = manifest.module_mtimes(config.dir_libraries)
     for mod_type in module_types:
         mod_dir = os.path.join(config.dir_modules, mod_type)
         sys_utils.assert_dir_exists(mod_dir)
@@ -367,18 +631,71 @@ def initialize_all_modules():
                 this_mod_dir = os.path.join(dev_dir, mod_name)
             init_file = os.path.join(this_mod_dir,"__init__.py")
             interface_file = os.path.join(this_mod_dir, "module_interface.py")
-            if (os.path.isdir(this_mod_dir) and os.path.isfile(init_file) and
-                 os.path.isfile(interface_file)):
-                if initialize_module(mod_name, os.path.split(this_mod_dir)[0]):
-                    modules_available[mod_type].append(mod_name)
+            if not (os.path.isdir(this_mod_dir) and os.path.isfile(init_file) and
+                    os.path.isfile(interface_file)):
+                continue
+            parent_dir = os.path.split(this_mod_dir)[0]
+            mtimes = manifest.module_mtimes(this_mod_dir)
+            entry = entries.get(mod_name)
+            if (not manifest.is_current(entry, mod_type, parent_dir, mtimes, lib_mtimes)
+                or entry["doc"] is None):
+                module_dirs[mod_name] = parent_dir
+                if timed_initialize(mod_name, parent_dir):
+                    doc = dict.__getitem__(initialized_modules, mod_name).documentation()
+                    entry = manifest.make_entry(mod_type, parent_dir, mtimes, lib_mtimes, doc)
                 else:
-                    logger.debug("Not able to initalize module %s",mod_name)
+                    entry = manifest.make_entry(mod_type, parent_dir, mtimes, lib_mtimes, None, True)
+            new_entries[mod_name] = entry
+            if entry["error"]:
+                logger.debug("Not able to initalize module %s",mod_name)
+                continue
+            if mod_name not in initialized_modules:
+                register_module(mod_name, parent_dir, entry["doc"])
+            modules_available[mod_type].append(mod_name)
+
+    if new_entries != entries:
+        try:
+            manifest.save(manifest_file, new_entries)
+        except (IOError, OSError), err:
+            logger.warning("Not able to save the module manifest: %s", err)
+    startup_times["initialize"] = time.time() - start
     
     # ugly hack to make source module lookup faster, places collections and files first in the list
     modules_available['source'].remove('collections')
     modules_available['source'].remove('files')
     modules_available['source'].insert(0, 'collections')
     modules_available['source'].insert(1, 'files')
+
+def register_module(mod_name, mod_dir, doc):
+    """ Make a module known from its manifest entry without importing it """
+    module_dirs[mod_name] = mod_dir
+    module_docs[mod_name] = doc
+    dict.__setitem__(initialized_modules, mod_name, None)
+    try:
+        options.compile_schema(mod_name, doc)
+    except otypes.OxideError, err:
+        logger.warn("%s", err) # Reported again when its options are used
+
+def load_module(mod_name):
+    """ Import a module registered from the manifest, called on first use """
+    if not timed_initialize(mod_name, module_dirs[mod_name]):
+        raise otypes.OxideError("Not able to import module %s" % mod_name)
+    return dict.__getitem__(initialized_modules, mod_name)
+
+def timed_initialize(mod_name, mod_dir):
+    start = time.time()
+    result = initialize_module(mod_name, mod_dir)
+    startup_times["modules"][mod_name] = time.time() - start
+    return result
+
+def startup_stats():
+    """ Returns where the start up time went: initialize is the seconds spent
+        in initialize_all_modules, modules the import seconds of each module
+        imported so far and deferred the number of modules not imported yet.
+    """
+    deferred = len([ m for m in initialized_modules if not initialized_modules.loaded(m) ])
+    return {"initialize":startup_times.get("initialize", 0), "deferred":deferred,
+            "modules":dict(startup_times["modules"])}
     
 def initialize_module(mod_name, mod_dir):
     # Tweak our sys.modules to import modules from another branch directory
@@ -390,6 +707,10 @@ def initialize_module(mod_name, mod_dir):
         f, filename, description = imp.find_module("module_interface", [filename])
         submod = imp.load_module(mod_name, f, filename, description)
         initialized_modules[mod_name] = submod
+        try:
+            options.compile_schema(mod_name, submod.documentation())
+        except otypes.OxideError, err:
+            logger.warn("%s", err) # Reported again when its options are used
 
     except ImportError, err:
         logger.warn("ImportError:%s", err)
@@ -402,6 +723,16 @@ def initialize_module(mod_name, mod_dir):
         return False
     return True 
 
+################### TAGS FUNCTIONS #############################################
+def apply_tags(oid_list, new_tags):
+    return tags.apply_tags(oid_list, new_tags, datastore.datastore_dir)
+
+def tag_filter(oid_list, tag, value="<empty>"):
+    return tags.tag_filter(oid_list, tag, value, datastore.datastore_dir)
+
+def time_filter(oid_list, year=None, mon=None, day=None):
+    return tags.time_filter(oid_list, datastore.datastore_dir, year, mon, day)
+
 ################### COLLECTIONS FUNCTIONS ######################################
 def create_collection(col_name, oid_list, notes=""):
     if not oid_list:
@@ -425,6 +756,7 @@ def create_collection(col_name, oid_list, notes=""):
     if not process("collections_meta", cid, meta_opts):
         logger.error("Collection metadata was not saved")
         return False
+    catalog.add(datastore.datastore_dir, cid, meta_opts, set(expand_oids(oid_list)))
     return True
 
 def delete_collection_by_name(col_name):
@@ -439,10 +771,18 @@ def delete_collection_by_cid(cid):
     if cid not in source_set_dict:
         logger.error("Cannot delete this collection, cid not found:%s", cid)
         return False
+    d = datastore.retrieve("collections", cid)
+    oid_list = None
+    if isinstance(d, dict) and "oid_list" in d:
+        oid_list = d["oid_list"]
+    result_cache.invalidate("collections_meta", cid)
+    result_cache.invalidate("collections", cid)
+    source_map.pop(cid, None)
     if ( not datastore.delete_oid_data("collections_meta", cid)
          or not datastore.delete_oid_data("collections", cid)):
         logger.error("Collection deletion failed")
         return False
+    catalog.discard(datastore.datastore_dir, cid, oid_list)
     return True
 
 def prune_collection_by_name(col_name, oid_list):
@@ -459,14 +799,14 @@ def prune_collection_by_cid(cid, oid_prune_list):
         return False
 
     d = datastore.retrieve("collections", cid)
-    md = datastore.retrieve("collections_meta", cid)
+    md = catalog.get_meta(datastore.datastore_dir, cid)
     oid_list = d["oid_list"]
     for oid in oid_prune_list:
         if oid in oid_list:
             oid_list.remove(oid)
     if delete_collection_by_cid(cid):
         return create_collection(md["name"], oid_list, md["notes"])
-    create_collection(md["name"], oid_list, notes)
+    create_collection(md["name"], oid_list, md["notes"])
     return False
     
 def rename_collection_by_name(orig_name, new_name):
@@ -482,7 +822,7 @@ def rename_collection_by_cid(cid, new_name):
         logger.error("Cannot rename this collection, cid not found:%s", cid)
         return False    
     d = datastore.retrieve("collections", cid)
-    md = datastore.retrieve("collections_meta", cid)
+    md = catalog.get_meta(datastore.datastore_dir, cid)
     oid_list = d["oid_list"]
     notes = md["notes"]
     col_names = collection_names()
@@ -494,12 +834,14 @@ def rename_collection_by_cid(cid, new_name):
     create_collection(md["name"], oid_list, notes)
     return False
 
+def get_memberships(oid_list, exclude_cids=()):
+    """ Returns {cid: [oids]} of the collections holding any of oid_list,
+        looked up in the catalog members index
+    """
+    return catalog.memberships(datastore.datastore_dir, oid_list, set(exclude_cids))
+
 def get_cid_from_name(col_name):
-    source_set_dict = get_set_names()
-    for cid in source_set_dict:
-        if source_set_dict[cid] == col_name:
-            return cid
-    return None
+    return catalog.get_cid(datastore.datastore_dir, col_name)
         
 def get_cid_from_oid_list(oid_list):
     oid_list = list(set(oid_list)) # Assert uniqueness
@@ -509,21 +851,17 @@ def get_cid_from_oid_list(oid_list):
     return cid
 
 def get_set_names():
-    source_set_dict = {}
-    for source_mod in modules_available["source"]:
-            doc = documentation(source_mod)
-            if doc["set"]: # Currently only source set is collections
-                data = retrieve_all(source_mod)
-                #print data
-                for oid in data:
-                    source_set_dict[oid] = get_colname_from_oid(oid)
-    return source_set_dict
+    """ Returns {cid: name} for every collection, read from the catalog so
+        the member lists are not loaded
+    """
+    cids, names = catalog.get_catalog(datastore.datastore_dir)
+    return dict( (cid, cids[cid]["name"]) for cid in cids )
 
 def collection_names():
-    return get_set_names().values() 
+    return catalog.get_catalog(datastore.datastore_dir)[1].keys()
         
 def collection_cids():
-    return get_set_names().keys()
+    return catalog.get_catalog(datastore.datastore_dir)[0].keys()
 
 def get_collection_info(col_name, view):
     col_names = collection_names()
@@ -535,8 +873,9 @@ def get_collection_info(col_name, view):
         return result 
     
     cid = get_cid_from_name(str(col_name))
-    num_files = get_field("collections_meta", cid, "num_oids")
-    notes = get_field("collections_meta", cid, "notes")
+    md = catalog.get_meta(datastore.datastore_dir, cid)
+    num_files = md["num_oids"]
+    notes = md["notes"]
     result['name'] = col_name
     result['id'] = cid
     result['num_files'] = num_files
@@ -561,13 +900,7 @@ def get_collection_info(col_name, view):
         cid = get_cid_from_name(col_name)
         oid_list = expand_oids(cid)
         exclude_cids = [ o for o in oid_list if exists("collections", o) ]
-        cids = [ c for c in collection_cids() if c not in exclude_cids]
-        results = {}
-        for c in cids:
-            this_oids = set(expand_oids(c))
-            this_intersection = list(set(oid_list).intersection(this_oids))
-            if this_intersection:
-                results[c] = this_intersection
+        results = get_memberships(oid_list, exclude_cids)
 		
         result['memberships'] = {}
         for new_cid in results:
@@ -585,9 +918,8 @@ def get_file_info(file):
     result = {}
 
     for oid in oid_list:
-        mr = retrieve("membership", oid_list, {})
         col_names = []
-        for cid in mr:
+        for cid in catalog.containing(datastore.datastore_dir, oid):
             col_name = get_colname_from_oid(cid)
             col_names.append(col_name)
         meta = retrieve("file_meta", oid, {})
@@ -655,15 +987,23 @@ def expand_oids(oids):
     """
     if isinstance(oids, str) or isinstance(oids, unicode):
         oids = [oids]
+    srcs = sources(oids)
+    sets = {} # source => its set oids
+    for oid in oids:
+        src = srcs[oid]
+        if src and documentation(src)["set"]:
+            sets.setdefault(src, []).append(oid)
+    for src in sets:
+        sets[src] = retrieve_many(src, sets[src], {})
+
     new_oids = []
     for oid in oids:
-        src = source(oid)
+        src = srcs[oid]
         if not src:
             logger.warn("Invalid OID to expand: %s", oid)
             continue
-        if documentation(src)["set"]:
-            col_dict = retrieve(src, oid, {})
-            new_oids.extend(col_dict["oid_list"])
+        if src in sets:
+            new_oids.extend(sets[src][oid]["oid_list"])
         else:
             new_oids.append(oid)
     return new_oids
@@ -691,6 +1031,9 @@ def get_colname_from_oid(oid):
         the name belonging to that oid
     """
     logger.debug("Getting name for collection oid:%s", oid)
+    md = catalog.get_meta(datastore.datastore_dir, oid)
+    if md:
+        return md["name"]
 
     for s in modules_available["source"]:
         if s == "collections":
@@ -734,6 +1077,11 @@ def wire_api():
     api.retrieve  = retrieve
     api.get_field = get_field
     
+    api.exists_many               = exists_many
+    api.retrieve_many             = retrieve_many
+    api.store_many                = store_many
+    api.raw_data                  = raw_data
+    api.store_raw                 = store_raw
     api.expand_oids               = expand_oids
     api.get_oids_with_name        = get_oids_with_name
     api.get_colname_from_oid      = get_colname_from_oid
@@ -759,12 +1107,21 @@ def wire_api():
     api.apply_tags            = apply_tags
     api.get_tags              = get_tags
     api.tag_filter            = tag_filter
+    api.time_filter           = time_filter
     api.collection_names      = collection_names
     api.collection_cids       = collection_cids
+    api.get_memberships       = get_memberships
     api.get_cid_from_oid_list = get_cid_from_oid_list
     api.valid_oids            = valid_oids
     api.flush_module          = flush_module
     api.flush_oid             = flush_oid
+    api.cache_stats           = cache_stats
+    api.cache_clear           = cache_clear
+    api.lock_stats            = lock_stats
+    api.io_stats              = io_stats
+    api.metrics_stats         = metrics_stats
+    api.progress_stats        = progress_stats
+    api.startup_stats         = startup_stats
     
     import local_datastore
     api.local_store                = local_datastore.local_store
@@ -23,50 +23,29 @@ THE SOFTWARE.
 """
 
 import logging, multiprocessing, optparse, time, cPickle, types, socket
-import oxide, api, server, sys_utils
+import oxide, api, server, sys_utils, sample_cache
 
 name = "oxide_server"
 logger = logging.getLogger(name)
 
 oxide.config.distributed_enabled = False
 
-def encode(f):
-    def wrapper(*args, **kwargs):
-        # Unpack the key word vars after being transmitted
-        new_args = []
-        for arg in args: 
-            new_args.append(sys_utils.unpack(arg))
-        new_args = tuple(new_args)
-        
-        # Unpack the key word vars after being transmitted
-        new_kwargs = {}
-        for k in kwargs:
-            new_kwargs[k] = sys_utils.unpack(kwargs[k])
-        
-        res = f(*new_args, **new_kwargs)
-        result = sys_utils.pack(res) # Pack the result before transmitting
-        return result
-    
-    # Fixup the name and doc string for this function
-    wrapper.__name__ = f.__name__
-    wrapper.__doc__  = f.__doc__
-    wrapper.__repr__  = f.__repr__
-    return wrapper
-
-# Wrap all of the oxide methods with the encode method
-functions = [encode(getattr(oxide, f)) for f in dir(oxide) if isinstance(getattr(oxide, f), types.FunctionType)]
-functions.extend( [encode(getattr(api, f)) for f in dir(api) if isinstance(getattr(api, f), types.FunctionType)] )
+# Serve all of the oxide methods, the server wraps them for its transport
+functions = [getattr(oxide, f) for f in dir(oxide) if isinstance(getattr(oxide, f), types.FunctionType)]
+functions.extend( [getattr(api, f) for f in dir(api) if isinstance(getattr(api, f), types.FunctionType)] )
+functions.extend( [sample_cache.held_samples, sample_cache.missing_samples, sample_cache.cache_samples] )
 
 def main(my_ip, my_port):
     try:
-       if not server.init(my_ip, my_port, functions):
+       if not server.init(my_ip, my_port, functions, oxide.config.distributed_transport,
+                          oxide.config.distributed_timeout):
            print " - Not able to initiate server. Exiting."
            return
     except socket.error as err:
        print err
        print " - Not able to initiate server. Exiting."
        return 
-    print " Oxide server listening on %s:%s" % (my_ip, my_port) 
+    print " Oxide server listening on %s:%s (%s)" % (my_ip, my_port, oxide.config.distributed_transport)
     print " <CTRL-C> to quit."
     try:
         server.start_listen()
@@ -24,45 +24,88 @@ THE SOFTWARE.
 
 import sys, time
 
+RENDER_INTERVAL = 0.25 # seconds between redraws of the progress line
+
+# The latest progress of each named run, so that how fast a module is going
+# can be read while it runs and after it is done.
+#   runs: name => progress
+runs = dict()
+
 class progress:
-    def __init__(self, total=1, freq=0):
+    """ Counts finished items and draws a progress line on stderr, at most
+        every RENDER_INTERVAL seconds and once more when the count reaches
+        total. Only the process calling tick draws anything; the pool ticks
+        in the parent as results come back.
+    """
+    def __init__(self, total=1, freq=0, name=None):
         self.total = total
         if freq < 1:
             self.freq = 1
-            if total > 1000:
-                self.freq = int(total/1000)
         else:
             self.freq = int(freq)
+        self.name = name
         self.count = 0
-        self.time = 0
-        self.last_tick  = time.time()
+        self.rendered = 0
+        self.start = time.time()
+        self.end = None
+        self.last_render = 0
+        if name:
+            runs[name] = self
         
-    def tick(self):
+    def tick(self, count=1):
+        self.count += count
+        now = time.time()
+        done = self.count >= self.total
+        if done and self.end is None:
+            self.end = now
         if self.total == 1:
             return
-        self.count += 1
-        now = time.time()
-        self.time += now - self.last_tick
-        self.last_tick = now
+        if done or (now - self.last_render >= RENDER_INTERVAL
+                    and self.count - self.rendered >= self.freq):
+            self.render(now)
+            if done:
+                print
+
+    def render(self, now):
+        self.last_render = now
+        self.rendered = self.count
+        s = self.stats(now)
+        if not s["elapsed"] or not s["rate"]:
+            return
+        est = s["eta"] / 60 # Convert to minutes
+        est_scale = 'm' # Default to minutes
+        if est > 60: # Convert to hours if there is more than 1
+            est /= 60
+            est_scale = 'h'
+
+        # Same thing for the total time
+        print_time = s["elapsed"] / float(60)
+        time_scale = 'm'
+        if print_time > 60:
+            print_time /= 60
+            time_scale = 'h'
 
-        if not self.count % self.freq:
-            if self.time:
-                rate = self.count / float(self.time)
-                est = (self.total-self.count) / float(rate)
-                est /= 60 # Convert to minutes
-                est_scale = 'm' # Default to minutes
-                if est > 60: # Convert to hours if there is more than 1
-                    est /= 60
-                    est_scale = 'h'
+        sys.stderr.write("Processed %d/%d (%.2f%%)   time: %.2f%s   est: %.2f%s   %.2f per/s\r"
+            % (self.count, self.total, (100*self.count)/float(self.total), print_time, time_scale, est, est_scale, s["rate"]))
 
-                # Same thing for the total time
-                print_time = self.time / float(60)
-                time_scale = 'm'
-                if print_time > 60:
-                    print_time /= 60
-                    time_scale = 'h'
+    def stats(self, now=None):
+        """ Returns the count, total, elapsed seconds, items per second and
+            seconds left (None until there is a rate) of this run
+        """
+        if self.end is not None:
+            now = self.end
+        elif now is None:
+            now = time.time()
+        elapsed = now - self.start
+        rate = 0.
+        if elapsed > 0:
+            rate = self.count / elapsed
+        eta = None
+        if rate:
+            eta = max(0, self.total - self.count) / rate
+        return {"name":self.name, "count":self.count, "total":self.total, "elapsed":elapsed,
+                "rate":rate, "eta":eta, "done":self.end is not None}
 
-                sys.stderr.write("Processed %d/%d (%.2f%%)   time: %.2f%s   est: %.2f%s   %.2f per/s\r"
-                    % (self.count, self.total, (100*self.count)/float(self.total), print_time, time_scale, est, est_scale, rate))
-        if self.count == self.total:
-            print
+def stats():
+    """ Returns name => stats() of the latest run of each name """
+    return dict( (name, runs[name].stats()) for name in runs )
@@ -35,7 +35,9 @@ class oxide_proxy:
         # Wrap the proxy methods with the decode method
         methods = ros.proxy.system.listMethods()
         for m in methods:
-            if m == "import_file":
+            if client.is_binary(ros.proxy): # Values are sent as they are
+                setattr(self, m, getattr(ros.proxy, m))
+            elif m == "import_file":
                 setattr(self, m, client.decode_file(getattr(ros.proxy, m)))
             else:
                 setattr(self, m, client.decode(getattr(ros.proxy, m)))
@@ -0,0 +1,127 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, logging
+
+name = "sample_cache"
+logger = logging.getLogger(name)
+
+import oxide, sys_utils
+
+CACHE_DIR = "samples.cache" # under the datastore dir
+SOURCE = "files"            # cached samples are stored as files samples
+
+# A compute node that does not share storage with the coordinator is sent the
+# samples of its batches before it processes them. They are stored like any
+# imported file, so modules find them through api.source and api.raw_data,
+# and each gets an empty marker file in CACHE_DIR. The mtime of the marker is
+# the last time the sample was asked for. When the next batch comes in, the
+# least recently used cached samples not in it are deleted until the cache
+# is back under distributed_sample_cache_max MB, so the samples of the batch
+# being processed are never evicted from under it. Samples imported on the
+# node itself have no marker and are never evicted. The server forks per
+# connection, so all of the state is kept on disk.
+
+def held_samples(mod_name, oid_list):
+    """ Returns a dict of oid => True if the results of mod_name for oid are
+        stored here or False if only its sample is, for each oid in oid_list
+        that this node has.
+    """
+    srcs = oxide.sources(oid_list)
+    held = [ oid for oid in oid_list if srcs[oid] ]
+    found = oxide.exists_many(mod_name, held) if held else {}
+    return dict( (oid, bool(found.get(oid))) for oid in held )
+
+def missing_samples(oid_list):
+    """ Returns the oids in oid_list that have no sample here. Cached samples
+        that are here count as used and the other cached samples are evicted
+        down to the cache size.
+    """
+    srcs = oxide.sources(oid_list)
+    touch([ oid for oid in oid_list if srcs[oid] ])
+    evict(keep=set(oid_list))
+    return [ oid for oid in oid_list if not srcs[oid] ]
+
+def cache_samples(samples):
+    """ Store samples, a dict of oid => bytes. Returns the number stored.
+    """
+    sys_utils.assert_dir_exists(get_cache_dir())
+    count = 0
+    for oid, data in samples.iteritems():
+        if oxide.get_oid_from_data(data) != oid:
+            logger.error("Sample sent for %s does not match its oid", oid)
+            continue
+        if not oxide.store_raw(SOURCE, oid, data):
+            logger.error("Not able to cache the sample of %s", oid)
+            continue
+        file(os.path.join(get_cache_dir(), oid), "w").close()
+        count += 1
+    return count
+
+def touch(oid_list):
+    cache_dir = get_cache_dir()
+    for oid in oid_list:
+        try:
+            os.utime(os.path.join(cache_dir, oid), None)
+        except OSError:
+            pass # Not a cached sample
+
+def evict(max_size=None, keep=()):
+    """ Delete cached samples that are not in keep, least recently used
+        first, until they add up to no more than max_size MB
+        (distributed_sample_cache_max by default)
+    """
+    if max_size is None:
+        max_size = oxide.config.distributed_sample_cache_max
+    cache_dir = get_cache_dir()
+    if not os.path.isdir(cache_dir):
+        return 0
+    raw_dir = oxide.datastore.get_raw_dir(SOURCE)
+    entries = []
+    for oid in os.listdir(cache_dir):
+        try:
+            used = os.path.getmtime(os.path.join(cache_dir, oid))
+            size = os.path.getsize(os.path.join(raw_dir, oid))
+        except OSError:
+            used, size = 0, 0
+        entries.append((used, oid, size))
+    entries.sort()
+    total = sum( size for used, oid, size in entries )
+    evicted = 0
+    for used, oid, size in entries:
+        if total <= max_size * 1048576:
+            break
+        if oid in keep:
+            continue
+        logger.debug("Evicting cached sample %s", oid)
+        oxide.datastore.delete_oid_data(SOURCE, oid)
+        oxide.result_cache.invalidate(SOURCE, oid)
+        oxide.source_map.pop(oid, None)
+        sys_utils.delete_file(os.path.join(cache_dir, oid))
+        total -= size
+        evicted += 1
+    return evicted
+
+def get_cache_dir():
+    return os.path.join(oxide.datastore.datastore_dir, CACHE_DIR)
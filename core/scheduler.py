@@ -0,0 +1,101 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import logging
+
+name = "scheduler"
+logger = logging.getLogger(name)
+
+import oxide, options
+
+# Modules list the modules they retrieve from in the "deps" entry of their
+# documentation(). Before a module is mapped over many oids in the pool its
+# dependencies are computed a level at a time: every module of a level is run
+# over all the oids that do not have its results yet before the next level
+# starts. This keeps every worker busy at every level, where otherwise each
+# worker would walk the whole chain serially for one oid at a time.
+#
+# A module's level is one more than the highest level of its dependencies.
+# Analyzers are not stored and source modules are not run, so they never get
+# a stage of their own, but the dependencies of analyzers are followed.
+RUN_TYPES = ["extractors", "map_reducers"]
+
+def get_deps(mod_name):
+    """ Returns the declared dependencies of mod_name that are loaded
+    """
+    doc = oxide.documentation(mod_name)
+    if not doc:
+        return []
+    deps = []
+    for dep in doc.get("deps", []):
+        if oxide.get_mod_type(dep):
+            deps.append(dep)
+        else:
+            logger.debug("%s depends on %s which is not loaded", mod_name, dep)
+    return deps
+
+def get_stages(mod_name):
+    """ Returns the dependencies of mod_name that can be run as a list of
+        stages, each a list of modules that only depend on earlier stages.
+    """
+    levels = {}
+    visiting = set()
+    def visit(m):
+        if m in levels:
+            return levels[m]
+        if m in visiting:
+            logger.error("Dependency cycle through %s", m)
+            return -1
+        visiting.add(m)
+        levels[m] = 1 + max([-1] + [ visit(d) for d in get_deps(m) ])
+        visiting.remove(m)
+        return levels[m]
+
+    visit(mod_name)
+    del levels[mod_name]
+    stages = {}
+    for m, level in levels.iteritems():
+        if oxide.get_mod_type(m) in RUN_TYPES:
+            stages.setdefault(level, []).append(m)
+    return [ sorted(stages[level]) for level in sorted(stages) ]
+
+def schedule(mod_name, oid_list):
+    """ Compute the dependencies of mod_name over oid_list in the pool, a
+        stage at a time, skipping results that are already stored.
+    """
+    if not oxide.config.multiproc_schedule or len(oid_list) < 2:
+        return True
+    for stage in get_stages(mod_name):
+        tasks = []
+        for dep in stage:
+            opts = {}
+            if not options.validate_opts(dep, opts):
+                logger.warning("Failed to validate default opts for %s", dep)
+                continue
+            dep_oids = oxide.cleanup_oid_list(dep, oid_list)
+            found = oxide.exists_many(dep, dep_oids, opts)
+            tasks.extend([ (dep, oid, opts) for oid in dep_oids if not found[oid] ])
+        logger.debug("Stage %s: %d tasks", stage, len(tasks))
+        oxide.mp.multi_map_stage(tasks)
+    return True
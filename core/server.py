@@ -23,28 +23,87 @@ THE SOFTWARE.
 """
 
 from SimpleXMLRPCServer import SimpleXMLRPCServer
-import logging, SocketServer, socket
+import os, logging, SocketServer, socket, multiprocessing
+import sys_utils
 
 class ForkingServer(SocketServer.ForkingMixIn, SimpleXMLRPCServer):
 #class ForkingServer(SimpleXMLRPCServer):
     pass
 
+class BinaryServer(SocketServer.ForkingMixIn, SocketServer.TCPServer):
+    """ Serves the same functions as ForkingServer over the binary transport.
+        Each client connection gets its own process and stays open for as
+        many requests as the client sends, answered in the order they came.
+        A connection that is silent for connection_timeout seconds is closed.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, address, functions, connection_timeout=None):
+        self.functions = functions
+        self.connection_timeout = connection_timeout or None
+        SocketServer.TCPServer.__init__(self, address, BinaryHandler)
+
+class BinaryHandler(SocketServer.StreamRequestHandler):
+    def setup(self):
+        self.timeout = self.server.connection_timeout
+        SocketServer.StreamRequestHandler.setup(self)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            try:
+                req_id, method, args, kwargs = sys_utils.recv_message(self.rfile)
+            except EOFError:
+                return
+            except socket.timeout:
+                logger.debug("Closing idle connection from %s:%s", self.client_address[0], self.client_address[1])
+                return
+            try:
+                result = self.server.functions[method](*args, **kwargs)
+                response = (req_id, True, sys_utils.portable(result))
+            except KeyError:
+                response = (req_id, False, "Method %s not found" % method)
+            except Exception, err:
+                logger.exception("Error in %s", method)
+                response = (req_id, False, "%s: %s" % (err.__class__.__name__, err))
+            try:
+                sys_utils.send_message(self.request, response)
+            except socket.error, err:
+                logger.error("Not able to answer %s:%s: %s", self.client_address[0], self.client_address[1], err)
+                return
+
 name = "server"
 logger = logging.getLogger(name)
 
+transports = ["xmlrpc", "binary"]
+
 my_server = None
-def init(ip, port, functions):
+def init(ip, port, functions, transport="xmlrpc", timeout=None):
+    """ Serve functions on ip:port. With the xmlrpc transport the arguments
+        and results are packed by encode, the binary transport pickles them
+        itself and closes connections silent for timeout seconds.
+    """
     global my_server
     if not isinstance(functions, list):
         logger.error("functions must be of list type")
         return False
-    my_server = ForkingServer((ip, int(port)), allow_none=True, )
-    my_server.register_introspection_functions()
-    my_server.register_function(alive)
-    for function in functions:
-        my_server.register_function(function)
+    if transport not in transports:
+        logger.error("Unknown transport %s, expected one of %s", transport, transports)
+        return False
+    if transport == "binary":
+        registered = dict( (f.__name__, f) for f in functions )
+        registered["alive"] = alive
+        registered["load"] = load
+        registered["system.listMethods"] = lambda: sorted(registered)
+        my_server = BinaryServer((ip, int(port)), registered, timeout)
+    else:
+        my_server = ForkingServer((ip, int(port)), allow_none=True, )
+        my_server.register_introspection_functions()
+        my_server.register_function(alive)
+        for function in functions + [load]:
+            my_server.register_function(encode(function))
         
-    logger.debug("Server init %s:%s", ip, port)
+    logger.debug("Server init %s:%s (%s)", ip, port, transport)
     return True
 
 def start_listen():
@@ -58,3 +117,38 @@ def close():
 
 def alive():
     return True
+
+def load():
+    """ Returns (number of CPUs, 1 minute load average) of this node """
+    try:
+        cpus = multiprocessing.cpu_count()
+    except NotImplementedError:
+        cpus = 1
+    try:
+        return cpus, os.getloadavg()[0]
+    except OSError:
+        return cpus, 0.
+
+def encode(f):
+    """ Wrap f to unpack its arguments and pack its result for xmlrpc """
+    def wrapper(*args, **kwargs):
+        # Unpack the key word vars after being transmitted
+        new_args = []
+        for arg in args: 
+            new_args.append(sys_utils.unpack(arg))
+        new_args = tuple(new_args)
+        
+        # Unpack the key word vars after being transmitted
+        new_kwargs = {}
+        for k in kwargs:
+            new_kwargs[k] = sys_utils.unpack(kwargs[k])
+        
+        res = f(*new_args, **new_kwargs)
+        result = sys_utils.pack(res) # Pack the result before transmitting
+        return result
+    
+    # Fixup the name and doc string for this function
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__  = f.__doc__
+    wrapper.__repr__  = f.__repr__
+    return wrapper
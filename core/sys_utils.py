@@ -22,7 +22,8 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import os, api, sys, cPickle, marshal, zlib, logging, xmlrpclib, subprocess, time, tempfile
+import os, api, sys, cPickle, marshal, zlib, mmap, struct, logging, xmlrpclib, subprocess, time, tempfile
+from collections import Mapping
 
 name      = "sys_utils"
 logger    = logging.getLogger(name)
@@ -36,7 +37,20 @@ os.umask(0000) # Needed for file/directory creation
 ########### File related functions ############################################
 def import_file(file_location, max_file_size):
     logger.debug("Importing file %s", file_location)
+    file_stat = get_import_stat(file_location, max_file_size)
+    if not file_stat:
+        return None
+
+    filesize = file_stat["size"]/1048576.
+    logger.debug("File import size %dM", filesize)
+    data = get_contents_of_file(file_location)
+    file_data = {"file_stat":file_stat, "size":filesize, "data":data}
+    return file_data
 
+def get_import_stat(file_location, max_file_size):
+    """ Returns the stat dict of file_location if it should be imported,
+        otherwise None.
+    """
     if os.path.basename(file_location) in files_not_imported:
         logger.debug("Skipping the import of file: %s", file_location)
         return None
@@ -54,15 +68,11 @@ def import_file(file_location, max_file_size):
         logger.error("Cannot stat file %s.", file_location)
         return None
 
-    filesize = os.path.getsize(file_location)/1048576.
+    filesize = file_stat["size"]/1048576.
     if filesize > max_file_size or filesize == 0:
         logger.error("File size %dM exceeds max filesize %dM or is 0", filesize, max_file_size)
         return None
-
-    logger.debug("File import size %dM", filesize)
-    data = get_contents_of_file(file_location)
-    file_data = {"file_stat":file_stat, "size":filesize, "data":data}
-    return file_data
+    return file_stat
 
 def delete_file(file_location):
     if not os.path.isfile(file_location):
@@ -112,6 +122,23 @@ def get_contents_of_file(file_location):
         logger.error("IOError:" + str(err))
         return None
 
+def map_file(file_location):
+    """ Given the location of a file return a read-only mmap of its contents,
+        "" if it is empty or None if it cannot be read.
+    """
+    try:
+        f = file(file_location, 'rb')
+        try:
+            if not os.fstat(f.fileno()).st_size:
+                return ""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+    except EnvironmentError, err:
+        logger.error("Not able to map %s: %s", file_location, err)
+        return None
+
 def read_object_from_file(filename):
     """ Reads Python object from file by first uncompressing, unpickling, then returning results """
     if not os.path.isfile(filename):
@@ -156,6 +183,23 @@ def write_object_to_file(filename, data):
         logger.error("PicklingError:%s", err)
         return False
 
+def write_object_to_temp(directory, data):
+    """ Writes Python object to a new temp file in directory the same way as
+        write_object_to_file. Returns the temp file's name, or None.
+    """
+    fd, tmp = tempfile.mkstemp(prefix="TMP", dir=directory)
+    try:
+        out = os.fdopen(fd, 'wb')
+        try:
+            out.write(zlib.compress(cPickle.dumps(data), zlib.Z_BEST_SPEED))
+        finally:
+            out.close()
+        return tmp
+    except (IOError, cPickle.PicklingError), err:
+        logger.error("Not able to write %s: %s", tmp, err)
+        os.remove(tmp)
+        return None
+
 def get_files_from_directory(directory):
     """ Given the name of a directory return a list of the fullpath files in the
         given directory and subdirectories 
@@ -181,13 +225,102 @@ def assert_dir_exists(directory):
         try:
             os.makedirs(directory, mode=0777)
         except OSError:
-            logger.debug("Already creating directory %s", directory)        
-    return True    
-         
+            logger.debug("Already creating directory %s", directory)
+    return True
+
+def stat_key(path):
+    """ Returns (mtime, size, inode) of path, or None if it is missing. A file
+        replaced by a rename gets a new key.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+def thread_map(func, items, nthreads):
+    """ map() func over items with up to nthreads threads. Only worth it when
+        func spends its time outside the GIL, e.g. reading files or zlib.
+    """
+    if nthreads <= 1 or len(items) <= 1:
+        return map(func, items)
+    from multiprocessing.dummy import Pool
+    pool = Pool(min(nthreads, len(items)))
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+
 ########### Networking related functions #######################################
+# The binary transport sends each message as one or more frames. A frame is a
+# FRAME_HEADER (payload length, flags) followed by at most FRAME_MAX bytes of
+# a pickled and possibly compressed message. All frames but the last of a
+# message have FRAME_MORE set, so a large result goes out as it is sliced
+# and the receiver never needs more than the message itself in memory.
+FRAME_HEADER = struct.Struct("!IB")
+FRAME_MORE = 1
+FRAME_ZLIB = 2
+FRAME_MAX = 1048576
+COMPRESS_MIN = 4096 # Smaller messages are not worth compressing
+
+def portable(data):
+    """ Returns data with raw data mappings and records replaced by copies
+        that can be pickled and sent to another host.
+    """
+    if isinstance(data, mmap.mmap):
+        return data[:]
+    if isinstance(data, Mapping) and not isinstance(data, dict):
+        return dict(data)
+    if isinstance(data, dict):
+        for k, v in data.iteritems():
+            if isinstance(v, (mmap.mmap, Mapping)) and not isinstance(v, dict):
+                return dict( (k, portable(v)) for k, v in data.iteritems() )
+    return data
+
+def send_message(sock, message):
+    """ Pickle message and send it over sock as binary transport frames
+    """
+    data = cPickle.dumps(message, cPickle.HIGHEST_PROTOCOL)
+    flags = 0
+    if len(data) >= COMPRESS_MIN:
+        compressed = zlib.compress(data, zlib.Z_BEST_SPEED)
+        if len(compressed) < len(data) * 0.9:
+            data = compressed
+            flags = FRAME_ZLIB
+    size = len(data)
+    if size <= FRAME_MAX:
+        sock.sendall(FRAME_HEADER.pack(size, flags) + data)
+        return
+    for ofs in xrange(0, size, FRAME_MAX):
+        chunk = buffer(data, ofs, FRAME_MAX)
+        more = FRAME_MORE if ofs + FRAME_MAX < size else 0
+        sock.sendall(FRAME_HEADER.pack(len(chunk), flags | more))
+        sock.sendall(chunk)
+
+def recv_message(fd):
+    """ Read the frames of one message from the file object fd and return
+        the message. Raises EOFError if the connection closes first.
+    """
+    chunks = []
+    while True:
+        header = fd.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            raise EOFError("Connection closed")
+        size, flags = FRAME_HEADER.unpack(header)
+        chunk = fd.read(size)
+        if len(chunk) < size:
+            raise EOFError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        if not flags & FRAME_MORE:
+            break
+    data = chunks[0] if len(chunks) == 1 else "".join(chunks)
+    if flags & FRAME_ZLIB:
+        data = zlib.decompress(data)
+    return cPickle.loads(data)
+
 def pack(data):
     try:
-        data = cPickle.dumps(data)
+        data = cPickle.dumps(portable(data))
         data = zlib.compress(data, zlib.Z_BEST_SPEED)
         return xmlrpclib.Binary(data)
     except MemoryError:
@@ -21,19 +21,27 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
-
-import logging
+import time, bisect, logging
 name = "tags"
 logger = logging.getLogger(name)
 
-import api
+import api, journaled
 
-def apply_tags(oid_list, new_tags):
-    if isinstance(oid_list, list):
-        for oid in oid_list:
-            apply_tags(oid, new_tags)
-    else:
-        oid = oid_list
+# The tag index answers tag_filter and time_filter without reading the tags
+# of each oid. It is {"tags":{tag: {key: [value, set of oids]}},
+# "oids":{oid: {tag: key}}}, where key is the value or its repr if the value
+# is not hashable. Tags whose name has "time" in it and whose value is a
+# number are also kept in "times":{tag: sorted list of (value, oid)} so that
+# dates are range lookups; "times" is derived on load and not saved.
+# apply_tags appends each change as (oid, new tags or None to drop the oid)
+# to the journal of the index, see journaled.index. The index is rebuilt
+# from the tags of each oid when it is missing.
+
+def apply_tags(oid_list, new_tags, index_dir):
+    if not isinstance(oid_list, list):
+        oid_list = [oid_list]
+    records = []
+    for oid in oid_list:
         if not api.exists("tags", oid):
             tags = {}
         else: 
@@ -41,7 +49,8 @@ def apply_tags(oid_list, new_tags):
         for tag in new_tags:
             tags[tag] = new_tags[tag]
         api.store("tags", oid, tags)
-        
+        records.append((oid, new_tags))
+    journal(index_dir, records)
 
 def get_tags(oid):
     if not isinstance(oid, str):
@@ -52,23 +61,163 @@ def get_tags(oid):
     else:
         return api.retrieve("tags", oid)
         
-        
-def tag_filter(oid_list, tag, value="<empty>"):
-    filtered_oids = []
+def tag_filter(oid_list, tag, value, index_dir):
+    """ Returns the oids of oid_list that have tag with value in it, or any
+        value if either is "<empty>". Without an oid_list every file and
+        collection is filtered.
+    """
+    matched = set()
+    for v, oids in get_index(index_dir)["tags"].get(tag, {}).itervalues():
+        if v == "<empty>" or value == "<empty>" or value == v or contains(v, value):
+            matched.update(oids)
+
     if not oid_list:
         oid_list = api.retrieve_all_keys("files")
         if not oid_list:
             logger.error("No files exist")
             return None
-        cids = api.retrieve_all_keys("collections")
-        if cids:
-            oid_list.extend(cids)
-            
-    for oid in oid_list:
-        t = get_tags(oid)
-        if t and tag in t:
-            if t[tag] == "<empty>" or value == "<empty>" or value == t[tag] or value in t[tag]:
-                filtered_oids.append(oid)
-                
-    return filtered_oids
- 
\ No newline at end of file
+        oid_list.extend(api.retrieve_all_keys("collections") or [])
+    return [ oid for oid in oid_list if oid in matched ]
+
+def time_filter(oid_list, index_dir, year=None, mon=None, day=None):
+    """ Returns the oids of oid_list with a time tag that falls in the given
+        year, month and day. Whichever of them are given must all match the
+        same time, e.g. year and month pick that one month and month and day
+        without a year pick that date in any year. The filter this replaced
+        accepted a time that matched any one of them.
+    """
+    matched = set()
+    for entries in get_index(index_dir)["times"].itervalues():
+        for start, end in time_ranges(entries, year, mon, day):
+            lo = bisect.bisect_left(entries, (start,))
+            hi = bisect.bisect_left(entries, (end,))
+            if year or not (mon or day):
+                matched.update( oid for t, oid in entries[lo:hi] )
+                continue
+            for t, oid in entries[lo:hi]: # No year, check each date
+                lt = time.localtime(t)
+                if (not mon or mon == lt.tm_mon) and (not day or day == lt.tm_mday):
+                    matched.add(oid)
+    return [ oid for oid in oid_list or [] if oid in matched ]
+
+def time_ranges(entries, year, mon, day):
+    """ [start, end) time ranges that cover the given date. Without a year the
+        whole index is one range that the caller checks date by date.
+    """
+    if not entries:
+        return []
+    if not year:
+        return [(entries[0][0], entries[-1][0] + 1)]
+    if mon:
+        months = [mon]
+    elif day:
+        months = range(1, 13)
+    else:
+        return [(epoch(year, 1, 1), epoch(year+1, 1, 1))]
+    if not day:
+        return [ (epoch(year, m, 1), epoch(year, m+1, 1)) for m in months ]
+    return [ (epoch(year, m, day), epoch(year, m, day+1)) for m in months
+             if time.localtime(epoch(year, m, day)).tm_mday == day ]
+
+def epoch(year, mon, day):
+    # mktime carries month 13 and day 32 over into the next year and month
+    return time.mktime((year, mon, day, 0, 0, 0, 0, 0, -1))
+
+def contains(v, value):
+    try:
+        return value in v
+    except TypeError:
+        return False
+
+def discard(index_dir, oid):
+    """ Forget the tags of oid, used when its data is flushed """
+    journal(index_dir, [(oid, None)])
+
+def reset(index_dir):
+    """ Drop the index so it is rebuilt on the next lookup """
+    index.reset(index_dir)
+
+def get_index(index_dir):
+    return index.get(index_dir)
+
+def journal(index_dir, records):
+    """ Append records of (oid, new tags or None to drop the oid) to the
+        journal and apply them to the index held by this process
+    """
+    index.append(index_dir, records)
+
+def replay(data, record):
+    """ Apply one journal record to data """
+    oid, new_tags = record
+    if new_tags is None:
+        for tag in data["oids"].get(oid, {}).keys():
+            unset(data, oid, tag)
+        data["oids"].pop(oid, None)
+        return
+    for tag, value in new_tags.iteritems():
+        unset(data, oid, tag)
+        key = value_key(value)
+        entry = data["tags"].setdefault(tag, {}).setdefault(key, [value, set()])
+        entry[1].add(oid)
+        data["oids"].setdefault(oid, {})[tag] = key
+        if is_time(tag, value):
+            bisect.insort(data["times"].setdefault(tag, []), (value, oid))
+
+def unset(data, oid, tag):
+    key = data["oids"].get(oid, {}).pop(tag, None)
+    entries = data["tags"].get(tag, {})
+    if key is None or key not in entries:
+        return
+    value, oids = entries[key]
+    oids.discard(oid)
+    if not oids:
+        del entries[key]
+    if is_time(tag, value):
+        times = data["times"][tag]
+        i = bisect.bisect_left(times, (value, oid))
+        if i < len(times) and times[i] == (value, oid):
+            del times[i]
+
+def build():
+    """ Read the index from the tags of each oid """
+    logger.debug("Building the tag index")
+    data = {"tags":{}, "oids":{}, "times":{}}
+    for oid in api.retrieve_all_keys("tags") or []:
+        tags = api.retrieve("tags", oid)
+        if isinstance(tags, dict):
+            replay(data, (oid, tags))
+    return data
+
+def dump(data):
+    return dict(tags=data["tags"], oids=data["oids"])
+
+def restore(saved):
+    if not isinstance(saved, dict) or "tags" not in saved:
+        return None
+    saved["times"] = time_index(saved)
+    return saved
+
+def time_index(data):
+    times = {}
+    for tag, entries in data["tags"].iteritems():
+        for value, oids in entries.itervalues():
+            if is_time(tag, value):
+                times.setdefault(tag, []).extend( (value, oid) for oid in oids )
+    for tag in times:
+        times[tag].sort()
+    return times
+
+def is_time(tag, value):
+    return "time" in tag and isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def value_key(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def cleanup_state():
+    index.cleanup_state()
+
+index = journaled.index("tags", replay, build, dump=dump, restore=restore)
@@ -0,0 +1,232 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, glob, json, time, cPickle, inspect, functools, logging
+name = "tracer"
+logger = logging.getLogger(name)
+
+SPANS_EXT = ".spans" # each process appends its spans to <trace file>.<pid>.spans
+
+# An opt-in tracer of the nested retrieve, process and store calls that one
+# command sets off as modules pull in the modules they depend on. While it is
+# on, each call is a span with the stack of calls it was made from, e.g.
+#   retrieve call_graph;process call_graph;call_graph.process;retrieve disassembly
+# where call_graph.process is the module's own process function.
+# A span is "compute" if a module ran under it and "hit" if everything it
+# needed was already stored. Worker processes write their spans to files next
+# to the trace file, under the stack of the call that handed them the task,
+# and stop() gathers them so the trace covers the whole command.
+#   stack: open spans, innermost last, as dicts with label, start, child
+#          (seconds spent in nested spans) and compute
+#   spans: finished spans of this process not written out yet
+trace_file = None # None when not tracing
+prefix = ()       # labels of the spans in the parent that this process works under
+stack = []
+spans = []
+
+def start(path):
+    """ Start tracing this process, the spans of workers go next to path """
+    global trace_file, prefix
+    stop()
+    trace_file, prefix = path, ()
+    for f in worker_files(path):
+        os.remove(f)
+
+def stop():
+    """ Stop tracing and return the spans of this process and its workers in
+        the order they ended. A span is a dict with stack (labels from the
+        outermost call down to this one), op, mod_name, oid, status, pid,
+        start (epoch seconds), duration and self (duration not spent in
+        nested spans).
+    """
+    global trace_file, prefix, spans
+    if trace_file is None:
+        return []
+    results = spans
+    for f in worker_files(trace_file):
+        results.extend(read_spans(f))
+        os.remove(f)
+    trace_file, prefix, spans = None, (), []
+    del stack[:]
+    results.sort(key=lambda s: s["start"] + s["duration"])
+    return results
+
+def follow(trace):
+    """ Called in a worker with the trace of the call it syncs to, see handoff """
+    global trace_file, prefix, spans
+    del stack[:]
+    spans = []
+    if trace is None:
+        trace_file, prefix = None, ()
+    else:
+        trace_file, prefix = "%s.%d" % (trace[0], os.getpid()), trace[1]
+
+def handoff():
+    """ Returns what a worker needs to trace the tasks it is handed under the
+        open spans of this process, or None when not tracing. The open spans
+        are marked compute since the tasks only run modules.
+    """
+    if trace_file is None:
+        return None
+    for frame in stack:
+        frame["compute"] = True
+    return (trace_file, labels())
+
+def traced(op):
+    """ Decorate an oxide function whose first two arguments are a module name
+        and an oid, oid list or dict of oids so that each call is a span
+        while tracing
+    """
+    def decorate(func):
+        mod_arg, oid_arg = inspect.getargspec(func).args[:2]
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if trace_file is None:
+                return func(*args, **kwargs)
+            call = inspect.getcallargs(func, *args, **kwargs)
+            return span(op, call[mod_arg], call[oid_arg], False, func, *args, **kwargs)
+        return wrapper
+    return decorate
+
+def span(op, mod_name, oids, compute, func, *args, **kwargs):
+    """ Returns func(*args, **kwargs) recorded as a span. A compute span is a
+        call of the op function of the module, and marks every span it is
+        nested in as compute too.
+    """
+    if trace_file is None:
+        return func(*args, **kwargs)
+    if compute:
+        for frame in stack:
+            frame["compute"] = True
+    if compute: # A call of the module itself
+        label = "%s.%s" % (mod_name, op)
+    else:
+        label = "%s %s" % (op, mod_name)
+    frame = dict(label=label, start=time.time(), child=0., compute=compute)
+    stack.append(frame)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        end = time.time()
+        if stack and stack[-1] is frame:
+            stack.pop()
+            duration = end - frame["start"]
+            if stack:
+                stack[-1]["child"] += duration
+            status = "compute" if frame["compute"] else "hit"
+            if op == "store":
+                status = "write"
+            spans.append(dict(stack=labels() + (label,), op=op, mod_name=mod_name,
+                              oid=oid_label(oids), status=status, pid=os.getpid(),
+                              start=frame["start"], duration=duration,
+                              self=duration - frame["child"]))
+
+def labels():
+    return tuple(prefix) + tuple( frame["label"] for frame in stack )
+
+def oid_label(oids):
+    if isinstance(oids, basestring) or oids is None:
+        return oids
+    if isinstance(oids, dict):
+        oids = oids.keys()
+    oids = list(oids)
+    if len(oids) == 1:
+        return oids[0]
+    return "%d oids" % len(oids)
+
+def flush():
+    """ Append the finished spans of a worker to its spans file """
+    global spans
+    if trace_file is None or not spans:
+        return
+    fd = open(trace_file + SPANS_EXT, "ab")
+    try:
+        cPickle.dump(spans, fd, cPickle.HIGHEST_PROTOCOL)
+    finally:
+        fd.close()
+    spans = []
+
+def worker_files(path):
+    return glob.glob(path + ".*" + SPANS_EXT)
+
+def read_spans(path):
+    results = []
+    fd = open(path, "rb")
+    try:
+        while True:
+            try:
+                results.extend(cPickle.load(fd))
+            except EOFError:
+                break
+    finally:
+        fd.close()
+    return results
+
+############# EXPORT ###########################################################
+
+def collapsed(spans):
+    """ Returns the spans as collapsed stacks, one "frame;frame;frame <usecs>"
+        line per stack with the time spent in it and not in nested spans, the
+        input of flamegraph.pl and speedscope
+    """
+    totals = {}
+    for s in spans:
+        totals[s["stack"]] = totals.get(s["stack"], 0.) + s["self"]
+    return "".join( "%s %d\n" % (";".join(stack), round(t * 1000000))
+                    for stack, t in sorted(totals.iteritems()) )
+
+def chrome(spans):
+    """ Returns the spans in the Chrome trace event format, for
+        chrome://tracing and Perfetto
+    """
+    events = []
+    for s in sorted(spans, key=lambda s: s["start"]):
+        events.append({"name":s["stack"][-1], "cat":s["op"], "ph":"X", "pid":s["pid"], "tid":s["pid"],
+                       "ts":s["start"] * 1000000, "dur":s["duration"] * 1000000,
+                       "args":{"oid":s["oid"], "status":s["status"]}})
+    return json.dumps({"traceEvents":events, "displayTimeUnit":"ms"})
+
+def write(spans, path):
+    """ Write the spans to path.folded and path.json, returns their names """
+    names = (path + ".folded", path + ".json")
+    for fname, text in zip(names, (collapsed(spans), chrome(spans))):
+        fd = open(fname, "w")
+        try:
+            fd.write(text)
+        finally:
+            fd.close()
+    return names
+
+def top(spans, count=10):
+    """ Returns the count labels with the most time not spent in nested spans
+        as a list of (seconds, label, calls, compute calls)
+    """
+    totals = {}
+    for s in spans:
+        t = totals.setdefault(s["stack"][-1], [0., 0, 0])
+        t[0] += s["self"]
+        t[1] += 1
+        if s["status"] == "compute":
+            t[2] += 1
+    return sorted( (t[0], label, t[1], t[2]) for label, t in totals.iteritems() )[::-1][:count]
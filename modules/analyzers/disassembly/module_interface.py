@@ -36,7 +36,8 @@ opts_doc = {'module': {'type': str, 'mangle': False, 'default': 'auto',
             'valid': choices}}
 
 def documentation():
-    return {'description': desc, 'opts_doc': opts_doc, 'set': False, 'atomic': True}
+    return {'description': desc, 'opts_doc': opts_doc, 'set': False, 'atomic': True,
+            'deps': ['linear_intel_disassembler']}
 
 def results(oid_list, opts):
     logger.debug('results()')
@@ -34,7 +34,8 @@ logger.debug("init")
 opts_doc = {"fake":{"type":bool, "mangle":False, "default":False}}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["src_type", "pe", "elf", "macho"] }
 
 def results(oid_list, opts):
     logger.debug("results()")
@@ -23,6 +23,7 @@ THE SOFTWARE.
 """
 
 import histogram
+from insn_table import insn_table
 from libdisasm.disasmbuf import DisasmBuffer
 from libdisasm.disasm import SingleDisassembler
 
@@ -42,7 +43,7 @@ class MySingleDisassembler(SingleDisassembler):
         
 def disassemble_linear(buf, header, logger):
     sections = header.section_info
-    disassembly = dict()
+    disassembly = insn_table()
     buf = DisasmBuffer(buf)
     disassembler = MySingleDisassembler()
     entry_sections = []
@@ -75,8 +76,9 @@ def disassemble_linear(buf, header, logger):
                              chunk_ofs, chunk_end_ofs)
                 while curr_ofs < chunk_end_ofs and curr_ofs < len(buf):
                     #check if we already have disassembled this instruction
-                    disasm = disassembly.get(curr_ofs, None)
-                    if not disasm:
+                    if curr_ofs in disassembly:
+                        ld = disassembly.length(curr_ofs)
+                    else:
                         try:
                             disassembler.disassemble(buf, curr_ofs)
                             libdisasm_insn = disassembler.get_last_insn()
@@ -88,11 +90,11 @@ def disassemble_linear(buf, header, logger):
                             curr_rva += 1
                             logger.debug("Found bad insn: %s", msg)
                             continue
-                        disassembly[curr_ofs] = disasm
-                    ld = disasm["len"]
+                        disassembly.append(curr_ofs, disasm)
+                        ld = disasm["len"]
                     curr_rva += ld
                     curr_ofs += ld  
-                    if buf[curr_ofs:].startswith('\x00'*32):
+                    if buf[curr_ofs:curr_ofs+32] == '\x00'*32:
                         while curr_ofs < len(buf) and buf[curr_ofs] == '\x00':
                             curr_ofs += 1
     return disassembly
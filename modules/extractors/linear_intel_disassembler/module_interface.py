@@ -35,12 +35,13 @@ logger.debug("init")
 opts_doc = {"force" : { "type":bool, "mangle":False, "default":"" }}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["object_header"] }
 
 def process(oid, opts):
     logger.debug("process()")
     src = api.source(oid)
-    file_data = api.get_field(src, oid, "data")    
+    file_data = api.raw_data(src, oid)    
     hopts = {"fake":opts['force']}
     header = api.get_field("object_header", [oid], "header", hopts)
     
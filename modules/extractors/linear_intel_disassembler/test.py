@@ -47,3 +47,19 @@ class linear_intel_disassembler_test(unittest.TestCase):
             else:
                 self.assertFalse(self.oxide.process(name, oid, {}), 
                                  "%s able to process a not-PE/ELF/MACHO file" % (name))
+
+    def test_insn_table_view(self):
+        from insn_table import insn_table
+        import cPickle
+        insn = {"addr":4096, "group":"move", "mnem":"mov", "len":2,
+                "d_op":{"type":"reg", "data":"eax"},
+                "s_ops":[{"type":"eff_addr", "data":{"base":"ebx", "idx":None, "scale":1, "disp":8}},
+                         {"type":"rel", "subtype":"near", "data":4200}]}
+        table = insn_table()
+        table.append(16, insn)
+        table.append(18, {"addr":4098, "group":"insn_return", "mnem":"ret", "len":1})
+        self.assertEqual(table[16], insn, "insn_table view does not match the stored insn")
+        self.assertEqual(sorted(table.keys()), [16, 18])
+        table = cPickle.loads(cPickle.dumps(table))
+        self.assertEqual(table[18]["mnem"], "ret", "insn_table did not survive pickling")
+        self.assertEqual(list(table.column("len")), [2, 1])
@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["src_type", "macho_parse"] }
 
 def process(oid, opts):
     logger.debug("Processing oid %s", oid)
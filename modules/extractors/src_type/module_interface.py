@@ -45,7 +45,7 @@ def process(oid, opts=None):
     if src == "collections":
         src_type["type"] = "collection"
     else:
-        src_type["type"] = file_type(api.get_field(src, oid, "data")) 
+        src_type["type"] = file_type(api.raw_data(src, oid)) 
 
     api.store(name, oid, src_type, opts)
     return True
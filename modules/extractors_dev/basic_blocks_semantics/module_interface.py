@@ -42,7 +42,8 @@ callTypes['networking'] = ['wsacleanup', 'wsastartup', 'inet_addr', 'htons', 'so
 
 
 def documentation():
-    return {'description': desc, 'opts_doc': opts_doc, 'set': False, 'atomic': True}
+    return {'description': desc, 'opts_doc': opts_doc, 'set': False, 'atomic': True,
+            'deps': ['function_extract', 'basic_blocks', 'object_header', 'map_calls', 'strings']}
 
 
 def nextJump(insns, address):   
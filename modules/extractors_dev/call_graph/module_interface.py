@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {} 
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["function_extract", "object_header"]}
             
 def process(oid, opts):
     logger.debug("process()")
@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {} 
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["function_extract", "object_header", "basic_blocks"]}
             
 def process(oid, opts):
     logger.debug("process()")
@@ -51,7 +52,7 @@ def process(oid, opts):
     if not bbs:
         return False
     
-    data = api.get_field(api.source(oid), oid, "data")
+    data = api.raw_data(api.source(oid), oid)
     if not data:
         return False
     
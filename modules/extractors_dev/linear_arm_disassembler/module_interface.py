@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {"force" : { "type":bool, "mangle":False, "default":"" }}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["object_header"] }
 
 def process(oid, opts):
     logger.debug("process()")
@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {} 
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["src_type", "object_header", "disassembly", "function_extract"]}
             
 def process(oid, opts):
     logger.debug("process()")
@@ -47,7 +48,7 @@ def process(oid, opts):
     if not disasm:
         return False
 
-    file_data = api.get_field(api.source(oid), oid, "data")
+    file_data = api.raw_data(api.source(oid), oid)
     if not file_data:
         return False
 
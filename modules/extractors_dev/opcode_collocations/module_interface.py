@@ -34,7 +34,8 @@ logger.debug("init")
 opts_doc = {} 
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["opcode_histogram", "opcodes"]}
             
 def process(oid, opts):
     logger.debug("process()")
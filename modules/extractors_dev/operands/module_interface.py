@@ -40,7 +40,8 @@ logger.debug("init")
 opts_doc = {"position": {"type": int, "mangle": True, "default": 0} }
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["disassembly"]}
             
 def process(oid, opts):
     logger.debug("process()")
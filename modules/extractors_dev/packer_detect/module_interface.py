@@ -35,7 +35,8 @@ logger.debug("init")
 opts_doc = {}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["src_type", "pe_parse"] }
 
 def process(oid, opts):
     logger.debug("process()")
@@ -46,7 +47,7 @@ def process(oid, opts):
     if not file_meta: 
         logger.debug("Not able to process %s",oid)
 	return False
-    data = api.get_field("files", oid, "data")
+    data = api.raw_data("files", oid)
     if not data:
         return False
     result = detect_packer(file_meta, data)
@@ -39,7 +39,7 @@ def documentation():
 def process(oid, opts):
     logger.debug("process()")
 
-    data = api.get_field(api.source(oid), oid, "data")
+    data = api.raw_data(api.source(oid), oid)
     if not data:
         return False
     
@@ -26,8 +26,7 @@ desc = " This module produces a histogram of the bytes in a file."
 name = "byte_histogram"        
 
 import logging
-from collections import defaultdict
-from histogram import build_histo, merge_histo
+from histogram import build_histo, merge_histos
 import api
 
 logger = logging.getLogger(name)
@@ -42,22 +41,20 @@ def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
     src = api.source(oid)
     if api.exists(name, oid, opts):
-        return oid
-    data = api.get_field(src, oid, "data")
+        return api.retrieve(name, oid, opts)
+    data = api.raw_data(src, oid)
     if not data:
         return None
     out_histo = build_histo(data)
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
         
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
+
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
-    
-    return out_histo          
+    return out_histo
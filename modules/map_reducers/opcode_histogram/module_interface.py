@@ -25,17 +25,17 @@ THE SOFTWARE.
 desc = " Calculate a histogram of opcodes"
 name = "opcode_histogram"        
 
-from collections import defaultdict
 import logging
 import api
-from histogram import build_histo, merge_histo
+from histogram import build_histo, merge_histos
 logger = logging.getLogger(name)
 logger.debug("init")
 
 opts_doc = {} 
     
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["opcodes"] }
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
@@ -43,19 +43,19 @@ def mapper(oid, opts, jobid=False):
     if api.documentation(src)["set"]:
         return None
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     opcodes = api.get_field("opcodes", oid, "opcodes")
     if not opcodes: return None
     out_histo = build_histo(opcodes)
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
         
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
+
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
-    return out_histo          
+    return out_histo
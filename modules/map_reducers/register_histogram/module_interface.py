@@ -25,18 +25,18 @@ THE SOFTWARE.
 desc = " Calculate a histogram of the register use of an executable."
 name = "register_histogram"
 
-from collections import defaultdict
 import logging
 import api
 from regs_histo import regs_histo
-from histogram import merge_histo
+from histogram import merge_histos
 logger = logging.getLogger(name)
 logger.debug("init")
 
 opts_doc = {}
  
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True }
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["operands"] }
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
@@ -44,20 +44,20 @@ def mapper(oid, opts, jobid=False):
     if api.documentation(src)["set"]:
         return None
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     operands = api.get_field("operands", oid, "operands")
     if not operands:
         return None
     out_histo = regs_histo(operands)
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
+
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
 
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
     return out_histo
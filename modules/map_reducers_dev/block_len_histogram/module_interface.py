@@ -28,7 +28,7 @@ name = "block_len_histogram"
 import logging
 import api
 
-from histogram import merge_histo
+from histogram import merge_histos
 from collections import defaultdict
 logger = logging.getLogger(name)
 logger.debug("init")
@@ -36,13 +36,14 @@ logger.debug("init")
 opts_doc = {}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["basic_blocks"]}
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
 
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     bbs = api.retrieve("basic_blocks", oid)
     if not bbs:
         return None
@@ -51,16 +52,14 @@ def mapper(oid, opts, jobid=False):
         for bb in bbs[f]:
             out_histo[bb["num_insns"]] += 1
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
+
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
 
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
-            if oid == jobid:
-                return out_histo
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
     return out_histo
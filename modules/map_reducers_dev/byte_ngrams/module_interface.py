@@ -27,8 +27,7 @@ name = "byte_ngrams"
 
 import logging
 import api
-from histogram import build_ngrams, merge_histo
-from collections import defaultdict
+from histogram import build_ngram_histo, merge_histos
 
 logger = logging.getLogger(name)
 logger.debug("init")
@@ -44,17 +43,17 @@ def mapper(oid, opts, jobid=False):
     if api.documentation(src)["set"]:
         return None
     if api.exists(name, oid, opts):
-        return oid
-    out_histo = build_ngrams(api.retrieve(src, oid, opts)["data"], opts["n"])
+        return api.retrieve(name, oid, opts)
+    out_histo = build_ngram_histo(api.raw_data(src, oid), opts["n"])
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
         
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
+
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
-    return out_histo          
+    return out_histo
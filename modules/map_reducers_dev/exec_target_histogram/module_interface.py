@@ -28,7 +28,7 @@ name = "exec_target_histogram"
 import logging
 import api
 
-from histogram import merge_histo
+from histogram import merge_histo, merge_histos
 from collections import defaultdict
 logger = logging.getLogger(name)
 logger.debug("init")
@@ -36,13 +36,14 @@ logger.debug("init")
 opts_doc = {}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["function_extract"]}
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
 
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     functions = api.retrieve("function_extract", oid)
     if not functions:
         return None
@@ -51,17 +52,15 @@ def mapper(oid, opts, jobid=False):
         l = calls(functions[f])
         out_histo = merge_histo(out_histo, l)
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
+
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
 
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
-            if oid == jobid:
-                return out_histo
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
     return out_histo
 
@@ -27,15 +27,15 @@ name = "opcode_ngrams"
 
 import logging
 import api
-from histogram import build_ngrams, merge_histo
-from collections import defaultdict
+from histogram import build_ngram_histo, merge_histos
 logger = logging.getLogger(name)
 logger.debug("init")
 
 opts_doc = {"n":{"type":int, "mangle":True, "default":3}}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["opcodes"]}
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
@@ -44,21 +44,19 @@ def mapper(oid, opts, jobid=False):
     if api.documentation(src)["set"]:
         return None
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     opcodes = api.get_field("opcodes", oid, "opcodes")
     if not opcodes: return None
-    out_histo = build_ngrams(opcodes, opts["n"])
+    out_histo = build_ngram_histo(opcodes, opts["n"])
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
+
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
 
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
-            if oid == jobid:
-                return out_histo
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
     return out_histo
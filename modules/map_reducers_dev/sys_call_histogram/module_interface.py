@@ -27,7 +27,7 @@ name = "sys_call_histogram"
 
 import logging
 import api
-from histogram import merge_histo
+from histogram import merge_histos
 from collections import defaultdict
 logger = logging.getLogger(name)
 logger.debug("init")
@@ -35,14 +35,15 @@ logger.debug("init")
 opts_doc = {}
 
 def documentation():
-    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True}
+    return {"description":desc, "opts_doc":opts_doc, "set":False, "atomic":True,
+            "deps":["map_calls"]}
 
 def mapper(oid, opts, jobid=False):
     logger.debug("mapper()")
 
     src = api.source(oid)
     if api.exists(name, oid, opts):
-        return oid
+        return api.retrieve(name, oid, opts)
     map_imports = api.get_field("map_calls", oid, "system_calls")
     if not map_imports:
         return None
@@ -50,16 +51,14 @@ def mapper(oid, opts, jobid=False):
     for addr in map_imports:
         out_histo[map_imports[addr]] = out_histo[map_imports[addr]] + 1
     api.store(name, oid, out_histo, opts)
-    return oid
+    return out_histo
+
+def combiner(intermediate_output, opts):
+    logger.debug("combiner()")
+    return merge_histos(intermediate_output)
 
 def reducer(intermediate_output, opts, jobid):
     logger.debug("reducer()")
-    out_histo = defaultdict(int)
-    for oid in intermediate_output:
-        if oid:
-            histo = api.retrieve(name, oid, opts)
-            out_histo = merge_histo(histo, out_histo)
-            if oid == jobid:
-                return out_histo
+    out_histo = merge_histos(intermediate_output)
     api.store(name, jobid, out_histo, opts)
     return out_histo
@@ -42,6 +42,5 @@ def process(oid, opts):
     if len(opts['file_contents']) == 0:
         return True
     logger.debug("Processing file %s", oid)
-    data = {"data":opts["file_contents"]}
-    api.store(name, oid, data, opts)
-    return True
+    # The contents are kept raw so consumers can map them with api.raw_data
+    return api.store_raw(name, oid, opts["file_contents"])
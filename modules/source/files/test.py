@@ -43,3 +43,12 @@ class files_test(unittest.TestCase):
                 data = ds['data']
                 self.assertEqual(data, file_contents, "Imported and stored file contents not equal")
 
+    def test_raw_data(self):
+        sample_file = os.path.join(self.oxide.config.dir_sample_dataset, "bash")
+        oid, new_file = self.oxide.import_file(sample_file)
+        fd = file(sample_file, 'rb')
+        file_contents = fd.read()
+        fd.close()
+        data = self.oxide.raw_data("files", oid)
+        self.assertEqual(len(data), len(file_contents), "Raw data length mismatch")
+        self.assertEqual(data[4096:8192], file_contents[4096:8192], "Raw data slice mismatch")
@@ -45,13 +45,7 @@ def membership(args, opts):
     exclude_cids = [oid for oid in valid if api.exists("collections", oid)]
     main_oids = set(api.expand_oids(valid))
         
-    membership_cids = {}
-    cids = [cid for cid in api.collection_cids() if cid not in exclude_cids]
-    for cid in cids:
-        this_oids = set(api.expand_oids(cid))
-        this_intersection = list(main_oids.intersection(this_oids))
-        if this_intersection:
-            membership_cids[cid] = this_intersection
+    membership_cids = api.get_memberships(main_oids, exclude_cids)
             
     if "noprint" not in opts:
         print_membership(membership_cids)
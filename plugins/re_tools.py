@@ -895,7 +895,7 @@ def get_fbreaks(funcs):
 def print_disassembly(oid, disasm, comments, f_breaks, start, stop, height=default_height):
     if not disasm:
         return
-    if isinstance(disasm, dict):
+    if isinstance(disasm, oshell.dict_type): # dict or insn_table
         keys = disasm.keys()
         keys.sort()
         h=1
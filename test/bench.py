@@ -0,0 +1,274 @@
+"""
+Copyright (c) 2014 Sandia Corporation.
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation,
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os, sys, json, math, time, shutil, hashlib, platform, optparse, subprocess, cPickle, _path_magic
+import core.oxide as oxide
+
+BENCH_TYPES = ["source", "extractors", "map_reducers", "analyzers"]
+PERCENTILES = (50, 90, 99)
+THRESHOLD   = 0.2 # fraction slower than the baseline that is flagged as a regression
+
+# Each module is run over the corpus twice over: cold, in a datastore that
+# holds only the imported corpus, so it computes everything it depends on,
+# and warm, again in the same process once everything is stored and cached.
+# Extractors, analyzers and sources are retrieved one oid at a time so each
+# oid has a latency; map reducers are retrieved over the whole corpus and
+# the latency of an oid is that of its mapper, taken from a trace. Every run
+# is appended to the history, and compared to the baseline when that was
+# taken over the same corpus.
+
+def corpus_id(oids):
+    return hashlib.sha1(",".join(sorted(oids))).hexdigest()
+
+def reset_datastore(corpus, db_dir):
+    """ Start an empty datastore at db_dir and import the corpus into it as
+        the collection "bench". Returns (oids, seconds the import took).
+    """
+    oxide.datastore.datastore_dir = db_dir
+    oxide.config.dir_datastore = db_dir
+    if os.path.isdir(db_dir):
+        shutil.rmtree(db_dir)
+    oxide.sys_utils.assert_dir_exists(db_dir)
+    oxide.cache_clear()
+    oxide.datastore.cleanup_state()
+    oxide.importer.cleanup_state()
+    oxide.catalog.cleanup_state()
+    oxide.tags.cleanup_state()
+    oxide.metrics.cleanup_state()
+    start = time.time()
+    oids, new_files = oxide.import_directory(corpus)
+    seconds = time.time() - start
+    if oids:
+        oxide.create_collection("bench", oids)
+    oxide.cache_clear()
+    return sorted(oids or []), seconds
+
+def bench_oids(mod_type, mod_name, oids):
+    """ Source modules are run over what they hold, e.g. the cid of "bench" """
+    if mod_type == "source":
+        return sorted(oxide.retrieve_all_keys(mod_name) or [])
+    return oids
+
+def result_size(result):
+    try:
+        return len(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL))
+    except (cPickle.PicklingError, TypeError):
+        return 0
+
+def run_module(mod_type, mod_name, oids, trace_path):
+    """ Run mod_name over oids once. Returns (seconds, latency of each oid,
+        bytes of the results pickled)
+    """
+    if mod_type == "map_reducers":
+        oxide.start_trace(trace_path)
+        try:
+            start = time.time()
+            result = oxide.retrieve(mod_name, oids)
+            seconds = time.time() - start
+        finally:
+            spans = oxide.stop_trace()
+        mapper = mod_name + ".mapper"
+        latencies = [ s["duration"] for s in spans if s["stack"][-1] == mapper ]
+        return seconds, latencies, result_size(result)
+
+    latencies, size = [], 0
+    for oid in oids:
+        start = time.time()
+        result = oxide.retrieve(mod_name, oid)
+        latencies.append(time.time() - start)
+        size += result_size(result)
+    return sum(latencies), latencies, size
+
+def percentile(values, p):
+    """ Nearest rank percentile of values """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(p / 100. * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def summarize(runs, num_oids):
+    """ Best time of runs and the percentiles of all of their latencies """
+    seconds = min( r[0] for r in runs )
+    latencies = [ l for r in runs for l in r[1] ]
+    summary = {"seconds":seconds, "throughput":num_oids / max(seconds, 1e-9),
+               "result_bytes":runs[0][2]}
+    for p in PERCENTILES:
+        summary["p%d" % p] = percentile(latencies, p)
+    return summary
+
+def bench_module(mod_type, mod_name, corpus, db_dir, repeat):
+    oids, seconds = reset_datastore(corpus, db_dir)
+    oid_list = bench_oids(mod_type, mod_name, oids)
+    if not oid_list:
+        return None
+    trace_path = os.path.join(oxide.config.dir_scratch, "bench_trace")
+    cold = run_module(mod_type, mod_name, oid_list, trace_path)
+    warm = [ run_module(mod_type, mod_name, oid_list, trace_path) for i in xrange(repeat) ]
+    return {"type":mod_type, "oids":len(oid_list),
+            "cold":summarize([cold], len(oid_list)),
+            "warm":summarize(warm, len(oid_list))}
+
+def bench(corpus, mod_types, mod_names=None, repeat=3):
+    """ Returns a run: what it was run on and the results of each module """
+    db_dir = os.path.join(oxide.config.dir_scratch, "bench_db")
+    oids, import_seconds = reset_datastore(corpus, db_dir)
+    run = {"time":time.time(), "host":platform.node(), "commit":git_commit(),
+           "backend":oxide.config.datastore_backend, "multiproc":oxide.config.multiproc_on,
+           "corpus":{"dir":os.path.abspath(corpus), "oids":len(oids), "id":corpus_id(oids)},
+           "import":{"seconds":import_seconds, "throughput":len(oids) / max(import_seconds, 1e-9)},
+           "modules":{}}
+    try:
+        for mod_type in mod_types:
+            for mod_name in sorted(oxide.modules_list(mod_type)):
+                if mod_names and mod_name not in mod_names:
+                    continue
+                if oxide.options.get_schema(mod_name).missing:
+                    continue # Needs options that only a caller can give, e.g. collections_meta
+                print "  - Benchmarking %s %s" % (mod_type, mod_name)
+                try:
+                    result = bench_module(mod_type, mod_name, corpus, db_dir, repeat)
+                except Exception, err:
+                    print "    Failed: %s" % err
+                    result = {"type":mod_type, "error":str(err)}
+                if result:
+                    run["modules"][mod_name] = result
+    finally:
+        if os.path.isdir(db_dir):
+            shutil.rmtree(db_dir)
+    return run
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=_path_magic.oxide_dir,
+                                       stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def regressions(baseline, run, threshold=THRESHOLD):
+    """ Returns a line for each module whose throughput or p90 latency, cold
+        or warm, is more than threshold worse than in the baseline. Runs over
+        a different corpus are not compared.
+    """
+    if baseline["corpus"]["id"] != run["corpus"]["id"]:
+        return []
+    lines = []
+    for mod_name, result in sorted(run["modules"].iteritems()):
+        base = baseline["modules"].get(mod_name)
+        if not base or "error" in base or "error" in result:
+            continue
+        for state in ("cold", "warm"):
+            old, new = base[state], result[state]
+            if new["throughput"] < old["throughput"] * (1 - threshold):
+                lines.append("%s %s throughput %.2f -> %.2f oids/s" % (mod_name, state,
+                             old["throughput"], new["throughput"]))
+            if old["p90"] and new["p90"] and new["p90"] > old["p90"] * (1 + threshold):
+                lines.append("%s %s p90 latency %.2f -> %.2f ms" % (mod_name, state,
+                             old["p90"] * 1000, new["p90"] * 1000))
+    return lines
+
+def load_json(path, default=None):
+    if not os.path.isfile(path):
+        return default
+    fd = open(path)
+    try:
+        return json.load(fd)
+    finally:
+        fd.close()
+
+def save_json(path, data):
+    oxide.sys_utils.assert_dir_exists(os.path.dirname(os.path.abspath(path)))
+    fd = open(path, "w")
+    try:
+        json.dump(data, fd, indent=1, sort_keys=True)
+    finally:
+        fd.close()
+
+def print_run(run):
+    print "  Corpus %s: %d oids, imported at %.2f oids/s" % (run["corpus"]["dir"],
+          run["corpus"]["oids"], run["import"]["throughput"])
+    print "  %-12s %-28s %6s %10s %10s %9s %9s %9s %10s" % ("type", "module", "oids",
+          "cold oid/s", "warm oid/s", "p50 ms", "p90 ms", "p99 ms", "result KB")
+    for mod_name, result in sorted(run["modules"].iteritems()):
+        if "error" in result:
+            print "  %-12s %-28s %s" % (result["type"], mod_name, result["error"])
+            continue
+        cold, warm = result["cold"], result["warm"]
+        ms = [ "%9.2f" % (cold[p] * 1000) if cold[p] is not None else "%9s" % "-"
+               for p in ("p50", "p90", "p99") ]
+        print "  %-12s %-28s %6d %10.2f %10.2f %s %10.1f" % (result["type"], mod_name,
+              result["oids"], cold["throughput"], warm["throughput"], " ".join(ms),
+              cold["result_bytes"] / 1024.)
+
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser()
+    parser.add_option("-d", "--corpus", action="store", dest="corpus",
+                        default=os.path.join(oxide.config.dir_datasets, "sample_dataset"),
+                        help="Directory of files to benchmark over")
+    parser.add_option("-t", "--type", action="append", dest="types",
+                        help="Only benchmark modules of this type (may be repeated)")
+    parser.add_option("-m", "--module", action="append", dest="modules",
+                        help="Only benchmark this module (may be repeated)")
+    parser.add_option("-r", "--repeat", action="store", type=int, dest="repeat", default=3,
+                        help="Warm runs per module, the best one is kept")
+    parser.add_option("-H", "--history", action="store", dest="history",
+                        default=os.path.join(oxide.config.dir_scratch, "bench_history.json"),
+                        help="JSON file each run is appended to")
+    parser.add_option("-b", "--baseline", action="store", dest="baseline",
+                        default=os.path.join(oxide.config.dir_scratch, "bench_baseline.json"),
+                        help="JSON file of the run to compare against")
+    parser.add_option("-s", "--save-baseline", action="store_true", dest="save_baseline",
+                        help="Make this run the baseline")
+    parser.add_option("--threshold", action="store", type=float, dest="threshold", default=THRESHOLD,
+                        help="Fraction slower than the baseline that is a regression")
+    (options, args) = parser.parse_args()
+
+    mod_types = options.types or BENCH_TYPES
+    for mod_type in mod_types:
+        if mod_type not in BENCH_TYPES:
+            parser.error("Unknown module type %s, expected one of %s" % (mod_type, BENCH_TYPES))
+    if not os.path.isdir(options.corpus):
+        parser.error("Corpus %s is not a directory" % options.corpus)
+
+    run = bench(options.corpus, mod_types, options.modules, options.repeat)
+    print_run(run)
+    history = load_json(options.history, [])
+    history.append(run)
+    save_json(options.history, history)
+    print "  - Appended to %s" % options.history
+
+    baseline = load_json(options.baseline)
+    if options.save_baseline or not baseline:
+        save_json(options.baseline, run)
+        print "  - Saved baseline %s" % options.baseline
+    elif baseline["corpus"]["id"] != run["corpus"]["id"]:
+        print "  - Baseline %s is of another corpus, not compared" % options.baseline
+    else:
+        lines = regressions(baseline, run, options.threshold)
+        for line in lines:
+            print "  REGRESSION: " + line
+        if lines:
+            sys.exit(1)
+        print "  - No regressions against %s" % options.baseline
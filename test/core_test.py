@@ -22,7 +22,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import os, sys, shutil, unittest, _path_magic
+import os, sys, time, shutil, unittest, _path_magic
 import core.oxide as oxide
 mod_types = os.listdir(oxide.config.dir_modules)
 
@@ -35,6 +35,12 @@ class core_test(unittest.TestCase):
         if os.path.isdir(oxide.datastore.datastore_dir):
             shutil.rmtree(oxide.datastore.datastore_dir)
         oxide.sys_utils.assert_dir_exists(oxide.datastore.datastore_dir)
+        oxide.cache_clear()
+        oxide.datastore.cleanup_state()
+        oxide.importer.cleanup_state()
+        oxide.catalog.cleanup_state()
+        oxide.tags.cleanup_state()
+        oxide.metrics.cleanup_state()
         self.failUnless(oxide.get_set_names() == {}, "Collection dict is not empty.")
          
     def tearDown(self):
@@ -72,6 +78,188 @@ class core_test(unittest.TestCase):
         fail_msg = "Not able to import directory", d
         self.assertNotEqual(oxide.import_directory(d), (None, 0), fail_msg)
     
+    def test_import_pipeline(self):
+        """ Assert that a threaded import matches a serial one and stores nothing twice """
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        threads = oxide.config.file_import_threads
+        try:
+            oxide.config.file_import_threads = 4
+            oids, new_files = oxide.import_directory(d)
+            oxide.config.file_import_threads = 1
+            serial_oids, serial_new = oxide.import_directory(d)
+        finally:
+            oxide.config.file_import_threads = threads
+        self.assertEqual((sorted(serial_oids), serial_new), (sorted(oids), 0), "Threaded import mismatch.")
+        self.assertEqual(new_files, len(oids), "Duplicate file counted as new.")
+        for oid in oids:
+            data = oxide.retrieve("files", oid)["data"]
+            self.assertEqual(oxide.get_oid_from_data(data), oid, "Stored contents do not match oid.")
+
+    def test_worker_pool(self):
+        """ Assert that the worker pool is reused across calls and writes to the current datastore """
+        if not hasattr(oxide, "mp"):
+            return
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        func = oxide.initialized_modules["src_type"].process
+        oxide.mp.multi_map(func, oids, {})
+        pool = oxide.mp.pool
+        oxide.mp.multi_map(func, oids, {})
+        self.assertTrue(pool is oxide.mp.pool, "Worker pool was not reused.")
+        found = oxide.exists_many("src_type", oids)
+        self.assertTrue(all(found.values()), "Workers did not store their results.")
+
+    def test_tree_combine(self):
+        """ Assert that partial map-reduce results combined in a tree add up """
+        if not hasattr(oxide, "mp"):
+            return
+        combiner = oxide.initialized_modules["byte_histogram"].combiner
+        partials = [ {i % 10:1} for i in xrange(50) ]
+        combined = oxide.mp.tree_combine(combiner, partials, {}, oxide.mp.new_call())
+        self.assertEqual(dict(combined), dict.fromkeys(range(10), 5), "Combined histogram mismatch.")
+
+    def test_distrib_batches(self):
+        """ Assert that distributed batches cover every oid once and that dead nodes lose their oids """
+        if not hasattr(oxide, "mp"):
+            return
+        sizes = dict( ("oid%d" % i, i + 1) for i in xrange(100) )
+        sizes["big"] = sum(sizes.values())
+        batches = oxide.mp.make_batches(sizes, 2)
+        self.assertEqual(sorted(oid for b in batches for oid in b), sorted(sizes), "Batches do not cover the oids.")
+        self.assertEqual(batches[0], ["big"], "Biggest sample not in a batch of its own first.")
+        self.assertTrue(len(batches) >= oxide.mp.DISTRIB_BATCHES_PER_NODE, "Too few batches.")
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        self.assertFalse(oxide.mp.multi_map_distrib([("127.0.0.1", 1)], "src_type", oids), "Dead node reported success.")
+        self.assertTrue(oxide.mp.distrib_stats[0].dropped, "Dead node not dropped.")
+
+    def test_distrib_requeue(self):
+        """ Assert that a batch that fails on one node is done by an idle node that was waiting on it """
+        if not hasattr(oxide, "mp"):
+            return
+        import threading, Queue
+        mp = oxide.mp
+        class fake_proxy:
+            def __init__(self, port):
+                self.port = port
+            def missing_samples(self, oid_list):
+                return []
+            def process(self, mod_name, oid_list, opts, force):
+                time.sleep(0.3)
+                if self.port == 1:
+                    raise IOError("node down")
+        get_proxy, node_slots = mp.get_proxy, mp._node_slots
+        mp.get_proxy = lambda ip, port, wrapped=False: fake_proxy(port)
+        mp._node_slots = lambda node: 1
+        try:
+            nodes = [ mp.node_stats("127.0.0.1", port) for port in (1, 2) ]
+            queues = dict( (n.name, Queue.Queue()) for n in nodes )
+            queues[None] = Queue.Queue()
+            queues[nodes[0].name].put((["abc"], set()))
+            state = {"lock":threading.Lock(), "inflight":0, "lost":0, "sizes":{"abc":1}}
+            p = mp.progress(1)
+            threads = [ threading.Thread(target=mp._distrib_node,
+                                         args=(n, nodes, queues, "test", {}, False, p, state))
+                        for n in nodes ]
+            for t in threads:
+                t.daemon = True
+            threads[0].start()
+            while not state["inflight"]: # The failing node has the batch before the idle one looks
+                time.sleep(0.01)
+            threads[1].start()
+            for t in threads:
+                t.join(10)
+            self.assertFalse(any( t.is_alive() for t in threads ), "Node left waiting on a requeued batch.")
+            self.assertEqual((state["lost"], nodes[1].oids), (0, 1), "Requeued batch not done by the idle node.")
+        finally:
+            mp.get_proxy, mp._node_slots = get_proxy, node_slots
+
+    def test_node_slots(self):
+        """ Assert that a compute node is asked for its idle CPUs once, and again after a failure """
+        if not hasattr(oxide, "mp"):
+            return
+        mp = oxide.mp
+        asked = []
+        class fake_proxy:
+            def load(self):
+                asked.append(1)
+                return 4, 1.
+        get_proxy = mp.get_proxy
+        mp.get_proxy = lambda ip, port, wrapped=False: fake_proxy()
+        try:
+            node = mp.node_stats("127.0.0.1", 1)
+            self.assertEqual([ mp._node_slots(node) for i in xrange(5) ], [3] * 5)
+            self.assertEqual(len(asked), 1, "Node asked for its slots on every batch.")
+            node.slots = None # As after a failed batch
+            mp._node_slots(node)
+            node.slots_time -= mp.DISTRIB_SLOTS_TTL + 1
+            mp._node_slots(node)
+            self.assertEqual(len(asked), 3, "Node slots not refreshed.")
+        finally:
+            mp.get_proxy = get_proxy
+
+    def test_binary_timeouts(self):
+        """ Assert that the binary transport times out on silent peers and
+            reports calls that could not be sent
+        """
+        import server, client, socket, threading, cPickle
+        functions = {"alive":lambda: True, "sleep":time.sleep}
+        s = server.BinaryServer(("127.0.0.1", 0), functions, 0.5)
+        t = threading.Thread(target=s.serve_forever, args=(0.1,))
+        t.daemon = True
+        t.start()
+        try:
+            ip, port = s.server_address
+            idle = socket.create_connection((ip, port))
+            idle.settimeout(10)
+            start = time.time()
+            self.assertEqual(idle.recv(1), "", "Silent client not dropped.")
+            self.assertTrue(time.time() - start < 5)
+            idle.close()
+            p = client.binary_proxy(ip, port, 0.5)
+            self.assertRaises(socket.timeout, p.sleep, 2)
+            self.assertTrue(p.alive(), "Proxy not reconnected after a timeout.")
+            self.assertRaises(cPickle.PicklingError, p.pipeline,
+                              [("alive", (), {}), ("sleep", (lambda: 0,), {})])
+            self.assertTrue(p.alive(), "Proxy not reconnected after a failed send.")
+            p.close()
+        finally:
+            s.shutdown()
+            s.server_close()
+
+    def test_sample_cache(self):
+        """ Assert that samples sent to a compute node are checked, stored and evicted least recently used first """
+        from core import sample_cache
+        samples = dict( (oxide.get_oid_from_data(c * 1048576), c * 1048576) for c in "abc" )
+        oids = sorted(samples)
+        self.assertEqual(sorted(sample_cache.missing_samples(oids)), oids, "Samples not reported missing.")
+        self.assertEqual(sample_cache.cache_samples({oids[0]:"wrong"}), 0, "Sample that does not match its oid cached.")
+        self.assertEqual(sample_cache.cache_samples(samples), 3, "Samples not cached.")
+        self.assertEqual(oxide.raw_data("files", oids[0])[:], samples[oids[0]], "Cached sample mismatch.")
+        self.assertEqual(sample_cache.evict(2, keep=[oids[0]]), 1, "Cache not evicted down to size.")
+        missing = sample_cache.missing_samples(oids)
+        self.assertEqual(len(missing), 1, "Evicted sample still found.")
+        self.assertTrue(oids[0] not in missing, "Kept sample evicted.")
+
+    def test_scheduler(self):
+        """ Assert that declared dependencies are scheduled after their own dependencies and stored """
+        if not hasattr(oxide, "mp"):
+            return
+        stages = oxide.scheduler.get_stages("opcode_histogram")
+        done = set()
+        for stage in stages:
+            for mod in stage:
+                for dep in oxide.scheduler.get_deps(mod):
+                    if oxide.get_mod_type(dep) in oxide.scheduler.RUN_TYPES:
+                        self.assertTrue(dep in done, "%s scheduled before %s" % (mod, dep))
+            done.update(stage)
+        self.assertTrue("opcodes" in done and "src_type" in done, "Dependencies missing from the stages.")
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        oxide.scheduler.schedule("opcode_histogram", oids)
+        found = oxide.exists_many("src_type", oids)
+        self.assertTrue(all(found.values()), "Scheduled stage was not stored.")
+
     def test_create_collection(self):
         """ Assert that a collection can be created """
         oid_list = ["abc"]
@@ -84,6 +272,101 @@ class core_test(unittest.TestCase):
         cid_n = oxide.get_cid_from_name(col_name)
         self.failUnlessEqual(cid_l, cid_n, "cid collection name mismatch.")
 
+    def test_collection_catalog(self):
+        """ Assert that the catalog follows collection changes and is rebuilt """
+        oid_list = ["abc", "def"]
+        for oid in oid_list:
+            oxide.store("files", oid, {"xyz":"lmn"}, {})
+        self.assertTrue(oxide.create_collection("test", oid_list, "notes"))
+        cid = oxide.get_cid_from_name("test")
+        self.assertTrue(oxide.rename_collection_by_name("test", "renamed"))
+        self.assertEqual(oxide.collection_names(), ["renamed"])
+        self.assertTrue(oxide.prune_collection_by_name("renamed", ["def"]))
+        cid = oxide.get_cid_from_name("renamed")
+        self.assertEqual(oxide.get_collection_info("renamed", "")["num_files"], 1)
+        self.assertTrue(oxide.create_collection("other", oid_list))
+        other = oxide.get_cid_from_name("other")
+        self.assertEqual(oxide.get_memberships(oid_list), {cid:["abc"], other:oid_list})
+        oxide.catalog.reset(oxide.datastore.datastore_dir)
+        self.assertEqual(oxide.get_memberships(["def"]), {other:["def"]}, "Members not rebuilt.")
+        oxide.flush_oid(other)
+        self.assertEqual(oxide.get_set_names(), {cid:"renamed"}, "Catalog not rebuilt.")
+        self.assertTrue(oxide.delete_collection_by_name("renamed"))
+        self.assertEqual(oxide.collection_cids(), [])
+        index_file = os.path.join(oxide.datastore.datastore_dir, oxide.catalog.index.index_file)
+        key = oxide.sys_utils.stat_key(index_file)
+        self.assertTrue(oxide.create_collection("again", oid_list))
+        self.assertEqual(oxide.sys_utils.stat_key(index_file), key, "Catalog rewritten for a change.")
+        journal = os.path.join(oxide.datastore.datastore_dir, oxide.catalog.index.journal_file)
+        size = os.path.getsize(journal)
+        self.assertTrue(oxide.catalog.discard(oxide.datastore.datastore_dir, "abc"))
+        self.assertEqual(os.path.getsize(journal), size, "Plain oid discarded from the catalog.")
+
+    def test_catalog_concurrent(self):
+        """ Assert that catalog updates from two processes are all kept """
+        index_dir = oxide.datastore.datastore_dir
+        meta = {"name":"", "num_oids":1, "notes":""}
+        oxide.catalog.get_catalog(index_dir)
+        pid = os.fork()
+        prefix = "child" if pid == 0 else "parent"
+        for i in xrange(30):
+            meta["name"] = "%s%d" % (prefix, i)
+            oxide.catalog.add(index_dir, meta["name"], meta, [prefix])
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        oxide.catalog.cleanup_state()
+        cids, names = oxide.catalog.get_catalog(index_dir)
+        self.assertEqual(len(cids), 60, "Catalog lost an update.")
+        self.assertEqual(len(oxide.catalog.get_members(index_dir)["child"]), 30)
+        oxide.catalog.reset(index_dir)
+
+    def test_source_map(self):
+        """ Assert that sources are remembered and forgotten on flush """
+        oxide.store("files", "abc", {"xyz":"lmn"}, {})
+        self.assertEqual(oxide.source_map.get("abc"), "files", "Store did not record the source.")
+        oxide.cache_clear()
+        self.assertEqual(oxide.sources(["abc", "def"]), {"abc":"files", "def":None})
+        self.assertEqual(oxide.source_map, {"abc":"files"})
+        oxide.flush_oid("abc")
+        self.assertEqual(oxide.source("abc"), None)
+        for lookup in (oxide.source, lambda oid: oxide.sources([oid])[oid]):
+            oxide.store("files", "abc", {"xyz":"lmn"}, {})
+            oxide.datastore.delete_oid_data("files", "abc") # As another process would
+            self.assertEqual(lookup("abc"), None, "Stale source returned.")
+            self.assertFalse("abc" in oxide.source_map)
+
+    def test_tag_index(self):
+        """ Assert that tag and time filters answer from the tag index """
+        oid_list = ["abc", "def", "ghi"]
+        for oid in oid_list:
+            oxide.store("files", oid, {"xyz":"lmn"}, {})
+        oxide.apply_tags(oid_list, {"color":"red", "seen_time":time.mktime((2012,3,4,5,0,0,0,0,-1))})
+        oxide.apply_tags("def", {"color":["blue", "green"], "seen_time":time.mktime((2013,3,4,5,0,0,0,0,-1))})
+        self.assertEqual(oxide.tag_filter(oid_list, "color", "red"), ["abc", "ghi"])
+        self.assertEqual(oxide.tag_filter(None, "color", "green"), ["def"])
+        oxide.apply_tags("jkl", {"color":"green"}) # Neither a file nor a collection
+        self.assertEqual(oxide.tag_filter(None, "color", "green"), ["def"])
+        self.assertEqual(oxide.tag_filter(["jkl"], "color", "green"), ["jkl"])
+        self.assertTrue(oxide.create_collection("tagged", ["abc"]))
+        cid = oxide.get_cid_from_name("tagged")
+        oxide.apply_tags(cid, {"color":"green"})
+        self.assertEqual(oxide.tag_filter(None, "color", "green"), ["def", cid])
+        oxide.tags.cleanup_state() # As another process would, from the journal
+        self.assertEqual(oxide.time_filter(oid_list, 2012), ["abc", "ghi"])
+        self.assertEqual(oxide.time_filter(oid_list, 2013, 3, 4), ["def"])
+        self.assertEqual(oxide.time_filter(oid_list, mon=3, day=4), oid_list)
+        self.assertEqual(oxide.time_filter(oid_list, 2013, 4), [], "Year alone matched.")
+        self.assertEqual(oxide.time_filter(oid_list, 2012, day=4), ["abc", "ghi"])
+        self.assertEqual(oxide.time_filter(oid_list, mon=3, day=5), [], "Month alone matched.")
+        self.assertEqual(oxide.time_filter(oid_list, day=4), oid_list)
+        self.assertTrue(oxide.tags.index.fold(oxide.datastore.datastore_dir))
+        oxide.flush_oid("ghi")
+        oxide.tags.cleanup_state()
+        self.assertEqual(oxide.tag_filter(None, "color", "red"), ["abc"])
+        oxide.flush_module("tags")
+        self.assertEqual(oxide.tag_filter(oid_list, "color"), [], "Index not rebuilt.")
+
     def test_documentation(self):
         """  Assert that documentation can be retrieved for each imported module """
         mods = oxide.modules_list()
@@ -103,6 +386,129 @@ class core_test(unittest.TestCase):
                     fail_msg = "opts_doc for module %s missing key %s." % (mod, opts_key)
                     self.assertTrue(opts_doc[opt].has_key(opts_key), fail_msg)
           
+    def test_progress(self):
+        """ Assert that progress counts batched ticks and reports its rate """
+        p = oxide.progress.progress(10, name="test_progress")
+        p.tick(4)
+        stats = oxide.progress_stats()["test_progress"]
+        self.assertEqual((stats["count"], stats["total"], stats["done"]), (4, 10, False))
+        self.assertTrue(stats["rate"] > 0 and stats["eta"] >= 0)
+        p.tick(6)
+        self.assertTrue(oxide.progress_stats()["test_progress"]["done"], "Finished run not done.")
+        del oxide.progress.runs["test_progress"]
+
+    def test_metrics(self):
+        """ Assert that module calls are recorded per module and src_type """
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        oxide.process("src_type", oids)
+        entries = oxide.metrics_stats("src_type")
+        self.assertEqual(sum( e["calls"] for e in entries.values() ), len(oids))
+        for (mod_name, src_type, kind), e in entries.items():
+            self.assertEqual((mod_name, kind), ("src_type", "process"))
+            self.assertNotEqual(src_type, "unknown", "src_type not resolved.")
+            self.assertEqual(sum( c for b, c in e["histogram"] ), e["calls"])
+            self.assertTrue(e["read"] > 0 and e["written"] > 0, "Datastore bytes not counted.")
+            self.assertTrue(set( oid for t, oid in e["slowest"] ) <= set(oids))
+        oxide.metrics.cleanup_state() # As another process would, from the journal
+        self.assertEqual(oxide.metrics_stats("src_type"), entries)
+        self.assertTrue(oxide.metrics.index.fold(oxide.datastore.datastore_dir))
+        oxide.metrics.cleanup_state()
+        self.assertEqual(oxide.metrics_stats("src_type"), entries)
+
+    def test_metrics_worker(self):
+        """ Assert that workers forked by a module call do not inherit the call in progress """
+        if not hasattr(oxide, "mp"):
+            return
+        oxide.mp.shutdown()
+        pool = oxide.call_module("test", "results", None, oxide.mp.get_pool)
+        self.assertEqual(pool.apply(eval, ("__import__('metrics').depth",)), 0, "Worker will never flush.")
+        self.assertEqual(oxide.metrics.depth, 0)
+
+    def test_metrics_pool(self):
+        """ Assert that pool workers hand their metrics to the parent instead of
+            writing the journal per task
+        """
+        if not hasattr(oxide, "mp"):
+            return
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        oxide.metrics.reset(oxide.datastore.datastore_dir)
+        oxide.mp.multi_map(oxide.initialized_modules["src_type"].process, oids, {})
+        journal = os.path.join(oxide.datastore.datastore_dir, oxide.metrics.index.journal_file)
+        self.assertFalse(os.path.exists(journal), "Workers wrote the journal.")
+        self.assertEqual(len(oxide.metrics.pending[oxide.datastore.datastore_dir]), len(oids))
+        entries = oxide.metrics_stats("src_type")
+        self.assertEqual(sum( e["calls"] for e in entries.values() ), len(oids))
+
+    def test_tracer(self):
+        """ Assert that nested module calls are traced and exported """
+        d = os.path.join(oxide.config.dir_datasets, "sample_dataset")
+        oids, new_files = oxide.import_directory(d)
+        oxide.start_trace(os.path.join(oxide.config.dir_scratch, "test_trace"))
+        oxide.retrieve("elf", oids)
+        oxide.retrieve("src_type", oids[0])
+        spans = oxide.stop_trace()
+        self.assertEqual(oxide.stop_trace(), [], "Tracer still on.")
+        stacks = set( s["stack"] for s in spans )
+        # With multiprocessing the scheduler runs src_type in a stage of its own
+        self.assertTrue(any( st[0] == "retrieve elf" and "src_type.process" in st for st in stacks ),
+                        "Dependency not nested under its caller.")
+        last = spans[-1]
+        self.assertEqual((last["stack"], last["status"]), (("retrieve src_type",), "hit"))
+        for s in spans:
+            self.assertTrue(0 <= s["self"] <= s["duration"])
+        folded = oxide.tracer.collapsed(spans).splitlines()
+        self.assertEqual(len(folded), len(stacks))
+        events = oxide.tracer.json.loads(oxide.tracer.chrome(spans))["traceEvents"]
+        self.assertEqual(len(events), len(spans))
+
+    def test_bench_regressions(self):
+        """ Assert that bench flags modules slower than the baseline over the same corpus """
+        import bench
+        self.assertEqual([ bench.percentile(range(1, 11), p) for p in (50, 90, 99) ], [5, 9, 10])
+        def run(throughput, p90, oids=("abc",)):
+            state = {"throughput":throughput, "p90":p90}
+            return {"corpus":{"id":bench.corpus_id(oids)},
+                    "modules":{"test":{"cold":state, "warm":state}}}
+        self.assertEqual(bench.regressions(run(10., .1), run(9., .11)), [])
+        self.assertEqual(len(bench.regressions(run(10., .1), run(5., .2))), 4)
+        self.assertEqual(bench.regressions(run(10., .1), run(5., .2, ("def",))), [])
+
+    def test_module_manifest(self):
+        """ Assert that modules are registered from the manifest and imported on first use """
+        entries = oxide.manifest.load(os.path.join(oxide.config.dir_scratch, oxide.manifest.MANIFEST_FILE))
+        entry = entries.get("files")
+        self.assertTrue(entry and not entry["error"], "Module missing from the manifest.")
+        mtimes = oxide.manifest.module_mtimes(os.path.join(entry["dir"], "files"))
+        libs = oxide.manifest.module_mtimes(oxide.config.dir_libraries)
+        self.assertTrue(oxide.manifest.is_current(entry, "source", entry["dir"], mtimes, libs))
+        libs["changed.py"] = 0.
+        self.assertFalse(oxide.manifest.is_current(entry, "source", entry["dir"], mtimes, libs),
+                         "Library change not noticed.")
+        self.assertEqual(oxide.documentation("files"), entry["doc"])
+        lazy = oxide.manifest.lazy_modules(lambda m: m.upper())
+        dict.__setitem__(lazy, "abc", None)
+        self.assertFalse(lazy.loaded("abc"))
+        self.assertEqual(lazy["abc"], "ABC")
+
+    def test_option_schema(self):
+        """ Assert that the compiled option schema matches the opts_doc """
+        opts_doc = {"b":{"type":str, "mangle":True, "default":"x"}, "n":{"type":int, "mangle":True, "default":3},
+                    "v":{"type":bool, "mangle":False, "default":None}}
+        schema = oxide.options.compile_schema("test_schema", {"opts_doc":opts_doc})
+        try:
+            self.assertEqual(schema.mangles, ("b", "n"))
+            opts = {"n":"4", "v":True}
+            self.assertTrue(oxide.options.validate_opts("test_schema", opts))
+            self.assertEqual(oxide.options.build_suffix("test_schema", opts), "x=4")
+            self.assertEqual(oxide.options.parse_suffix("test_schema", "x=4"), {"b":"x", "n":4})
+            self.assertFalse(oxide.options.validate_opts("test_schema", {"n":"four", "v":True}))
+            self.assertFalse(oxide.options.validate_opts("test_schema", {}), "Missing required option passed.")
+            self.assertTrue(oxide.options.validate_opts("test_schema", {}, only_mangle=True))
+        finally:
+            del oxide.options.schemas["test_schema"]
+
     def test_store_exists_retrieve_delete(self):
         """ Exercise the oxide functions store, exists, retrieve and delete_data """
         mod_name = "files"
@@ -114,6 +520,167 @@ class core_test(unittest.TestCase):
         self.assertNotEqual(oxide.retrieve(mod_name, oid, opts, lock=False), False, "Retrieve attempt failed.")
         #self.assertNotEqual(oxide.delete_data(mod_name, oid, opts), False, "Delete data attempt failed."
 
+    def test_result_cache(self):
+        """ Assert that retrieve is served from the cache until the data is stored again """
+        mod_name = "files"
+        oid = "abc"
+        oxide.store(mod_name, oid, {"xyz":"lmn"}, {})
+        hits = oxide.cache_stats()["hits"]
+        self.assertEqual(oxide.retrieve(mod_name, oid), {"xyz":"lmn"}, "Retrieve attempt failed.")
+        self.assertEqual(oxide.retrieve(mod_name, oid), {"xyz":"lmn"}, "Cached retrieve attempt failed.")
+        self.assertEqual(oxide.cache_stats()["hits"], hits+1, "Second retrieve was not a cache hit.")
+        oxide.store(mod_name, oid, {"xyz":"opq"}, {})
+        self.assertEqual(oxide.retrieve(mod_name, oid), {"xyz":"opq"}, "Store did not invalidate the cache.")
+
+    def test_existence_index(self):
+        """ Assert that exists sees data stored by this and by other processes """
+        if oxide.datastore.name != "ds_filesystem":
+            return
+        mod_name = "files"
+        self.assertFalse(oxide.datastore.exists(mod_name, "abc"), "Data exists in an empty store.")
+        oxide.store(mod_name, "abc", {"xyz":"lmn"}, {})
+        self.assertTrue(oxide.datastore.exists(mod_name, "abc"), "Stored data not found.")
+        # Simulate a write by another process that bypasses our index
+        fname = os.path.join(oxide.datastore.datastore_dir, mod_name, "def")
+        oxide.sys_utils.write_object_to_file(fname, {"xyz":"opq"})
+        self.assertTrue(oxide.datastore.exists(mod_name, "def"), "Externally stored data not found.")
+
+    def test_store_retrieve_many(self):
+        """ Exercise the batched oxide functions store_many, exists_many and retrieve_many """
+        mod_name = "files"
+        data = {"abc":{"xyz":"lmn"}, "def":{"xyz":"opq"}}
+        self.assertTrue(oxide.store_many(mod_name, data), "Store many attempt failed.")
+        found = oxide.exists_many(mod_name, ["abc", "def", "ghi"])
+        self.assertEqual(found, {"abc":True, "def":True, "ghi":False}, "Exists many mismatch.")
+        results = oxide.retrieve_many(mod_name, ["abc", "def", "ghi"])
+        self.assertEqual(results, {"abc":data["abc"], "def":data["def"], "ghi":None}, "Retrieve many mismatch.")
+        if oxide.datastore.name != "ds_filesystem":
+            return
+        lockid = oxide.datastore.get_lockfilename(mod_name, "abc", {})[0]
+        oxide.datastore.acquire_file_lock(mod_name, "abc", {}, True)
+        try:
+            self.assertEqual(oxide.datastore.retrieve_many(mod_name, ["abc", "def"]), data)
+            self.assertTrue(oxide.datastore.lock_manager.holds(lockid), "Caller's lock released.")
+        finally:
+            oxide.datastore.release_file_lock(mod_name, "abc", {})
+        # Locked retrieves leave out missing and unreadable oids just the same
+        mod_dir = oxide.datastore.get_mod_dir(mod_name)
+        with open(oxide.datastore.get_fullpath(mod_dir, mod_name, "def", {}), "wb") as fd:
+            fd.write("not a stored object")
+        results = oxide.datastore.retrieve_many(mod_name, ["abc", "def", "ghi"], lock=True)
+        try:
+            self.assertEqual(results, {"abc":data["abc"]}, "Locked retrieve many mismatch.")
+            self.assertFalse(oxide.datastore.lock_manager.holds(
+                             oxide.datastore.get_lockfilename(mod_name, "def", {})[0]),
+                             "Lock kept on an oid that was left out.")
+        finally:
+            oxide.datastore.release_file_lock(mod_name, "abc", {})
+
+    def test_lock_manager(self):
+        """ Assert that a lock held by another process blocks and is dropped when it exits """
+        import lock_manager, otypes, multiprocessing
+        if not lock_manager.fcntl:
+            return
+        path = os.path.join(oxide.datastore.datastore_dir, "test.lock")
+        held, done = multiprocessing.Event(), multiprocessing.Event()
+        def hold():
+            lock_manager.acquire(path, "abc", write=True)
+            held.set()
+            done.wait(10)
+            os._exit(0) # Exit without releasing the lock
+        p = multiprocessing.Process(target=hold)
+        p.start()
+        held.wait(10)
+        self.assertRaises(otypes.LockTimeout, lock_manager.acquire, path, "abc", False, 0.05)
+        self.assertTrue(lock_manager.acquire(path, "def"), "Unrelated lock was blocked.")
+        done.set()
+        p.join()
+        self.assertTrue(lock_manager.acquire(path, "abc", timeout=1), "Lock outlived its process.")
+        lock_manager.release_all()
+
+    def test_lock_threads(self):
+        """ Assert that threads wait for each other's locks and that lock ids on
+            the same byte do not release each other
+        """
+        import lock_manager, otypes, threading, zlib, multiprocessing
+        if not lock_manager.fcntl:
+            return
+        path = os.path.join(oxide.datastore.datastore_dir, "test.lock")
+        lock_manager.acquire(path, "abc", write=True)
+        result = []
+        def other(timeout):
+            try:
+                result.append(lock_manager.acquire(path, "abc", False, timeout))
+                lock_manager.release("abc")
+            except otypes.LockTimeout:
+                result.append(False)
+        t = threading.Thread(target=other, args=(0.05,))
+        t.start(); t.join()
+        self.assertEqual(result, [False], "Thread took a lock held by another thread.")
+        t = threading.Thread(target=other, args=(10,))
+        t.start()
+        time.sleep(0.05)
+        lock_manager.release("abc")
+        t.join()
+        self.assertEqual(result, [False, True])
+
+        seen = {}
+        i = 0
+        while True: # Find two lock ids on the same byte
+            lockid = "id%d" % i
+            offset = zlib.crc32(lockid) & 0x7fffffff
+            if offset in seen:
+                break
+            seen[offset] = lockid
+            i += 1
+        lock_manager.acquire(path, seen[offset], write=True)
+        lock_manager.acquire(path, lockid, write=True)
+        lock_manager.release(seen[offset])
+        held = multiprocessing.Event()
+        def probe():
+            lock_manager.cleanup_state()
+            try:
+                lock_manager.acquire(path, lockid, False, 0.05)
+            except otypes.LockTimeout:
+                held.set()
+            os._exit(0)
+        p = multiprocessing.Process(target=probe)
+        p.start(); p.join()
+        lock_manager.release(lockid)
+        self.assertTrue(held.is_set(), "Releasing one lock id dropped the other's byte.")
+
+    def test_sparse_histo(self):
+        """ Assert that sparse n-gram histograms read and merge like the string keyed ones """
+        import histogram
+        data = "\x00\x01,\x00\x01,\x02"
+        opcodes = ["push", "mov", "push", "mov", "call"]
+        for seq in (data, opcodes):
+            expected = histogram.build_ngrams(seq, 2)
+            self.assertEqual(histogram.build_sparse_ngrams(seq, 2), expected, "Sparse n-grams mismatch.")
+            merged = histogram.merge_histos([histogram.build_sparse_ngrams(seq, 2), expected])
+            self.assertEqual(merged, histogram.merge_histo(dict(expected), expected), "Sparse merge mismatch.")
+
+    def test_sqlite_backend(self):
+        """ Exercise the sqlite datastore backend directly """
+        import datastore_sqlite
+        datastore_sqlite.datastore_dir = oxide.datastore.datastore_dir
+        mod_name = "byte_ngrams"
+        oid = "abc"
+        data = {"xyz":"lmn"}
+        opts = {"n":3}
+        self.assertFalse(datastore_sqlite.exists(mod_name, oid, opts), "Data exists in an empty store.")
+        self.assertTrue(datastore_sqlite.store(mod_name, oid, data, opts), "Store attempt failed.")
+        self.assertTrue(datastore_sqlite.exists(mod_name, oid, opts), "Test for data exists failed.")
+        self.assertFalse(datastore_sqlite.exists(mod_name, oid, {"n":4}), "Mangled options ignored.")
+        self.assertEqual(datastore_sqlite.retrieve(mod_name, oid, opts), data, "Retrieve attempt failed.")
+        self.assertEqual(datastore_sqlite.available_data(mod_name), [[oid, opts]], "Available data mismatch.")
+        self.assertEqual(datastore_sqlite.count_records(mod_name), 1, "Record count mismatch.")
+        datastore_sqlite.delete_oid_data(mod_name, oid)
+        self.assertFalse(datastore_sqlite.exists(mod_name, oid, opts), "Delete oid data failed.")
+        self.assertTrue(datastore_sqlite.store_many(mod_name, {oid:data, "def":data}, opts), "Store many attempt failed.")
+        self.assertEqual(datastore_sqlite.exists_many(mod_name, [oid, "ghi"], opts), {oid:True, "ghi":False}, "Exists many mismatch.")
+        self.assertEqual(datastore_sqlite.retrieve_many(mod_name, [oid, "def", "ghi"], opts), {oid:data, "def":data}, "Retrieve many mismatch.")
+
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(core_test)
     unittest.TextTestRunner().run(suite)
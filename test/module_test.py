@@ -33,6 +33,9 @@ def module_test(singlemodule=None):
     if os.path.isdir(oxide.datastore.datastore_dir):
         shutil.rmtree(oxide.datastore.datastore_dir)
     oxide.sys_utils.assert_dir_exists(oxide.datastore.datastore_dir)
+    oxide.cache_clear()
+    oxide.datastore.cleanup_state()
+    oxide.importer.cleanup_state()
 
     # Add module directories to path
     modulesdir = os.listdir(oxide.config.dir_modules)
@@ -48,6 +51,8 @@ def module_test(singlemodule=None):
                     print "Running the %s module test." % (module)
                     sys.path.insert(0,os.path.join(moduletypepath,module)) # Prepend the path
                     class_str = str(module) + ".test"
+                    if module in oxide.initialized_modules:
+                        oxide.initialized_modules[module] # Modules are imported on first use
                     try:
                         mod = __import__(class_str, globals(), locals(), [str(module) + "_test"])
                         try:
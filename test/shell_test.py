@@ -22,7 +22,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import unittest, os, shutil
+import unittest, os, sys, shutil
 import _path_magic
 import core.oshell as oshell
 s = oshell.OxideShell()
@@ -36,6 +36,9 @@ class shell_test(unittest.TestCase):
         if os.path.isdir(s.oxide.datastore.datastore_dir):
             shutil.rmtree(s.oxide.datastore.datastore_dir)
         s.oxide.sys_utils.assert_dir_exists(s.oxide.datastore.datastore_dir)
+        s.oxide.cache_clear()
+        s.oxide.datastore.cleanup_state()
+        s.oxide.importer.cleanup_state()
         self.failUnless(s.oxide.get_set_names() == {}, "Collection dict is not empty.")
 
     def tearDown(self):
@@ -98,6 +101,20 @@ class shell_test(unittest.TestCase):
         if os.path.isfile(test_history):
             os.remove(test_history)
             
+
+    def test_export_twice(self):
+        """ Assert that exporting a file twice does not use up its cached names """
+        s.onecmd("plugin default")
+        default = sys.modules["plugins.default"]
+        oid, new = s.oxide.import_file(os.path.join(s.oxide.config.dir_datasets, "sample_dataset", "ls"))
+        before = set(os.listdir(s.oxide.config.dir_scratch))
+        try:
+            for i in range(2):
+                default.export_files([oid], {"name":"test_export"})
+            self.assertEqual(s.oxide.get_field("file_meta", oid, "names"), set(["ls"]))
+        finally:
+            for f in set(os.listdir(s.oxide.config.dir_scratch)) - before:
+                os.remove(os.path.join(s.oxide.config.dir_scratch, f))
         
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(shell_test)
@@ -84,6 +84,19 @@ class sys_utils_test(unittest.TestCase):
         old_data = unpack_file(new_data)
         self.assertEqual(old_data, test_data)
 
+        # Binary transport frames, one compressed and one spanning frames
+        class sent_frames:
+            frames = []
+            def sendall(self, data):
+                self.frames.append(str(data))
+        from StringIO import StringIO
+        random_data = os.urandom(FRAME_MAX * 2 + 1)
+        for message in [(1, True, test_data), (2, True, random_data)]:
+            sock = sent_frames()
+            sent_frames.frames = []
+            send_message(sock, message)
+            self.assertEqual(recv_message(StringIO("".join(sock.frames))), message)
+
         
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(sys_utils_test)
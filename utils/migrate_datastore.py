@@ -0,0 +1,88 @@
+"""
+Copyright (c) 2014 Sandia Corporation. 
+Under the terms of Contract DE-AC04-94AL85000 with Sandia Corporation, 
+the U.S. Government retains certain rights in this software.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import sys, optparse
+import _path_magic
+import core.oxide as oxide
+import datastore_filesystem, datastore_sqlite
+
+backends = {"filesystem":datastore_filesystem,
+            "sqlite"    :datastore_sqlite}
+
+parser = optparse.OptionParser(usage="%prog [options] <from_backend> <to_backend>")
+parser.add_option("-m", "--module", action="append", dest="modules",
+                    help="Only migrate this module (may be repeated)")
+parser.add_option("-r", "--remove", action="store_true", dest="remove",
+                    help="Remove the data from the source backend after it is copied")
+(options, args) = parser.parse_args()
+
+def migrate_module(src, dst, mod_name, remove=False):
+    """ Copy every record of mod_name from the src backend to the dst backend.
+        Returns the tuple (copied, failed).
+    """
+    copied, failed = 0, 0
+    try:
+        records = src.available_data(mod_name)
+    except oxide.otypes.OxideError, err:
+        print "  - Skipping %s: %s" % (mod_name, err)
+        return copied, failed
+
+    p = oxide.progress.progress(len(records))
+    for oid, opts in records:
+        data = src.retrieve(mod_name, oid, opts)
+        if data is None or not dst.store(mod_name, oid, data, opts):
+            failed += 1
+        else:
+            copied += 1
+        p.tick()
+
+    if remove and not failed:
+        # Raw data has the same layout in every backend and is not copied
+        src.delete_module_data(mod_name, keep_raw=True)
+    return copied, failed
+
+def migrate(src_name, dst_name, mod_list=None, remove=False):
+    src = backends[src_name]
+    dst = backends[dst_name]
+    if not mod_list:
+        mod_list = oxide.modules_list()
+    mod_list.sort()
+    for mod_name in mod_list:
+        if not src.count_records(mod_name):
+            continue
+        print "  Migrating %s from %s to %s" % (mod_name, src_name, dst_name)
+        copied, failed = migrate_module(src, dst, mod_name, remove)
+        print "  %s record(s) copied, %s failed." % (copied, failed)
+
+
+if __name__ == "__main__":
+    if len(args) != 2 or args[0] == args[1]:
+        parser.print_help()
+        sys.exit(1)
+    for b in args:
+        if b not in backends:
+            print "  Unknown backend %s, choose from: %s" % (b, ", ".join(backends))
+            sys.exit(1)
+    migrate(args[0], args[1], options.modules, options.remove)
+    print "  Set [datastore] backend = %s in %s to use the migrated data." % (args[1], oxide.config.config_file)